@@ -19,3 +19,10 @@ from django.apps import AppConfig
 class ChannelsAuthTokenMiddlewaresConfig(AppConfig):
     name = 'channels_auth_token_middlewares'
     verbose_name = 'Channels auth token middlewares'
+
+    def ready(self):
+        from .signals import connect_signals
+        from .warming import start_configured_cache_warming
+
+        connect_signals()
+        start_configured_cache_warming()
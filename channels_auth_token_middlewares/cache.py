@@ -0,0 +1,474 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Token and user caches.
+"""
+
+
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router
+
+
+class LRUCache:
+    """
+    Thread safe bounded LRU cache with entries time to live.
+    Entries could be tagged to be deleted by tag.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at > self._timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._delete(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, tags=(), ttl=None):
+        with self._lock:
+            self._set(key, value, tags, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+
+    def delete_tag(self, tag):
+        with self._lock:
+            self._delete_tag(tag)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _set(self, key, value, tags, ttl):
+        expires_at = self._timer() + (self.ttl if ttl is None else ttl)
+        if key in self._entries:
+            self._delete(key)
+        self._entries[key] = (expires_at, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._delete(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _delete_tag(self, tag):
+        for key in list(self._tags.get(tag, ())):
+            self._delete(key)
+
+    def _delete(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+
+_user_caches = weakref.WeakSet()
+
+
+class TokenCache(LRUCache):
+    """
+    LRU cache of values by token key.
+    Entries are tagged by user primary key
+    and invalidated by token and user model signals.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # bumped on any invalidation to skip setting of users
+        # loaded before it
+        self.generation = 0
+        _user_caches.add(self)
+
+    def set(self, token_key, value, user_pk=None, ttl=None, generation=None):
+        """
+        Sets value by token key and returns True.
+        Value is not set (False is returned) if cache generation
+        is changed since the generation the value was loaded at.
+        """
+
+        tags = () if user_pk is None else (user_pk,)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._set(token_key, value, tags, ttl)
+            return True
+
+    async def aget(self, token_key):
+        return self.get(token_key)
+
+    async def aget_generation(self, user_pk=None):
+        """Returns generation to be got before user loading."""
+
+        return self.generation
+
+    async def aset(self, token_key, user, generation=None):
+        self.set(token_key, user, user_pk=user.pk, generation=generation)
+
+    async def aget_user(self, user_pk):
+        return self.get(("user", str(user_pk)))
+
+    async def aset_user(self, user, generation=None):
+        self.set(
+            ("user", str(user.pk)), user,
+            user_pk=user.pk, generation=generation)
+
+    def invalidate_token(self, token_key):
+        with self._lock:
+            self.generation += 1
+            if token_key in self._entries:
+                self._delete(token_key)
+
+    def invalidate_user(self, user_pk):
+        with self._lock:
+            self.generation += 1
+            self._delete_tag(user_pk)
+
+
+def dump_user(user):
+    """
+    Returns compact user payload,
+    tuple of concrete field values except password.
+    """
+
+    return tuple(getattr(user, attname) for attname in _user_attnames())
+
+
+def load_user(payload):
+    """Returns user instance loaded from compact user payload."""
+
+    User = get_user_model()
+    return User.from_db(router.db_for_read(User), _user_attnames(), payload)
+
+
+def _user_attnames():
+    User = get_user_model()
+    return [
+        field.attname for field in User._meta.concrete_fields
+        if field.attname != "password"
+    ]
+
+
+# user generation is not known before loading by token key
+_UNKNOWN_GENERATION = object()
+
+
+class TieredUserCache:
+    """
+    Two tier users cache.
+    In-process TokenCache tier is checked first,
+    then Django cache backend tier shared across workers.
+
+    Shared tier keeps token key (hashed) to user primary key entries,
+    compact user payload entries and user generation entries
+    by user primary key.
+    Both tiers are invalidated by token and user model signals.
+    Local tier entries keep user generation they were cached at,
+    it is checked against shared tier on every local hit, so entries
+    invalidated by other workers are not served.
+    """
+
+    def __init__(self, local=None, alias="default", timeout=300,
+                 key_prefix="channels_auth_token_middlewares"):
+        self.local = local if local is not None else TokenCache()
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+        # Payloads of other user fields set are not loaded.
+        attnames_digest = hashlib.sha256(
+            ",".join(_user_attnames()).encode()).hexdigest()
+        self._user_key_prefix = f"{key_prefix}:user:{attnames_digest[:8]}"
+        # Generation entries have to outlive local tier entries.
+        self._generation_timeout = max(timeout, self.local.ttl)
+        _user_caches.add(self)
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @property
+    def stats(self):
+        shared_stats = {"hits": self.shared_hits, "misses": self.shared_misses}
+        return {
+            "local": {**self.local.stats, "hit_rate": _hit_rate(self.local.stats)},
+            "shared": {**shared_stats, "hit_rate": _hit_rate(shared_stats)},
+        }
+
+    def make_token_key(self, token_key):
+        digest = hashlib.sha256(token_key.encode()).hexdigest()
+        return f"{self.key_prefix}:token:{digest}"
+
+    def make_user_key(self, user_pk):
+        return f"{self._user_key_prefix}:{user_pk}"
+
+    def make_generation_key(self, user_pk):
+        return f"{self.key_prefix}:generation:{user_pk}"
+
+    async def aget(self, token_key):
+        user = await self._aget_local(token_key)
+        if user is not None:
+            return user
+
+        user_pk = await self.shared.aget(self.make_token_key(token_key))
+        if user_pk is None:
+            self.shared_misses += 1
+            return None
+
+        user, generation = await self._aget_shared_user(user_pk)
+        if user is not None:
+            self.local.set(token_key, (user, generation), user_pk=user.pk)
+        return user
+
+    async def aget_generation(self, user_pk=None):
+        """
+        Returns pair of local tier generation and shared tier
+        user generation to be got before user loading.
+        User generation is got if user primary key is known
+        before loading (by user primary key lookups).
+        """
+
+        local_generation = await self.local.aget_generation()
+        if user_pk is None:
+            return local_generation, _UNKNOWN_GENERATION
+        user_generation = await self.shared.aget(
+            self.make_generation_key(user_pk))
+        return local_generation, user_generation
+
+    async def aset(self, token_key, user, generation=None):
+        if not await self._aset_local(token_key, user, generation):
+            return
+        await self.shared.aset_many({
+            self.make_token_key(token_key): user.pk,
+            self.make_user_key(user.pk): dump_user(user),
+        }, self.timeout)
+
+    def set_local(self, token_key, user):
+        """Sets local tier entry with current user generation."""
+
+        generation = self.shared.get(self.make_generation_key(user.pk))
+        self.local.set(token_key, (user, generation), user_pk=user.pk)
+
+    async def aget_user(self, user_pk):
+        local_key = ("user", str(user_pk))
+        user = await self._aget_local(local_key)
+        if user is not None:
+            return user
+
+        user, generation = await self._aget_shared_user(user_pk)
+        if user is not None:
+            self.local.set(local_key, (user, generation), user_pk=user.pk)
+        return user
+
+    async def aset_user(self, user, generation=None):
+        if not await self._aset_local(("user", str(user.pk)), user, generation):
+            return
+        await self.shared.aset(
+            self.make_user_key(user.pk), dump_user(user), self.timeout)
+
+    def invalidate_token(self, token_key):
+        self.local.invalidate_token(token_key)
+        self.shared.delete(self.make_token_key(token_key))
+
+    def invalidate_user(self, user_pk):
+        self.local.invalidate_user(user_pk)
+        self.shared.delete(self.make_user_key(user_pk))
+        # Local tiers of other workers drop entries of previous generation.
+        self.shared.set(
+            self.make_generation_key(user_pk), uuid.uuid4().hex,
+            self._generation_timeout)
+
+    async def _aset_local(self, local_key, user, generation):
+        """
+        Sets local tier entry and returns True.
+        Entry is not set (False is returned) if local tier generation
+        or user generation is changed since the generation
+        the user was loaded at.
+        """
+
+        user_generation = await self.shared.aget(
+            self.make_generation_key(user.pk))
+        local_generation = None
+        if generation is not None:
+            local_generation, loaded_generation = generation
+            if (loaded_generation is not _UNKNOWN_GENERATION
+                    and loaded_generation != user_generation):
+                return False
+        return self.local.set(
+            local_key, (user, user_generation),
+            user_pk=user.pk, generation=local_generation)
+
+    async def _aget_local(self, local_key):
+        entry = self.local.get(local_key)
+        if entry is None:
+            return None
+        user, generation = entry
+        shared_generation = await self.shared.aget(
+            self.make_generation_key(user.pk))
+        if shared_generation != generation:
+            self.local.delete(local_key)
+            return None
+        return user
+
+    async def _aget_shared_user(self, user_pk):
+        user_key = self.make_user_key(user_pk)
+        generation_key = self.make_generation_key(user_pk)
+        values = await self.shared.aget_many([user_key, generation_key])
+        payload = values.get(user_key)
+        if payload is None:
+            self.shared_misses += 1
+            return None, None
+        self.shared_hits += 1
+        return load_user(payload), values.get(generation_key)
+
+
+def _hit_rate(stats):
+    total = stats["hits"] + stats["misses"]
+    return stats["hits"] / total if total else 0.0
+
+
+class UserRegistry:
+    """
+    Weak reference registry of user objects shared by connections
+    of the same user. Users are interned by (user primary key, version),
+    version is bumped when the user is invalidated, so new connections
+    get new user objects and already interned ones are kept
+    by their connections only.
+    Users are invalidated by token and user model signals.
+    """
+
+    def __init__(self):
+        # bumped on any invalidation to skip interning of users
+        # loaded before it
+        self.generation = 0
+
+        self._users = weakref.WeakValueDictionary()
+        self._tokens = weakref.WeakValueDictionary()
+        self._versions = {}
+        self._lock = threading.Lock()
+        _user_caches.add(self)
+
+    def __len__(self):
+        return len(self._users)
+
+    def version(self, user_pk):
+        return self._versions.get(str(user_pk), 0)
+
+    def get(self, user_pk):
+        """Returns interned user by primary key or None."""
+
+        return self._users.get((str(user_pk), self.version(user_pk)))
+
+    def get_by_token(self, token_key):
+        """Returns interned user by token key or None."""
+
+        user = self._tokens.get(token_key)
+        if user is None or self.get(user.pk) is not user:
+            return None
+        return user
+
+    def intern(self, user, generation=None, token_key=None):
+        """
+        Returns already interned user with the same primary key
+        or interns the user and returns it.
+        User is not interned if registry generation is changed
+        since the generation the user was loaded at.
+        """
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return user
+
+            key = (str(user.pk), self.version(user.pk))
+            interned = self._users.get(key)
+            if interned is None:
+                interned = self._users[key] = user
+            if token_key is not None:
+                self._tokens[token_key] = interned
+            return interned
+
+    def invalidate_token(self, token_key):
+        with self._lock:
+            self.generation += 1
+            self._tokens.pop(token_key, None)
+
+    def invalidate_user(self, user_pk):
+        with self._lock:
+            self.generation += 1
+            user_pk = str(user_pk)
+            self._versions[user_pk] = self._versions.get(user_pk, 0) + 1
+
+
+def invalidate_token(token_key):
+    """Delete token key entries from all token and user caches."""
+
+    for cache in list(_user_caches):
+        cache.invalidate_token(token_key)
+
+
+def invalidate_user(user_pk):
+    """Delete user entries from all token and user caches."""
+
+    for cache in list(_user_caches):
+        cache.invalidate_user(user_pk)
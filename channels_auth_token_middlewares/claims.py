@@ -0,0 +1,128 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Simple JWT claims backed users.
+"""
+
+
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
+
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+class UserNotLoaded(RuntimeError):
+    """Raised when ClaimsUser attribute requires not loaded user instance."""
+
+
+class LoadedUserAttribute:
+    """
+    ClaimsUser attribute got from loaded user instance,
+    or from anonymous user if user instance is not found.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance.get_loaded_user(), self.name)
+
+
+class ClaimsUser(TokenUser):
+    """
+    Simple JWT TokenUser backed by validated token claims.
+    User model instance is loaded on the first aget_user() call,
+    attributes out of claims are got from it once it is loaded.
+    Username, staff, superuser and permissions attributes
+    are got from loaded user instance only.
+    """
+
+    username = LoadedUserAttribute()
+    is_staff = LoadedUserAttribute()
+    is_superuser = LoadedUserAttribute()
+    groups = LoadedUserAttribute()
+    user_permissions = LoadedUserAttribute()
+    get_username = LoadedUserAttribute()
+    get_group_permissions = LoadedUserAttribute()
+    get_all_permissions = LoadedUserAttribute()
+    has_perm = LoadedUserAttribute()
+    has_perms = LoadedUserAttribute()
+    has_module_perms = LoadedUserAttribute()
+
+    def __init__(self, token, loader):
+        super().__init__(token)
+        self._loader = loader
+        self._user_task = None
+
+    def __str__(self):
+        return f"ClaimsUser {self.id}"
+
+    @cached_property
+    def id(self):
+        user_id = self.token[api_settings.USER_ID_CLAIM]
+        pk_field = get_user_model()._meta.pk
+        if api_settings.USER_ID_FIELD in ("pk", pk_field.name):
+            try:
+                return pk_field.to_python(user_id)
+            except ValidationError:
+                pass
+        return user_id
+
+    @property
+    def is_loaded(self):
+        task = self._user_task
+        return task is not None and task.done() and not task.cancelled()
+
+    async def aget_user(self):
+        """Returns user model instance or None, it is loaded once."""
+
+        if self._user_task is None:
+            self._user_task = asyncio.ensure_future(self._loader(self.token))
+        return await asyncio.shield(self._user_task)
+
+    def get_loaded_user(self):
+        """
+        Returns loaded user model instance or anonymous user if it is not found,
+        raises UserNotLoaded if aget_user() is not awaited yet.
+        """
+
+        if not self.is_loaded:
+            raise UserNotLoaded(
+                f"User {self.id} is not loaded, await aget_user() first")
+        user = self._user_task.result()
+        return AnonymousUser() if user is None else user
+
+    def __getattr__(self, attr):
+        if attr.startswith("_") or attr == "token":
+            raise AttributeError(attr)
+
+        if self.is_loaded and self._user_task.exception() is None:
+            user = self._user_task.result()
+            if user is not None:
+                return getattr(user, attr)
+
+        if attr in self.token:
+            return self.token[attr]
+        raise AttributeError(
+            f"'{attr}' is not in token claims, "
+            "await aget_user() to load user instance")
@@ -0,0 +1,475 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Concurrency helpers for user lookups.
+"""
+
+
+import asyncio
+import threading
+import time
+import weakref
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import STAGE_QUEUE_WAIT
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key within an event loop
+    into one in-flight task.
+
+    Every caller awaits the shared task. Exception of the task is raised
+    to every caller. Cancelled caller doesn't cancel the task
+    while other callers wait for it, task is cancelled with the last one.
+    """
+
+    def __init__(self):
+        self._loops_calls = weakref.WeakKeyDictionary()
+
+    def __len__(self):
+        return sum(len(calls) for calls in self._loops_calls.values())
+
+    async def do(self, key, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        calls = self._loops_calls.get(loop)
+        if calls is None:
+            calls = self._loops_calls[loop] = {}
+
+        call = calls.get(key)
+        if call is None:
+            call = calls[key] = _Call(loop.create_task(func(*args, **kwargs)))
+            call.task.add_done_callback(
+                lambda task: self._forget(calls, key, call))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                if calls.get(key) is call:
+                    del calls[key]
+                call.task.cancel()
+
+    @staticmethod
+    def _forget(calls, key, call):
+        if calls.get(key) is call:
+            del calls[key]
+        if not call.task.cancelled():
+            # Mark exception as retrieved for the case all callers are gone.
+            call.task.exception()
+
+
+class _Batch:
+    __slots__ = ("futures", "handle")
+
+    def __init__(self):
+        self.futures = {}
+        self.handle = None
+
+
+class BatchLoader:
+    """
+    Collects keys requested within window or up to max batch size
+    and loads them by one load_many call (dataloader style).
+
+    load_many is a coroutine function which gets a list of keys
+    and returns a dict of values by keys, missing keys are loaded as None.
+    Exception of load_many is raised to every caller of the batch.
+    """
+
+    def __init__(self, load_many, window=0.002, max_batch_size=100):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be positive")
+
+        self.load_many = load_many
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._loops_batches = weakref.WeakKeyDictionary()
+        self._tasks = set()
+
+    async def load(self, key):
+        loop = asyncio.get_running_loop()
+        batch = self._loops_batches.get(loop)
+        if batch is None:
+            batch = self._loops_batches[loop] = _Batch()
+            batch.handle = loop.call_later(self.window, self._dispatch, loop)
+
+        future = batch.futures.get(key)
+        if future is None:
+            future = batch.futures[key] = loop.create_future()
+            if len(batch.futures) >= self.max_batch_size:
+                self._dispatch(loop)
+
+        return await asyncio.shield(future)
+
+    def _dispatch(self, loop):
+        batch = self._loops_batches.pop(loop, None)
+        if batch is None:
+            return
+        batch.handle.cancel()
+        task = loop.create_task(self._load(batch.futures))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, futures):
+        try:
+            values = await self.load_many(list(futures))
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as exc:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for key, future in futures.items():
+            if not future.done():
+                future.set_result(values.get(key))
+
+
+class ExecutorQueueFull(RuntimeError):
+    """Raised when BoundedExecutor queue is full."""
+
+
+class BoundedExecutor:
+    """
+    Bounded dedicated thread pool to run sync functions
+    off the event loop and off the thread sensitive executor.
+
+    Calls over max_workers wait in the queue up to max_queue_depth,
+    further calls are rejected by ExecutorQueueFull.
+    Time calls waited in the queue is reported by stats
+    and by metrics sink as "queue_wait" stage.
+    """
+
+    def __init__(self, max_workers=4, max_queue_depth=64, metrics_sink=None,
+                 thread_name_prefix="channels-auth-token"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be positive")
+        if max_queue_depth < 0:
+            raise ValueError("max_queue_depth must not be negative")
+
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.metrics_sink = metrics_sink
+        self.thread_name_prefix = thread_name_prefix
+        self.submitted = 0
+        self.rejected = 0
+        self.queue_wait_count = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Count of running and queued calls."""
+
+        return self._pending
+
+    @property
+    def stats(self):
+        count = self.queue_wait_count
+        return {
+            "pending": self._pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "queue_wait": {
+                "count": count,
+                "mean": self.queue_wait_total / count if count else 0.0,
+                "max": self.queue_wait_max,
+            },
+        }
+
+    async def run(self, func, *args):
+        """Returns result of func(*args) called in the thread pool."""
+
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue_depth:
+                self.rejected += 1
+                raise ExecutorQueueFull(
+                    f"{self._pending} calls are pending already")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.thread_name_prefix)
+            executor = self._executor
+            self._pending += 1
+            self.submitted += 1
+
+        started = []
+
+        def call():
+            started.append(time.monotonic())
+            return func(*args)
+
+        def release(future):
+            # Called once the call is finished or cancelled before start,
+            # running call cancelled by caller keeps its slot until then.
+            with self._lock:
+                self._pending -= 1
+            if started:
+                self._record_queue_wait(started[0] - submitted_at)
+
+        submitted_at = time.monotonic()
+        try:
+            future = executor.submit(call)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _record_queue_wait(self, seconds):
+        with self._lock:
+            self.queue_wait_count += 1
+            self.queue_wait_total += seconds
+            if seconds > self.queue_wait_max:
+                self.queue_wait_max = seconds
+        if self.metrics_sink is not None:
+            self.metrics_sink.timing(STAGE_QUEUE_WAIT, seconds)
+
+
+# circuit breaker states
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class CircuitOpen(RuntimeError):
+    """Raised when CircuitBreaker doesn't allow a call."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of async calls.
+
+    Closed circuit is opened when failure rate of the last window_size
+    calls (at least min_calls) reaches failure_rate.
+    Open circuit rejects calls by CircuitOpen until open_interval
+    is elapsed, then up to half_open_probes calls are allowed,
+    circuit is closed if all of them succeed and opened again otherwise.
+    State changes are reported to on_state_change(breaker, old, new).
+    Rejections by CircuitOpen and ExecutorQueueFull are not failures
+    of the guarded backend, they are not counted by default.
+    """
+
+    def __init__(self, failure_rate=0.5, window_size=20, min_calls=10,
+                 open_interval=30, half_open_probes=1,
+                 failure_exceptions=(Exception,),
+                 ignored_exceptions=(CircuitOpen, ExecutorQueueFull),
+                 on_state_change=None, timer=time.monotonic):
+        if not 0 < failure_rate <= 1:
+            raise ValueError("failure_rate must be in (0, 1] range")
+        if window_size < 1 or half_open_probes < 1:
+            raise ValueError(
+                "window_size and half_open_probes must be positive")
+
+        self.failure_rate = failure_rate
+        self.window_size = window_size
+        self.min_calls = min(max(min_calls, 1), window_size)
+        self.open_interval = open_interval
+        self.half_open_probes = half_open_probes
+        self.failure_exceptions = tuple(failure_exceptions)
+        self.ignored_exceptions = tuple(ignored_exceptions)
+        self.on_state_change = on_state_change
+        self.rejected = 0
+        self.opened = 0
+
+        self._timer = timer
+        self._state = CIRCUIT_CLOSED
+        self._opened_at = None
+        self._outcomes = deque(maxlen=window_size)
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+        self._transitions = []
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        Current state, open circuit becomes half open
+        once open interval is elapsed.
+        """
+
+        with self._lock:
+            self._check_open_interval()
+            state = self._state
+        self._notify()
+        return state
+
+    @property
+    def stats(self):
+        with self._lock:
+            self._check_open_interval()
+            calls = len(self._outcomes)
+            stats = {
+                "state": self._state,
+                "calls": calls,
+                "failures": self._failures,
+                "failure_rate": self._failures / calls if calls else 0.0,
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+        self._notify()
+        return stats
+
+    def allow(self):
+        """
+        Returns whether a call is allowed.
+        Allowed call outcome has to be recorded by record_success,
+        record_failure or release.
+        """
+
+        with self._lock:
+            self._check_open_interval()
+            if self._state == CIRCUIT_CLOSED:
+                allowed = True
+            elif (
+                self._state == CIRCUIT_HALF_OPEN
+                and self._probes < self.half_open_probes
+            ):
+                self._probes += 1
+                allowed = True
+            else:
+                self.rejected += 1
+                allowed = False
+        self._notify()
+        return allowed
+
+    def record_success(self):
+        with self._lock:
+            if self._state == CIRCUIT_HALF_OPEN:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._set_state(CIRCUIT_CLOSED)
+            elif self._state == CIRCUIT_CLOSED:
+                self._record_outcome(False)
+        self._notify()
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == CIRCUIT_HALF_OPEN:
+                self._set_state(CIRCUIT_OPEN)
+            elif self._state == CIRCUIT_CLOSED:
+                self._record_outcome(True)
+                calls = len(self._outcomes)
+                if (
+                    calls >= self.min_calls
+                    and self._failures / calls >= self.failure_rate
+                ):
+                    self._set_state(CIRCUIT_OPEN)
+        self._notify()
+
+    def release(self):
+        """Release allowed call without outcome, like cancelled one."""
+
+        with self._lock:
+            if self._state == CIRCUIT_HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    async def call(self, func, *args):
+        """
+        Returns result of func(*args) coroutine if the call is allowed,
+        raises CircuitOpen otherwise.
+        """
+
+        if not self.allow():
+            raise CircuitOpen("Circuit is open")
+        try:
+            result = await func(*args)
+        except self.ignored_exceptions:
+            self.release()
+            raise
+        except self.failure_exceptions:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+    def reset(self):
+        """Close the circuit and forget recorded calls."""
+
+        with self._lock:
+            self._set_state(CIRCUIT_CLOSED)
+        self._notify()
+
+    def _record_outcome(self, failed):
+        outcomes = self._outcomes
+        if len(outcomes) == outcomes.maxlen and outcomes[0]:
+            self._failures -= 1
+        outcomes.append(failed)
+        if failed:
+            self._failures += 1
+
+    def _check_open_interval(self):
+        if (
+            self._state == CIRCUIT_OPEN
+            and self._timer() - self._opened_at >= self.open_interval
+        ):
+            self._set_state(CIRCUIT_HALF_OPEN)
+
+    def _set_state(self, state):
+        old_state = self._state
+        self._state = state
+        self._probes = self._probe_successes = 0
+        if state == CIRCUIT_OPEN:
+            self._opened_at = self._timer()
+            self.opened += 1
+        elif state == CIRCUIT_CLOSED:
+            self._outcomes.clear()
+            self._failures = 0
+        if old_state != state:
+            self._transitions.append((old_state, state))
+
+    def _notify(self):
+        # State changes are reported out of the lock,
+        # so on_state_change could use the breaker.
+        if not self._transitions:
+            return
+        with self._lock:
+            transitions, self._transitions = self._transitions, []
+        if self.on_state_change is not None:
+            for old_state, state in transitions:
+                self.on_state_change(self, old_state, state)
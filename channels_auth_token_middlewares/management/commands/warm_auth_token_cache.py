@@ -0,0 +1,81 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Warm users cache by Django REST framework auth tokens,
+for example after deploy before workers get connections.
+"""
+
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from ...cache import TieredUserCache
+from ...warming import warm_user_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams auth tokens with their users to TieredUserCache shared tier "
+        "(Django cache backend), so workers get users without DB queries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cache",
+            help=(
+                "Dotted import path of TieredUserCache instance to warm, "
+                "by default TieredUserCache is built by --alias, "
+                "--timeout and --key-prefix options"))
+        parser.add_argument(
+            "--alias", default="default", help="Django cache alias")
+        parser.add_argument(
+            "--timeout", type=int, default=300,
+            help="Shared tier entries timeout in seconds")
+        parser.add_argument(
+            "--key-prefix", default="channels_auth_token_middlewares",
+            help="Shared tier keys prefix")
+        parser.add_argument(
+            "--recently-used", type=int,
+            help="Only users logged in during the last seconds")
+        parser.add_argument(
+            "--max-entries", type=int, help="Max warmed tokens count")
+        parser.add_argument(
+            "--max-bytes", type=int,
+            help="Max approximate size of warmed user payloads")
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="Tokens count fetched from DB and written to cache at once")
+
+    def handle(self, *args, **options):
+        if options["cache"]:
+            cache = import_string(options["cache"])
+        else:
+            cache = TieredUserCache(
+                alias=options["alias"], timeout=options["timeout"],
+                key_prefix=options["key_prefix"])
+
+        try:
+            warmed = warm_user_cache(
+                cache,
+                recently_used=options["recently_used"],
+                max_entries=options["max_entries"],
+                max_bytes=options["max_bytes"],
+                chunk_size=options["chunk_size"])
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write(
+            f"Warmed {warmed['entries']} tokens "
+            f"({warmed['bytes']} bytes of user payloads)")
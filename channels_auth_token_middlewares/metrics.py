@@ -0,0 +1,202 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Auth middlewares instrumentation sinks.
+"""
+
+
+import os
+import socket
+import threading
+
+
+# timed stages
+STAGE_TOKEN_KEY_STRING = "token_key_string"
+STAGE_PARSE_TOKEN_KEY = "parse_token_key"
+STAGE_USER_INSTANCE = "user_instance"
+STAGE_QUEUE_WAIT = "queue_wait"
+
+STAGES = (
+    STAGE_TOKEN_KEY_STRING, STAGE_PARSE_TOKEN_KEY,
+    STAGE_USER_INSTANCE, STAGE_QUEUE_WAIT,
+)
+
+# counted outcomes
+OUTCOME_NO_TOKEN = "no_token"
+OUTCOME_MALFORMED = "malformed"
+OUTCOME_NOT_FOUND = "not_found"
+OUTCOME_AUTHENTICATED = "authenticated"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_CIRCUIT_OPEN = "circuit_open"
+OUTCOME_QUEUE_FULL = "queue_full"
+
+OUTCOMES = (
+    OUTCOME_NO_TOKEN, OUTCOME_MALFORMED,
+    OUTCOME_NOT_FOUND, OUTCOME_AUTHENTICATED,
+    OUTCOME_TIMEOUT, OUTCOME_CIRCUIT_OPEN, OUTCOME_QUEUE_FULL,
+)
+
+
+class MetricsSink:
+    """
+    No-op metrics sink, base class of metrics sinks.
+    Sink methods are called on the event loop and must not block.
+    """
+
+    def timing(self, stage, seconds):
+        """Record duration of the stage in seconds."""
+
+    def count(self, outcome):
+        """Count outcome of the token authentication."""
+
+
+class PrometheusTextSink(MetricsSink):
+    """
+    Aggregates metrics in memory and renders them
+    in Prometheus text exposition format.
+    Rendered text could be written to the file read by local collector,
+    like node_exporter textfile collector, periodically by background thread.
+    """
+
+    buckets = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0,
+    )
+
+    def __init__(self, prefix="channels_auth_token", path=None,
+                 write_interval=None, buckets=None):
+        self.prefix = prefix
+        self.path = path
+        self.write_interval = write_interval
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+
+        self._counts = dict.fromkeys(OUTCOMES, 0)
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._writer = None
+        if path is not None and write_interval is not None:
+            self._writer = threading.Thread(
+                target=self._write_periodically,
+                name="channels-auth-token-metrics", daemon=True)
+            self._writer.start()
+
+    def timing(self, stage, seconds):
+        with self._lock:
+            timing = self._timings.get(stage)
+            if timing is None:
+                timing = self._timings[stage] = [[0] * len(self.buckets), 0, 0.0]
+            bucket_counts = timing[0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    bucket_counts[i] += 1
+                    break
+            timing[1] += 1
+            timing[2] += seconds
+
+    def count(self, outcome):
+        with self._lock:
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+
+    def render(self):
+        """Returns metrics in Prometheus text exposition format."""
+
+        prefix = self.prefix
+        with self._lock:
+            counts = dict(self._counts)
+            timings = {
+                stage: (list(bucket_counts), count, total)
+                for stage, (bucket_counts, count, total) in self._timings.items()
+            }
+
+        lines = [
+            f"# HELP {prefix}_outcomes_total Token authentication outcomes.",
+            f"# TYPE {prefix}_outcomes_total counter",
+        ]
+        for outcome, count in counts.items():
+            lines.append(f'{prefix}_outcomes_total{{outcome="{outcome}"}} {count}')
+
+        lines.extend([
+            f"# HELP {prefix}_stage_seconds Token authentication stages duration.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ])
+        for stage, (bucket_counts, count, total) in timings.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}}'
+                    f" {cumulative}")
+            lines.extend([
+                f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}',
+                f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total!r}',
+                f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}',
+            ])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=None):
+        """Atomically write rendered metrics to the file."""
+
+        path = path or self.path
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temp_path, path)
+
+    def close(self):
+        """Stop periodic writing."""
+
+        self._closed.set()
+        if self._writer is not None:
+            self._writer.join()
+
+    def _write_periodically(self):
+        while not self._closed.wait(self.write_interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+
+class StatsdSink(MetricsSink):
+    """
+    Sends metrics as statsd lines over UDP to local collector.
+    Sending errors are ignored.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125,
+                 prefix="channels_auth_token"):
+        self.address = (host, port)
+        self.prefix = prefix
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def timing(self, stage, seconds):
+        self.send(f"{self.prefix}.stage.{stage}:{seconds * 1000:.3f}|ms")
+
+    def count(self, outcome):
+        self.send(f"{self.prefix}.outcome.{outcome}:1|c")
+
+    def send(self, line):
+        try:
+            self._socket.sendto(line.encode(), self.address)
+        except OSError:
+            pass
+
+    def close(self):
+        self._socket.close()
@@ -16,10 +16,13 @@
 from .base import (
     BaseAuthTokenMiddleware, CookieAuthTokenMiddleware,
     HeaderAuthTokenMiddleware, QueryStringAuthTokenMiddleware,
+    MultiSourceAuthTokenMiddleware, SchemeAuthTokenMiddleware,
+    TokenSource, HeaderTokenSource, CookieTokenSource, QueryStringTokenSource,
+    UserLookupTimeout,
 )
 from .drf import (
     DRFAuthTokenMiddleware, QueryStringDRFAuthTokenMiddleware,
-    DRFAuthTokenMiddlewareStack,
+    MultiSourceDRFAuthTokenMiddleware, DRFAuthTokenMiddlewareStack,
     SimpleJWTAuthTokenMiddleware, QueryStringSimpleJWTAuthTokenMiddleware,
-    SimpleJWTAuthTokenMiddlewareStack,
+    MultiSourceSimpleJWTAuthTokenMiddleware, SimpleJWTAuthTokenMiddlewareStack,
 )
@@ -13,16 +13,311 @@
 # limitations under the License.
 
 
+import asyncio
 import re
+import time
 
-from http.cookies import BaseCookie
-from urllib.parse import parse_qs
+from urllib.parse import unquote
 
 from django.contrib.auth.models import AnonymousUser
-from django.utils.functional import empty
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import cached_property, empty
 
 from channels.auth import AuthMiddleware, UserLazyObject
 
+from ..concurrency import CircuitOpen, ExecutorQueueFull, SingleFlight
+from ..revocation import add_revocation_groups, get_scope_groups
+from ..metrics import (
+    OUTCOME_AUTHENTICATED, OUTCOME_CIRCUIT_OPEN, OUTCOME_MALFORMED,
+    OUTCOME_NO_TOKEN, OUTCOME_NOT_FOUND, OUTCOME_QUEUE_FULL, OUTCOME_TIMEOUT,
+    STAGE_PARSE_TOKEN_KEY, STAGE_TOKEN_KEY_STRING, STAGE_USER_INSTANCE,
+)
+
+
+# user instance lookup failure policies
+FALLBACK_ANONYMOUS = "anonymous"
+FALLBACK_REJECT = "reject"
+FALLBACK_STALE = "stale"
+
+FALLBACK_POLICIES = (FALLBACK_ANONYMOUS, FALLBACK_REJECT, FALLBACK_STALE)
+
+
+class UserLookupTimeout(asyncio.TimeoutError):
+    """
+    User instance lookup deadline is exceeded,
+    raised by "reject" lookup timeout policy.
+    """
+
+
+# exceptions raised by "reject" fallback policies
+REJECT_EXCEPTIONS = (UserLookupTimeout, CircuitOpen, ExecutorQueueFull)
+
+# websocket close code of rejected connections ("Try Again Later")
+REJECT_CLOSE_CODE = 1013
+
+
+_COOKIE_SEPARATORS = frozenset("; \t\n\r\x0b\x0c")
+
+_COOKIE_VALUE_PATTERN = re.compile(r'\s*=\s*("(?:[^\\"]|\\.)*"|[^;\s]*)')
+
+_COOKIE_QUOTED_PATTERN = re.compile(r'"(?:[^\\"]|\\.)*"')
+
+
+def get_cookie_value(cookie_raw_data, cookie_name):
+    """
+    Returns first cookie value by name from Cookie header value or None.
+    Only the cookie name is scanned for, scanning stops at the first match.
+    Quoted values are skipped and returned quoted
+    like http.cookies.BaseCookie does, malformed other cookies are skipped.
+    """
+
+    position = 0
+    quote_position = cookie_raw_data.find('"')
+    while True:
+        name_position = cookie_raw_data.find(cookie_name, position)
+        if name_position == -1:
+            return None
+
+        if quote_position != -1 and quote_position < name_position:
+            # Name could be inside of quoted value, skip it.
+            matched = _COOKIE_QUOTED_PATTERN.match(cookie_raw_data, quote_position)
+            position = matched.end() if matched else quote_position + 1
+            quote_position = cookie_raw_data.find('"', position)
+            continue
+
+        position = name_position + len(cookie_name)
+        if (
+            name_position == 0
+            or cookie_raw_data[name_position - 1] in _COOKIE_SEPARATORS
+        ):
+            matched = _COOKIE_VALUE_PATTERN.match(cookie_raw_data, position)
+            if matched:
+                return matched.group(1)
+
+
+_ENCODED_QUERY_PARAM_PATTERN = re.compile(rb"&([^&=%+]*[%+][^&=]*)=([^&]*)")
+
+
+def get_query_param_value(raw_query_string, query_param):
+    """
+    Returns first not blank query param value by name from raw query string
+    or None, like urllib.parse.parse_qs does.
+    Raw query string is scanned for the param name,
+    only matched value is decoded.
+    """
+
+    name = query_param.encode() + b"="
+    length = len(raw_query_string)
+    value_start = value_end = None
+    position = 0
+    while True:
+        found = raw_query_string.find(name, position)
+        if found == -1:
+            break
+        position = found + len(name)
+        if found and raw_query_string[found - 1] != 38:  # b"&"
+            continue
+        end = raw_query_string.find(b"&", position)
+        if end == -1:
+            end = length
+        # Blank values are skipped.
+        if end > position:
+            value_start, value_end = position, end
+            break
+
+    # Percent or plus encoded param name could be decoded to the name,
+    # such params are matched before the found one.
+    # Pattern is matched after "&", so the first param is prefixed by it.
+    limit = length if value_start is None else value_start - len(name)
+    for matched in _ENCODED_QUERY_PARAM_PATTERN.finditer(
+        b"&" + raw_query_string, 0, limit + 1,
+    ):
+        raw_name, raw_value = matched.groups()
+        if raw_value and unquote_query_component(raw_name) == query_param:
+            return unquote_query_component(raw_value)
+
+    if value_start is None:
+        return None
+    return unquote_query_component(raw_query_string[value_start:value_end])
+
+
+def unquote_query_component(raw_value):
+    """Decode raw query string name or value like urllib.parse.parse_qs does."""
+
+    return unquote(raw_value.decode(errors="replace").replace("+", " "))
+
+
+# scope key of ScopeRequest shared by stacked middlewares
+SCOPE_REQUEST_KEY = "auth_token_request"
+
+
+class ScopeRequest:
+    """
+    Parsed view of the scope request shared by stacked auth token
+    middlewares and token sources, placed to the scope once.
+    Headers index is built on first use, cookie and query param
+    values are memoized by name, so every layer reuses them.
+    """
+
+    __slots__ = (
+        "headers", "query_string",
+        "_headers_index", "_lower_headers", "_cookies", "_query_params",
+    )
+
+    def __init__(self, scope):
+        self.headers = scope.get("headers", ())
+        self.query_string = scope.get("query_string")
+        self._headers_index = None
+        self._lower_headers = None
+        self._cookies = {}
+        self._query_params = {}
+
+    def header(self, header_name):
+        """
+        Returns raw header value by raw header name or None.
+        Exact name match takes precedence over lowercased name match,
+        last header wins in both cases.
+        """
+
+        index = self._get_headers_index()
+        value = index.get(header_name)
+        if value is None:
+            value = index.get(header_name.lower())
+        return value
+
+    @property
+    def lower_headers(self):
+        """
+        Dict of raw header values by lowercased raw header names,
+        last header wins.
+        """
+
+        if self._lower_headers is None:
+            index = self._get_headers_index()
+            if b"\0".join(index).islower():
+                # Header names are lowercased already (like ASGI requires).
+                self._lower_headers = index
+            else:
+                self._lower_headers = {
+                    name.lower(): value for name, value in self.headers}
+        return self._lower_headers
+
+    def _get_headers_index(self):
+        if self._headers_index is None:
+            # last header wins
+            self._headers_index = dict(self.headers)
+        return self._headers_index
+
+    def cookie(self, cookie_name):
+        """Returns cookie value by name or None."""
+
+        value = self._cookies.get(cookie_name, empty)
+        if value is empty:
+            raw_value = self.header(b"cookie")
+            if raw_value is None:
+                raw_value = self.lower_headers.get(b"cookie")
+            value = self._cookies[cookie_name] = (
+                get_cookie_value(raw_value.decode(), cookie_name)
+                if raw_value else None)
+        return value
+
+    def query_param(self, query_param):
+        """Returns first not blank query param value by name or None."""
+
+        value = self._query_params.get(query_param, empty)
+        if value is empty:
+            value = self._query_params[query_param] = (
+                get_query_param_value(self.query_string, query_param)
+                if self.query_string else None)
+        return value
+
+
+def get_scope_request(scope):
+    """
+    Returns ScopeRequest of the scope, it is placed to the scope
+    on the first call. It is replaced if scope headers or query string
+    are replaced by other middleware.
+    """
+
+    request = scope.get(SCOPE_REQUEST_KEY)
+    if (
+        request is None
+        or request.headers is not scope.get("headers", request.headers)
+        or request.query_string is not scope.get("query_string")
+    ):
+        request = scope[SCOPE_REQUEST_KEY] = ScopeRequest(scope)
+    return request
+
+
+# scope key of the lookups ledger shared by stacked middlewares
+SCOPE_LOOKUPS_KEY = "auth_token_lookups"
+
+
+def get_scope_lookups(scope):
+    """
+    Returns lookups ledger of the scope: dict of looked up users
+    by (lookup backend, token key). It is placed to the scope
+    on the first call and shared with inner middlewares by scope copies.
+    """
+
+    lookups = scope.get(SCOPE_LOOKUPS_KEY)
+    if lookups is None:
+        lookups = scope[SCOPE_LOOKUPS_KEY] = {}
+    return lookups
+
+
+class LazyUserResolver:
+    """
+    Awaitable accessor of lazily resolved scope user,
+    placed to scope["auser"] by BaseAuthTokenMiddleware in lazy user mode.
+    User is resolved on the first call and memoized per connection.
+    """
+
+    def __init__(self, user, token_lookups, previous=None,
+                 lookups=None, groups=None):
+        self._user = user
+        self._token_lookups = token_lookups
+        self._previous = previous
+        self._lookups = lookups
+        self._groups = groups
+        self._task = None
+
+    async def __call__(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._resolve())
+        return await asyncio.shield(self._task)
+
+    async def _resolve(self):
+        if self._previous is not None:
+            await self._previous()
+
+        user = self._user
+        if user._wrapped is not empty and not user.is_anonymous:
+            return user._wrapped
+
+        if self._token_lookups:
+            user._wrapped, token_key = await get_first_user(
+                self._token_lookups, self._lookups)
+            if self._groups is not None and token_key is not None:
+                add_revocation_groups(self._groups, token_key, user)
+        elif user._wrapped is empty:
+            user._wrapped = AnonymousUser()
+        return user._wrapped
+
+
+async def get_first_user(token_lookups, lookups):
+    """
+    Returns (user, token key) of the first of (middleware, token key)
+    lookups which user is found by, like nested middlewares do,
+    (anonymous user, None) otherwise.
+    """
+
+    for middleware, token_key in token_lookups:
+        user = await middleware.get_recorded_user(token_key, lookups)
+        if not user.is_anonymous:
+            return user, token_key
+    return AnonymousUser(), None
+
 
 class BaseAuthTokenMiddleware(AuthMiddleware):
     """
@@ -33,31 +328,295 @@ class BaseAuthTokenMiddleware(AuthMiddleware):
     # regex need to fullmatch token key
     token_regex = r".*"
 
-    def __init__(self, *args, token_regex=None, **kwargs):
+    # opt-in TokenCache instance to remember rejected token keys
+    rejected_token_cache = None
+
+    # coalesce concurrent get_user_instance calls with the same token key
+    coalesce_lookups = False
+
+    # defer user instance getting until scope["auser"]() is awaited
+    lazy_user = False
+
+    # opt-in MetricsSink instance to record stages timing and outcomes
+    metrics_sink = None
+
+    # opt-in user instance lookup deadline in seconds
+    lookup_timeout = None
+
+    # what user is on lookup timeout: "anonymous", "reject" or "stale"
+    lookup_timeout_policy = FALLBACK_ANONYMOUS
+
+    # opt-in TokenCache instance to remember looked up users
+    # to be served by "stale" policy
+    stale_user_cache = None
+
+    # opt-in CircuitBreaker instance to guard user instance lookups
+    circuit_breaker = None
+
+    # what user is while circuit is open: "anonymous", "reject" or "stale"
+    circuit_open_policy = FALLBACK_ANONYMOUS
+
+    # add authenticated connections to token and user revocation groups
+    revocation_groups = False
+
+    # hashable key of user lookups shared by stacked middlewares
+    # which resolve token keys to the same users, middleware itself by default
+    lookup_backend = None
+
+    def __init__(self, *args, token_regex=None, rejected_token_cache=None,
+                 coalesce_lookups=None, lazy_user=None, metrics_sink=None,
+                 lookup_timeout=None, lookup_timeout_policy=None,
+                 stale_user_cache=None, circuit_breaker=None,
+                 circuit_open_policy=None, lookup_backend=None,
+                 revocation_groups=None, **kwargs):
         self.token_regex = str(token_regex or self.token_regex)
+        if rejected_token_cache is not None:
+            self.rejected_token_cache = rejected_token_cache
+        if coalesce_lookups is not None:
+            self.coalesce_lookups = coalesce_lookups
+        if lazy_user is not None:
+            self.lazy_user = lazy_user
+        if metrics_sink is not None:
+            self.metrics_sink = metrics_sink
+        if lookup_timeout is not None:
+            self.lookup_timeout = lookup_timeout
+        if lookup_timeout_policy is not None:
+            self.lookup_timeout_policy = lookup_timeout_policy
+        if stale_user_cache is not None:
+            self.stale_user_cache = stale_user_cache
+        if circuit_breaker is not None:
+            self.circuit_breaker = circuit_breaker
+        if circuit_open_policy is not None:
+            self.circuit_open_policy = circuit_open_policy
+        if lookup_backend is not None:
+            self.lookup_backend = lookup_backend
+        if revocation_groups is not None:
+            self.revocation_groups = revocation_groups
+        self._check_fallback_policy(self.lookup_timeout_policy)
+        self._check_fallback_policy(self.circuit_open_policy)
+        self._lookups = SingleFlight() if self.coalesce_lookups else None
         super().__init__(*args, **kwargs)
 
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        self.populate_scope(scope)
+        try:
+            await self.resolve_scope(scope)
+        except REJECT_EXCEPTIONS as exception:
+            return await self.reject(scope, send, exception)
+        if not isinstance(self.inner, BaseAuthTokenMiddleware):
+            # Innermost layer drops request memo and lookups ledger,
+            # so they are not kept by the application for the connection.
+            scope.pop(SCOPE_REQUEST_KEY, None)
+            scope.pop(SCOPE_LOOKUPS_KEY, None)
+        return await self.inner(scope, receive, send)
+
     def populate_scope(self, scope):
         # Add it to the scope if it is not there already
         if "user" not in scope:
             scope["user"] = UserLazyObject()
 
     async def resolve_scope(self, scope):
-        # Get user instance if it is not already in the scope.
-        if scope["user"]._wrapped is empty or scope["user"].is_anonymous:
-            scope["user"]._wrapped = await self.get_user(scope)
+        user = scope["user"]
+        resolved = user._wrapped is not empty and not user.is_anonymous
+
+        if self.lazy_user:
+            # Parse token key now, get user instance on first access.
+            token_lookups = () if resolved else self.get_token_lookups(scope)
+            scope["auser"] = LazyUserResolver(
+                user, token_lookups, previous=scope.get("auser"),
+                lookups=get_scope_lookups(scope) if token_lookups else None,
+                groups=(
+                    get_scope_groups(scope)
+                    if token_lookups and self.revocation_groups else None))
+        elif not resolved:
+            # Get user instance if it is not already in the scope.
+            user._wrapped = await self.get_user(scope)
 
     async def get_user(self, scope):
-        token_key_string = self.get_token_key_string(scope)
-        if not token_key_string:
+        token_lookups = self.get_token_lookups(scope)
+        if not token_lookups:
             return AnonymousUser()
+        user, token_key = await get_first_user(
+            token_lookups, get_scope_lookups(scope))
+        if self.revocation_groups and token_key is not None:
+            add_revocation_groups(get_scope_groups(scope), token_key, user)
+        return user
 
-        token_key = self.parse_token_key(token_key_string)
+    def get_token_lookups(self, scope):
+        """
+        Returns ordered list of (middleware to look up user by, token key)
+        pairs, user is got by the first of them which user is found by.
+        """
+
+        backend, token_key = self.get_token_lookup(scope)
         if not token_key:
+            return []
+        return [(backend, token_key)]
+
+    def get_token_lookup(self, scope):
+        """
+        Returns (middleware to look up user by, token key) pair,
+        token key is None if it is not found.
+        """
+
+        return self, self.get_token_key(scope)
+
+    async def get_recorded_user(self, token_key, lookups):
+        """
+        Returns user by token key recorded in the scope lookups ledger
+        by other stacked middleware with the same lookup backend,
+        or looks it up and records it.
+        """
+
+        if lookups is None:
+            return await self.get_user_by_token_key(token_key)
+        lookup = (
+            self if self.lookup_backend is None else self.lookup_backend,
+            token_key)
+        user = lookups.get(lookup)
+        if user is None:
+            user = lookups[lookup] = await self.get_user_by_token_key(token_key)
+        return user
+
+    async def get_user_by_token_key(self, token_key):
+        """Returns user instance by token key or anonymous user instance."""
+
+        metrics_sink = self.metrics_sink
+        rejected_token_cache = self.rejected_token_cache
+        if rejected_token_cache is not None and token_key in rejected_token_cache:
+            if metrics_sink is not None:
+                metrics_sink.count(OUTCOME_NOT_FOUND)
+            return AnonymousUser()
+
+        if metrics_sink is not None:
+            started = time.perf_counter()
+        try:
+            user = await self._lookup_user_instance(token_key)
+        except CircuitOpen as exception:
+            if metrics_sink is not None:
+                metrics_sink.count(OUTCOME_CIRCUIT_OPEN)
+            return self.get_fallback_user(
+                token_key, self.circuit_open_policy, exception)
+        except ExecutorQueueFull as exception:
+            if metrics_sink is not None:
+                metrics_sink.count(OUTCOME_QUEUE_FULL)
+            return self.get_fallback_user(
+                token_key, self.circuit_open_policy, exception)
+        except asyncio.TimeoutError:
+            if self.lookup_timeout is None:
+                raise
+            if metrics_sink is not None:
+                metrics_sink.timing(
+                    STAGE_USER_INSTANCE, time.perf_counter() - started)
+                metrics_sink.count(OUTCOME_TIMEOUT)
+            return self.get_fallback_user(
+                token_key, self.lookup_timeout_policy,
+                UserLookupTimeout(
+                    f"User lookup exceeded {self.lookup_timeout}s deadline"))
+        if metrics_sink is not None:
+            metrics_sink.timing(STAGE_USER_INSTANCE, time.perf_counter() - started)
+            metrics_sink.count(
+                OUTCOME_NOT_FOUND if user is None else OUTCOME_AUTHENTICATED)
+
+        if user is None:
+            if rejected_token_cache is not None:
+                rejected_token_cache.set(token_key, True)
             return AnonymousUser()
+        if self.stale_user_cache is not None:
+            self.stale_user_cache.set(token_key, user, user_pk=user.pk)
+        return user
+
+    async def _lookup_user_instance(self, token_key):
+        if self._lookups is None:
+            return await self._get_user_instance(token_key)
+        return await self._lookups.do(
+            token_key, self._get_user_instance, token_key)
+
+    async def _get_user_instance(self, token_key):
+        # coalesced lookup records one circuit breaker outcome
+        if self.circuit_breaker is None:
+            return await self._wait_user_instance(token_key)
+        return await self.circuit_breaker.call(
+            self._wait_user_instance, token_key)
+
+    async def _wait_user_instance(self, token_key):
+        lookup = self.get_user_instance(token_key)
+        if self.lookup_timeout is None:
+            return await lookup
+        return await asyncio.wait_for(lookup, self.lookup_timeout)
+
+    def get_fallback_user(self, token_key, policy, exception):
+        """
+        Returns user by the policy if user instance lookup failed.
+        "reject" policy raises the exception,
+        "stale" policy returns user remembered by stale_user_cache,
+        anonymous user is returned otherwise.
+        """
+
+        if policy == FALLBACK_REJECT:
+            raise exception
+        if policy == FALLBACK_STALE and self.stale_user_cache is not None:
+            user = self.stale_user_cache.get(token_key)
+            if user is not None:
+                return user
+        return AnonymousUser()
+
+    async def reject(self, scope, send, exception):
+        """
+        Refuses connection which user instance lookup is failed for
+        by "reject" policy, inner application is not called.
+        Websocket handshake is closed, HTTP request gets 403 response,
+        the exception is raised for other scope types.
+        """
+
+        scope_type = scope.get("type")
+        if scope_type == "websocket":
+            await send({"type": "websocket.close", "code": REJECT_CLOSE_CODE})
+        elif scope_type == "http":
+            await send({
+                "type": "http.response.start", "status": 403, "headers": [],
+            })
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            raise exception
+
+    def _check_fallback_policy(self, policy):
+        if policy not in FALLBACK_POLICIES:
+            raise ImproperlyConfigured(
+                f"Unknown fallback policy {policy!r}, "
+                f"expected one of {', '.join(FALLBACK_POLICIES)}")
+        if policy == FALLBACK_STALE and self.stale_user_cache is None:
+            raise ImproperlyConfigured(
+                '"stale" fallback policy requires stale_user_cache')
+
+    def get_token_key(self, scope):
+        """Get token key string from the scope and parse token key from it."""
+
+        if self.metrics_sink is not None:
+            return self._get_measured_token_key(scope)
+
+        token_key_string = self.get_token_key_string(scope)
+        if not token_key_string:
+            return None
+        return self.parse_token_key(token_key_string)
+
+    def _get_measured_token_key(self, scope):
+        metrics_sink = self.metrics_sink
 
-        user = await self.get_user_instance(token_key)
-        return user or AnonymousUser()
+        started = time.perf_counter()
+        token_key_string = self.get_token_key_string(scope)
+        extracted = time.perf_counter()
+        metrics_sink.timing(STAGE_TOKEN_KEY_STRING, extracted - started)
+        if not token_key_string:
+            metrics_sink.count(OUTCOME_NO_TOKEN)
+            return None
+
+        token_key = self.parse_token_key(token_key_string)
+        metrics_sink.timing(STAGE_PARSE_TOKEN_KEY, time.perf_counter() - extracted)
+        if not token_key:
+            metrics_sink.count(OUTCOME_MALFORMED)
+        return token_key
 
     def get_token_key_string(self, scope):
         """
@@ -70,11 +629,20 @@ class BaseAuthTokenMiddleware(AuthMiddleware):
             "must provide a get_token_key_string(scope) method")
 
     def parse_token_key(self, token_key_string):
-        matched = re.fullmatch(self.token_key_string_regex, token_key_string)
+        matched = self.token_key_string_pattern.fullmatch(token_key_string)
         if not matched:
             return None
         return matched.group(1)
 
+    @cached_property
+    def token_key_string_pattern(self):
+        """
+        Compiled token key string regex.
+        Compiled once per middleware instance on first use.
+        """
+
+        return re.compile(self.token_key_string_regex)
+
     @property
     def token_key_string_regex(self):
         """
@@ -99,8 +667,7 @@ class BaseAuthTokenMiddleware(AuthMiddleware):
         elif not isinstance(header_name, bytes):
             raise ValueError("Header name must be string or bytes")
 
-        headers = dict(scope["headers"])
-        value = headers.get(header_name, headers.get(header_name.lower()))
+        value = get_scope_request(scope).header(header_name)
 
         if not value:
             return None
@@ -116,11 +683,12 @@ class HeaderAuthTokenMiddleware(BaseAuthTokenMiddleware):
     def __init__(self, *args, header_name=None, keyword=None, **kwargs):
         self.header_name = str(header_name or self.header_name)
         self.keyword = str(keyword or self.keyword)
+        self._raw_header_name = self.header_name.encode()
 
         super().__init__(*args, **kwargs)
 
     def get_token_key_string(self, scope):
-        return self.get_scope_header_value(scope, self.header_name)
+        return self.get_scope_header_value(scope, self._raw_header_name)
 
     @property
     def token_key_string_regex(self):
@@ -143,14 +711,7 @@ class CookieAuthTokenMiddleware(BaseAuthTokenMiddleware):
         super().__init__(*args, **kwargs)
 
     def get_token_key_string(self, scope):
-        header_name = "Cookie"
-        cookie_raw_data = self.get_scope_header_value(scope, header_name) or ""
-        cookie = BaseCookie()
-        cookie.load(cookie_raw_data)
-        cookie_item = cookie.get(self.cookie_name)
-        if not cookie_item:
-            return None
-        return cookie_item.value
+        return get_scope_request(scope).cookie(self.cookie_name)
 
 
 class QueryStringAuthTokenMiddleware(BaseAuthTokenMiddleware):
@@ -164,9 +725,220 @@ class QueryStringAuthTokenMiddleware(BaseAuthTokenMiddleware):
         super().__init__(*args, **kwargs)
 
     def get_token_key_string(self, scope):
-        raw_query_params = scope["query_string"].decode()
-        query_params = parse_qs(raw_query_params)
-        query_param = query_params.get(self.query_param)
-        if not query_param:
+        return get_scope_request(scope).query_param(self.query_param)
+
+
+class SchemeAuthTokenMiddleware(BaseAuthTokenMiddleware):
+    """
+    Middleware which parses token key from request header by its scheme
+    keyword and looks up user by the backend middleware of the keyword.
+    Header value is split once and backend is found by dict lookup,
+    so schemes count does not affect per connection cost.
+    """
+
+    header_name = "Authorization"
+
+    # dict of backend auth token middlewares by scheme keywords
+    schemes = None
+
+    def __init__(self, *args, header_name=None, schemes=None, **kwargs):
+        self.header_name = str(header_name or self.header_name)
+        self.schemes = dict(schemes or self.schemes or {})
+        if not self.schemes:
+            raise ImproperlyConfigured(
+                "SchemeAuthTokenMiddleware requires schemes")
+        self._raw_header_name = self.header_name.encode()
+        self._scheme_patterns = {
+            keyword: (backend, re.compile(backend.token_regex))
+            for keyword, backend in self.schemes.items()
+        }
+
+        super().__init__(*args, **kwargs)
+
+    def get_token_lookup(self, scope):
+        backend_token_key = self.get_token_key(scope)
+        if not backend_token_key:
+            return self, None
+        return backend_token_key
+
+    def get_token_key_string(self, scope):
+        return self.get_scope_header_value(scope, self._raw_header_name)
+
+    def parse_token_key(self, token_key_string):
+        """
+        Returns (backend middleware, token key) pair by the scheme keyword
+        or None if scheme is unknown or token key does not match
+        the backend token regex.
+        """
+
+        keyword, _, token_key = token_key_string.partition(" ")
+        scheme = self._scheme_patterns.get(keyword)
+        if scheme is None or not token_key:
+            return None
+        backend, pattern = scheme
+        if not pattern.fullmatch(token_key):
             return None
-        return query_param[0]
+        return backend, token_key
+
+    async def get_user_instance(self, token_key):
+        raise NotImplementedError(
+            "SchemeAuthTokenMiddleware looks up users by scheme backends")
+
+
+class TokenSource:
+    """
+    Base token key source of MultiSourceAuthTokenMiddleware.
+    Works like token key string getting and parsing stages of
+    BaseAuthTokenMiddleware.
+    """
+
+    # regex need to fullmatch token key
+    token_regex = r".*"
+
+    def __init__(self, token_regex=None):
+        self.token_regex = str(token_regex or self.token_regex)
+        self.token_key_string_pattern = re.compile(self.token_key_string_regex)
+
+    @property
+    def token_key_string_regex(self):
+        """
+        Regex to parse token key from token key string.
+        Token key need to be in first group.
+        """
+
+        return rf"({self.token_regex})"
+
+    def get_token_key_string(self, scope, header_values):
+        """
+        Must be implemented by subclass
+        to get token key string from the scope or found header values
+        (dict of raw header values by lowercased raw header names).
+        Implementation need to returns string to parse token key from or None.
+        """
+        raise NotImplementedError(
+            "subclasses of TokenSource must provide "
+            "a get_token_key_string(scope, header_values) method")
+
+    def parse_token_key(self, token_key_string):
+        matched = self.token_key_string_pattern.fullmatch(token_key_string)
+        if not matched:
+            return None
+        return matched.group(1)
+
+
+class HeaderTokenSource(TokenSource):
+    """Token key source which parses token key from request header."""
+
+    def __init__(self, header_name, keyword, token_regex=None):
+        self.header_name = header_name.lower().encode()
+        self.keyword = keyword
+
+        super().__init__(token_regex=token_regex)
+
+    def get_token_key_string(self, scope, header_values):
+        value = header_values.get(self.header_name)
+        if not value:
+            return None
+        return value.decode()
+
+    @property
+    def token_key_string_regex(self):
+        return rf"{self.keyword} ({self.token_regex})"
+
+
+class CookieTokenSource(TokenSource):
+    """Token key source which parses token key from request cookie."""
+
+    def __init__(self, cookie_name, token_regex=None):
+        self.cookie_name = cookie_name
+
+        super().__init__(token_regex=token_regex)
+
+    def get_token_key_string(self, scope, header_values):
+        return get_scope_request(scope).cookie(self.cookie_name)
+
+
+class QueryStringTokenSource(TokenSource):
+    """Token key source which parses token key from request query string."""
+
+    def __init__(self, query_param, token_regex=None):
+        self.query_param = query_param
+
+        super().__init__(token_regex=token_regex)
+
+    def get_token_key_string(self, scope, header_values):
+        return get_scope_request(scope).query_param(self.query_param)
+
+
+class MultiSourceAuthTokenMiddleware(BaseAuthTokenMiddleware):
+    """
+    Base middleware which parses token keys from ordered token sources
+    and gets user by the first of them which user is found by,
+    like nested middlewares do.
+    Headers are indexed once for all sources (see ScopeRequest).
+    """
+
+    # ordered TokenSource instances
+    sources = ()
+
+    def __init__(self, *args, sources=None, **kwargs):
+        self.sources = tuple(sources or self.sources)
+
+        super().__init__(*args, **kwargs)
+
+    def get_token_key(self, scope):
+        token_keys = self.get_token_keys(scope)
+        return token_keys[0] if token_keys else None
+
+    def get_token_lookups(self, scope):
+        return [(self, token_key) for token_key in self.get_token_keys(scope)]
+
+    def get_token_keys(self, scope):
+        """Returns distinct token keys parsed from sources in their order."""
+
+        if self.metrics_sink is not None:
+            return self._get_measured_token_keys(scope)
+
+        header_values = get_scope_request(scope).lower_headers
+        token_keys = []
+
+        for source in self.sources:
+            token_key_string = source.get_token_key_string(scope, header_values)
+            if not token_key_string:
+                continue
+            token_key = source.parse_token_key(token_key_string)
+            if token_key and token_key not in token_keys:
+                token_keys.append(token_key)
+        return token_keys
+
+    def _get_measured_token_keys(self, scope):
+        metrics_sink = self.metrics_sink
+        extracting = parsing = 0.0
+        found = False
+        token_keys = []
+
+        started = time.perf_counter()
+        header_values = get_scope_request(scope).lower_headers
+
+        for source in self.sources:
+            token_key_string = source.get_token_key_string(scope, header_values)
+            extracted = time.perf_counter()
+            extracting += extracted - started
+            if not token_key_string:
+                started = extracted
+                continue
+            found = True
+            token_key = source.parse_token_key(token_key_string)
+            started = time.perf_counter()
+            parsing += started - extracted
+            if token_key and token_key not in token_keys:
+                token_keys.append(token_key)
+
+        metrics_sink.timing(STAGE_TOKEN_KEY_STRING, extracting)
+        if not found:
+            metrics_sink.count(OUTCOME_NO_TOKEN)
+            return token_keys
+        metrics_sink.timing(STAGE_PARSE_TOKEN_KEY, parsing)
+        if not token_keys:
+            metrics_sink.count(OUTCOME_MALFORMED)
+        return token_keys
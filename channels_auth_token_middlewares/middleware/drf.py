@@ -18,28 +18,257 @@ Django REST framework middlewares.
 """
 
 
+import time
+
 from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import F
 
 from channels.db import database_sync_to_async
 
-from .base import HeaderAuthTokenMiddleware, QueryStringAuthTokenMiddleware
+from ..cache import TieredUserCache
+from ..concurrency import BatchLoader
+from ..users import compact_user_class
+from .base import (
+    HeaderAuthTokenMiddleware, HeaderTokenSource,
+    MultiSourceAuthTokenMiddleware, QueryStringAuthTokenMiddleware,
+    QueryStringTokenSource,
+)
+
+
+def _setup_compact_user_class(compact_user_fields, user_cache):
+    if isinstance(user_cache, TieredUserCache):
+        raise ImproperlyConfigured(
+            "compact_user_fields could not be used with TieredUserCache")
+    return compact_user_class(compact_user_fields)
+
+
+def _blacklisted_token_classes(token_classes):
+    if not apps.is_installed("rest_framework_simplejwt.token_blacklist"):
+        return False
+    from rest_framework_simplejwt.tokens import BlacklistMixin
+
+    return any(
+        issubclass(token_class, BlacklistMixin) for token_class in token_classes)
+
+
+# annotation name of token key in batch users lookup
+_TOKEN_KEY_ANNOTATION = "_channels_auth_token_key"
+
 
+class UserQuerysetMixin:
+    """User queryset projection and related objects loading mixin."""
 
-class DRFAuthTokenMiddlewareMixin:
+    # opt-in user model field names to load only
+    user_only = None
+
+    # opt-in user model field names to defer
+    user_defer = None
+
+    # opt-in user relations to load by the same query
+    user_select_related = None
+
+    # opt-in user relations to prefetch
+    user_prefetch_related = None
+
+    _custom_user_queryset = False
+
+    def _setup_user_queryset(self, user_only=None, user_defer=None,
+                             user_select_related=None,
+                             user_prefetch_related=None):
+        if user_only is not None:
+            self.user_only = user_only
+        if user_defer is not None:
+            self.user_defer = user_defer
+        if user_select_related is not None:
+            self.user_select_related = user_select_related
+        if user_prefetch_related is not None:
+            self.user_prefetch_related = user_prefetch_related
+
+        self._custom_user_queryset = (
+            self.user_only is not None or self.user_defer is not None
+            or self.user_select_related is not None
+            or self.user_prefetch_related is not None
+            or type(self).get_user_queryset
+            is not UserQuerysetMixin.get_user_queryset
+        )
+        if not self._custom_user_queryset:
+            return
+        if self.compact_user_fields is not None:
+            raise ImproperlyConfigured(
+                "user queryset options could not be used "
+                "with compact_user_fields")
+        if isinstance(self.user_cache, TieredUserCache):
+            raise ImproperlyConfigured(
+                "user queryset options could not be used "
+                "with TieredUserCache")
+
+    def get_user_queryset(self):
+        """
+        Returns user queryset users are looked up by.
+        Could be overridden to customize users loading.
+        """
+
+        queryset = get_user_model()._default_manager.all()
+        if self.user_only is not None:
+            queryset = queryset.only(*self.user_only)
+        if self.user_defer is not None:
+            queryset = queryset.defer(*self.user_defer)
+        if self.user_select_related is not None:
+            queryset = queryset.select_related(*self.user_select_related)
+        if self.user_prefetch_related is not None:
+            queryset = queryset.prefetch_related(*self.user_prefetch_related)
+        return queryset
+
+
+class DRFAuthTokenMiddlewareMixin(UserQuerysetMixin):
     """Django REST framework auth token middleware mixin."""
 
+    # opt-in TokenCache or TieredUserCache instance to cache users by token key
+    user_cache = None
+
+    # opt-in window in seconds to collect token keys to look up by one query
+    batch_window = None
+
+    # max token keys count to look up by one query
+    batch_size = 100
+
+    # opt-in user model field names to populate CompactUser with
+    compact_user_fields = None
+
+    # opt-in UserRegistry instance to share user objects between connections
+    user_registry = None
+
+    _batch_loader = None
+    _compact_user_class = None
+    _compact_user_lookups = None
+
+    def __init__(self, *args, user_cache=None, batch_window=None,
+                 batch_size=None, compact_user_fields=None, user_registry=None,
+                 user_only=None, user_defer=None, user_select_related=None,
+                 user_prefetch_related=None, **kwargs):
+        self._setup(
+            user_cache=user_cache,
+            batch_window=batch_window, batch_size=batch_size,
+            compact_user_fields=compact_user_fields,
+            user_registry=user_registry,
+            user_only=user_only, user_defer=user_defer,
+            user_select_related=user_select_related,
+            user_prefetch_related=user_prefetch_related)
+        super().__init__(*args, **kwargs)
+
+    def _setup(self, user_cache=None, batch_window=None, batch_size=None,
+               compact_user_fields=None, user_registry=None, **kwargs):
+        if user_cache is not None:
+            self.user_cache = user_cache
+        if user_registry is not None:
+            self.user_registry = user_registry
+        if batch_window is not None:
+            self.batch_window = batch_window
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if compact_user_fields is not None:
+            self.compact_user_fields = compact_user_fields
+        if self.lookup_backend is None:
+            # stacked DRF auth token middlewares share token key lookups
+            self.lookup_backend = "drf"
+        if self.compact_user_fields is not None:
+            self._compact_user_class = _setup_compact_user_class(
+                self.compact_user_fields, self.user_cache)
+            self._compact_user_lookups = [
+                f"user__{field}" for field in self._compact_user_class.fields]
+        self._setup_user_queryset(**kwargs)
+
+        if self.batch_window is not None:
+            self._batch_loader = BatchLoader(
+                self.get_drf_users,
+                window=self.batch_window, max_batch_size=self.batch_size)
+
     async def get_drf_user_instance(self, token_key):
+        registry = self.user_registry
+        if registry is not None:
+            user = registry.get_by_token(token_key)
+            if user is not None:
+                return user
+            generation = registry.generation
+
+        user = None
+        user_cache = self.user_cache
+        if user_cache is not None:
+            user = await user_cache.aget(token_key)
+        cached = user is not None
+
+        if user is None:
+            if user_cache is not None:
+                cache_generation = await user_cache.aget_generation()
+            user = await self.load_drf_user(token_key)
+            if user is None:
+                return None
+
+        if registry is not None:
+            user = registry.intern(user, generation, token_key=token_key)
+        if user_cache is not None and not cached:
+            await user_cache.aset(token_key, user, cache_generation)
+        return user
+
+    async def load_drf_user(self, token_key):
+        """Returns user instance loaded by token key or None."""
+
+        if self._batch_loader is not None:
+            return await self._batch_loader.load(token_key)
+
+        if self._compact_user_class is not None:
+            Token = apps.get_model("authtoken", "Token")
+            values = await Token.objects.filter(key=token_key).values_list(
+                *self._compact_user_lookups).afirst()
+            if values is None:
+                return None
+            return self._compact_user_class(*values)
+
+        if not self._custom_user_queryset:
+            Token = apps.get_model("authtoken", "Token")
+            try:
+                token = await Token.objects.select_related("user").aget(
+                    key=token_key)
+            except Token.DoesNotExist:
+                return None
+            return token.user
+
+        return await self.get_user_queryset().filter(
+            **{f"{self._token_query_name}__key": token_key}).afirst()
+
+    @database_sync_to_async
+    def get_drf_users(self, token_keys):
+        """Returns dict of users by token keys found by one query."""
+
+        if self._compact_user_class is not None:
+            Token = apps.get_model("authtoken", "Token")
+            tokens = Token.objects.filter(key__in=token_keys)
+            return {
+                key: self._compact_user_class(*values)
+                for key, *values in tokens.values_list(
+                    "key", *self._compact_user_lookups)
+            }
+
+        token_key_lookup = f"{self._token_query_name}__key"
+        users = self.get_user_queryset().filter(
+            **{f"{token_key_lookup}__in": token_keys},
+        ).annotate(**{_TOKEN_KEY_ANNOTATION: F(token_key_lookup)})
+        return {
+            user.__dict__.pop(_TOKEN_KEY_ANNOTATION): user for user in users
+        }
+
+    @property
+    def _token_query_name(self):
+        # user model to token relation query name ("auth_token")
         Token = apps.get_model("authtoken", "Token")
-        try:
-            token = await Token.objects.select_related("user").aget(key=token_key)
-        except Token.DoesNotExist:
-            return None
-        return token.user
+        return Token._meta.get_field("user").related_query_name()
 
 
 class DRFAuthTokenMiddleware(
-    HeaderAuthTokenMiddleware,
     DRFAuthTokenMiddlewareMixin,
+    HeaderAuthTokenMiddleware,
 ):
     """
     Django REST framework auth token middleware.
@@ -56,8 +285,8 @@ class DRFAuthTokenMiddleware(
 
 
 class QueryStringDRFAuthTokenMiddleware(
-    QueryStringAuthTokenMiddleware,
     DRFAuthTokenMiddlewareMixin,
+    QueryStringAuthTokenMiddleware,
 ):
     """Django REST framework auth token middleware with query string token."""
 
@@ -67,40 +296,308 @@ class QueryStringDRFAuthTokenMiddleware(
         return await self.get_drf_user_instance(token_key)
 
 
-def DRFAuthTokenMiddlewareStack(inner):
-    return DRFAuthTokenMiddleware(QueryStringDRFAuthTokenMiddleware(inner))
+class MultiSourceDRFAuthTokenMiddleware(
+    DRFAuthTokenMiddlewareMixin,
+    MultiSourceAuthTokenMiddleware,
+):
+    """
+    Django REST framework auth token middleware with multiple token sources.
+    By default token key is taken from header or query string.
+    """
+
+    sources = (
+        HeaderTokenSource("Authorization", "Token", token_regex="[0-9a-f]{40}"),
+        QueryStringTokenSource("token"),
+    )
+
+    async def get_user_instance(self, token_key):
+        return await self.get_drf_user_instance(token_key)
+
+
+def DRFAuthTokenMiddlewareStack(inner, **kwargs):
+    return MultiSourceDRFAuthTokenMiddleware(inner, **kwargs)
 
 
-class SimpleJWTAuthTokenMiddlewareMixin:
+class SimpleJWTAuthTokenMiddlewareMixin(UserQuerysetMixin):
     """Simple JWT auth token middleware mixin."""
 
     _auth = None
     _exceptions = None
-
-    def _setup(self):
+    _user_id_claim = None
+    _user_id_field = None
+    _check_user_is_active = True
+    _user_pk_field = None
+    _claims_user_class = None
+    _compact_user_class = None
+
+    # opt-in TokenCache or TieredUserCache instance to cache users by user id
+    user_cache = None
+
+    # opt-in BoundedExecutor instance to validate tokens
+    # off the thread sensitive executor
+    jwt_executor = None
+
+    # validate tokens on the event loop
+    jwt_validate_on_loop = False
+
+    # opt-in TokenCache instance to cache validated tokens
+    # by raw token until their expiration
+    jwt_token_cache = None
+
+    # populate claims backed user which loads user instance lazily
+    jwt_claims_user = False
+
+    # opt-in user model field names to populate CompactUser with
+    compact_user_fields = None
+
+    # opt-in UserRegistry instance to share user objects between connections
+    user_registry = None
+
+    def __init__(self, *args, user_cache=None, jwt_executor=None,
+                 jwt_validate_on_loop=None, jwt_token_cache=None,
+                 jwt_claims_user=None, compact_user_fields=None,
+                 user_registry=None, user_only=None, user_defer=None,
+                 user_select_related=None, user_prefetch_related=None,
+                 **kwargs):
+        self._setup(
+            user_cache=user_cache, jwt_executor=jwt_executor,
+            jwt_validate_on_loop=jwt_validate_on_loop,
+            jwt_token_cache=jwt_token_cache, jwt_claims_user=jwt_claims_user,
+            compact_user_fields=compact_user_fields,
+            user_registry=user_registry,
+            user_only=user_only, user_defer=user_defer,
+            user_select_related=user_select_related,
+            user_prefetch_related=user_prefetch_related)
+        super().__init__(*args, **kwargs)
+
+    def _setup(self, user_cache=None, jwt_executor=None,
+               jwt_validate_on_loop=None, jwt_token_cache=None,
+               jwt_claims_user=None, compact_user_fields=None,
+               user_registry=None, **kwargs):
         from rest_framework_simplejwt.authentication import JWTAuthentication
         from rest_framework_simplejwt.exceptions import (
             AuthenticationFailed, InvalidToken, TokenError
         )
+        from rest_framework_simplejwt.settings import api_settings
 
         self._auth = JWTAuthentication()
         self._exceptions = (AuthenticationFailed, InvalidToken, TokenError)
-
-    @database_sync_to_async
-    def get_jwt_user_instance(self, token_key):
+        self._user_id_claim = api_settings.USER_ID_CLAIM
+        self._user_id_field = api_settings.USER_ID_FIELD
+        self._check_user_is_active = getattr(
+            api_settings, "CHECK_USER_IS_ACTIVE", True)
+        pk_field = get_user_model()._meta.pk
+        if api_settings.USER_ID_FIELD in ("pk", pk_field.name):
+            self._user_pk_field = pk_field
+
+        if jwt_executor is not None:
+            self.jwt_executor = jwt_executor
+        if jwt_validate_on_loop is not None:
+            self.jwt_validate_on_loop = jwt_validate_on_loop
+        if jwt_token_cache is not None:
+            self.jwt_token_cache = jwt_token_cache
+        if jwt_claims_user is not None:
+            self.jwt_claims_user = jwt_claims_user
+        if (
+            (self.jwt_validate_on_loop or self.jwt_token_cache is not None)
+            and _blacklisted_token_classes(api_settings.AUTH_TOKEN_CLASSES)
+        ):
+            # Blacklisted tokens are checked by DB query on validation,
+            # validated tokens cache is not invalidated on blacklisting.
+            raise ImproperlyConfigured(
+                "jwt_validate_on_loop and jwt_token_cache could not be used "
+                "with Simple JWT token_blacklist app and blacklisted "
+                "AUTH_TOKEN_CLASSES")
+        if self.jwt_claims_user:
+            if api_settings.CHECK_REVOKE_TOKEN:
+                raise ImproperlyConfigured(
+                    "jwt_claims_user could not be used with "
+                    "Simple JWT CHECK_REVOKE_TOKEN")
+            from ..claims import ClaimsUser
+            self._claims_user_class = ClaimsUser
+        if self.lookup_backend is None:
+            # stacked Simple JWT auth token middlewares share token key
+            # lookups, claims backed users are not shared with loaded ones
+            self.lookup_backend = (
+                "simplejwt_claims" if self.jwt_claims_user else "simplejwt")
+        if compact_user_fields is not None:
+            self.compact_user_fields = compact_user_fields
+        if user_cache is not None:
+            self.user_cache = user_cache
+        if user_registry is not None:
+            self.user_registry = user_registry
+        for name in ("user_cache", "user_registry"):
+            if getattr(self, name) is None:
+                continue
+            if self._user_pk_field is None:
+                raise ImproperlyConfigured(
+                    f"{name} requires Simple JWT USER_ID_FIELD "
+                    "to be user model primary key")
+            if api_settings.CHECK_REVOKE_TOKEN:
+                raise ImproperlyConfigured(
+                    f"{name} could not be used with "
+                    "Simple JWT CHECK_REVOKE_TOKEN")
+        if self.compact_user_fields is not None:
+            self._compact_user_class = _setup_compact_user_class(
+                self.compact_user_fields, self.user_cache)
+        self._setup_user_queryset(**kwargs)
+        if self._custom_user_queryset and api_settings.CHECK_REVOKE_TOKEN:
+            raise ImproperlyConfigured(
+                "user queryset options could not be used with "
+                "Simple JWT CHECK_REVOKE_TOKEN")
+        if (
+            self.user_only is not None and self._check_user_is_active
+            and "is_active" not in self.user_only
+            and any(
+                field.name == "is_active"
+                for field in get_user_model()._meta.concrete_fields)
+        ):
+            # is_active is checked for every user
+            self.user_only = (*self.user_only, "is_active")
+
+    async def get_jwt_user_instance(self, token_key):
         if self._auth is None or self._exceptions is None:
             raise RuntimeError("_setup method has to be called before.")
 
+        if (
+            self.user_cache is None and self.user_registry is None
+            and self.jwt_executor is None and self.jwt_token_cache is None
+            and not self.jwt_validate_on_loop and not self.jwt_claims_user
+        ):
+            return await self._get_jwt_user_instance(token_key)
+
+        validated_token = await self.get_jwt_validated_token(token_key)
+        if validated_token is None:
+            return None
+
+        if self.jwt_claims_user:
+            return self._claims_user_class(validated_token, self.load_jwt_user)
+        return await self.load_jwt_user(validated_token)
+
+    async def load_jwt_user(self, validated_token):
+        """Returns user instance by validated token or None."""
+
+        user_id = validated_token.get(self._user_id_claim)
+        registry = self.user_registry
+        if registry is not None:
+            if user_id is not None:
+                user = registry.get(user_id)
+                if user is not None:
+                    return user
+            generation = registry.generation
+
+        user = None
+        user_cache = self.user_cache
+        if user_cache is not None and user_id is not None:
+            user = await user_cache.aget_user(user_id)
+        cached = user is not None
+
+        if user is None:
+            if user_cache is not None:
+                cache_generation = await user_cache.aget_generation(user_id)
+            user = await self.get_jwt_user(validated_token)
+            if user is None:
+                return None
+            if self._compact_user_class is not None:
+                user = self._compact_user_class.from_user(user)
+
+        if registry is not None:
+            user = registry.intern(user, generation)
+        if user_cache is not None and not cached:
+            await user_cache.aset_user(user, cache_generation)
+        return user
+
+    async def get_jwt_validated_token(self, token_key):
+        """
+        Returns validated token or None.
+        Token is got from jwt_token_cache if it is set, otherwise
+        it is validated on the event loop if jwt_validate_on_loop is set,
+        by jwt_executor if it is set or by the thread sensitive executor.
+        """
+
+        token_cache = self.jwt_token_cache
+        if token_cache is not None:
+            validated_token = token_cache.get(token_key)
+            if validated_token is not None:
+                return validated_token
+
+        if self.jwt_validate_on_loop:
+            validated_token = self._get_jwt_validated_token(token_key)
+        elif self.jwt_executor is not None:
+            validated_token = await self.jwt_executor.run(
+                self._get_jwt_validated_token, token_key)
+        else:
+            validated_token = await database_sync_to_async(
+                self._get_jwt_validated_token)(token_key)
+
+        if validated_token is not None and token_cache is not None:
+            self.set_jwt_token_cache(token_key, validated_token)
+        return validated_token
+
+    def set_jwt_token_cache(self, token_key, validated_token):
+        """Cache validated token until its expiration."""
+
+        ttl = None
+        expires_at = validated_token.get("exp")
+        if expires_at is not None:
+            ttl = expires_at - time.time()
+            if ttl <= 0:
+                return
+            ttl = min(ttl, self.jwt_token_cache.ttl)
+
+        # Entry is invalidated with the user if user id is primary key.
+        user_pk = None
+        user_id = validated_token.get(self._user_id_claim)
+        if user_id is not None and self._user_pk_field is not None:
+            try:
+                user_pk = self._user_pk_field.to_python(user_id)
+            except ValidationError:
+                pass
+        self.jwt_token_cache.set(
+            token_key, validated_token, user_pk=user_pk, ttl=ttl)
+
+    def _get_jwt_validated_token(self, token_key):
         try:
-            validated_token = self._auth.get_validated_token(token_key)
+            return self._auth.get_validated_token(token_key)
+        except self._exceptions:
+            return None
+
+    @database_sync_to_async
+    def get_jwt_user(self, validated_token):
+        try:
+            return self._get_jwt_user(validated_token)
+        except self._exceptions:
+            return None
+
+    def _get_jwt_user(self, validated_token):
+        if not self._custom_user_queryset:
             return self._auth.get_user(validated_token)
+
+        # Simple JWT JWTAuthentication.get_user checks with user queryset
+        user_id = validated_token.get(self._user_id_claim)
+        if user_id is None:
+            return None
+        user = self.get_user_queryset().filter(
+            **{self._user_id_field: user_id}).first()
+        if user is None or (self._check_user_is_active and not user.is_active):
+            return None
+        return user
+
+    @database_sync_to_async
+    def _get_jwt_user_instance(self, token_key):
+        try:
+            validated_token = self._auth.get_validated_token(token_key)
+            user = self._get_jwt_user(validated_token)
         except self._exceptions:
             return None
+        if user is not None and self._compact_user_class is not None:
+            return self._compact_user_class.from_user(user)
+        return user
 
 
 class SimpleJWTAuthTokenMiddleware(
-    HeaderAuthTokenMiddleware,
     SimpleJWTAuthTokenMiddlewareMixin,
+    HeaderAuthTokenMiddleware,
 ):
     """
     Simple JWT auth token middleware.
@@ -111,30 +608,39 @@ class SimpleJWTAuthTokenMiddleware(
     header_name = "Authorization"
     keyword = "Bearer"
 
-    def __init__(self, *args, **kwargs):
-        self._setup()
-        return super().__init__(*args, **kwargs)
-
     async def get_user_instance(self, token_key):
         return await self.get_jwt_user_instance(token_key)
 
 
 class QueryStringSimpleJWTAuthTokenMiddleware(
-    QueryStringAuthTokenMiddleware,
     SimpleJWTAuthTokenMiddlewareMixin,
+    QueryStringAuthTokenMiddleware,
 ):
     """Simple JWT auth token middleware with query string token."""
 
     query_param = "token"
 
-    def __init__(self, *args, **kwargs):
-        self._setup()
-        return super().__init__(*args, **kwargs)
+    async def get_user_instance(self, token_key):
+        return await self.get_jwt_user_instance(token_key)
+
+
+class MultiSourceSimpleJWTAuthTokenMiddleware(
+    SimpleJWTAuthTokenMiddlewareMixin,
+    MultiSourceAuthTokenMiddleware,
+):
+    """
+    Simple JWT auth token middleware with multiple token sources.
+    By default token key is taken from header or query string.
+    """
+
+    sources = (
+        HeaderTokenSource("Authorization", "Bearer"),
+        QueryStringTokenSource("token"),
+    )
 
     async def get_user_instance(self, token_key):
         return await self.get_jwt_user_instance(token_key)
 
 
-def SimpleJWTAuthTokenMiddlewareStack(inner):
-    return SimpleJWTAuthTokenMiddleware(
-        QueryStringSimpleJWTAuthTokenMiddleware(inner))
+def SimpleJWTAuthTokenMiddlewareStack(inner, **kwargs):
+    return MultiSourceSimpleJWTAuthTokenMiddleware(inner, **kwargs)
@@ -0,0 +1,140 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Push based disconnect of revoked token and deactivated user connections
+by token and user channel layer groups.
+"""
+
+
+import hashlib
+import logging
+
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+
+from channels.layers import get_channel_layer
+
+
+logger = logging.getLogger(__name__)
+
+# channel layer groups names prefix
+GROUP_PREFIX = "channels_auth_token"
+
+# scope key of revocation groups list of authenticated connection
+SCOPE_GROUPS_KEY = "auth_token_groups"
+
+# type of revocation message sent to the groups
+REVOKED_MESSAGE_TYPE = "auth_token.revoked"
+
+
+def token_group(token_key):
+    """Returns revocation group name of token key connections."""
+
+    return f"{GROUP_PREFIX}.token.{_digest(token_key)}"
+
+
+def user_group(user_pk):
+    """Returns revocation group name of user connections."""
+
+    return f"{GROUP_PREFIX}.user.{_digest(str(user_pk))}"
+
+
+def _digest(value):
+    # Group names have to be short ASCII strings, raw token keys
+    # should not be exposed to channel layer backend as well.
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+def get_scope_groups(scope):
+    """
+    Returns revocation groups list of the scope, it is placed to the scope
+    on the first call and shared with inner middlewares and consumer.
+    """
+
+    groups = scope.get(SCOPE_GROUPS_KEY)
+    if groups is None:
+        groups = scope[SCOPE_GROUPS_KEY] = []
+    return groups
+
+
+def add_revocation_groups(groups, token_key, user):
+    """Adds token and user revocation groups of authenticated connection."""
+
+    for group in (token_group(token_key), user_group(user.pk)):
+        if group not in groups:
+            groups.append(group)
+
+
+def is_revocation_enabled():
+    """
+    Whether token and user model signals close revoked connections,
+    CHANNELS_AUTH_TOKEN_MIDDLEWARES_REVOCATION setting.
+    """
+
+    return getattr(settings, "CHANNELS_AUTH_TOKEN_MIDDLEWARES_REVOCATION", False)
+
+
+def revoke_token(token_key):
+    """Closes connections authenticated by the token key."""
+
+    _send_revoked(token_group(token_key))
+
+
+def revoke_user(user_pk):
+    """Closes connections of the user."""
+
+    _send_revoked(user_group(user_pk))
+
+
+def _send_revoked(group):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            group, {"type": REVOKED_MESSAGE_TYPE})
+    except Exception:
+        # Unavailable channel layer must not break tokens and users changes.
+        logger.exception("Revocation message is not sent to %s group", group)
+
+
+class RevocableConsumerMixin:
+    """
+    AsyncWebsocketConsumer mixin which adds connection to revocation
+    groups placed to the scope by auth token middlewares
+    and closes it when its token or user is revoked.
+    """
+
+    # websocket close code of revoked connection
+    revoked_close_code = 4001
+
+    async def websocket_connect(self, message):
+        groups = self.scope.get(SCOPE_GROUPS_KEY, ())
+        if self.channel_layer is not None:
+            self.groups = [*self.groups, *groups]
+        await super().websocket_connect(message)
+
+        # Groups of user resolved lazily while connecting.
+        if self.channel_layer is None:
+            return
+        for group in groups:
+            if group not in self.groups:
+                self.groups.append(group)
+                await self.channel_layer.group_add(group, self.channel_name)
+
+    async def auth_token_revoked(self, event):
+        await self.close(code=self.revoked_close_code)
@@ -0,0 +1,109 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Token caches invalidation and connections revocation
+by token and user model signals.
+"""
+
+
+from functools import partial
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .cache import invalidate_token, invalidate_user
+from .revocation import is_revocation_enabled, revoke_token, revoke_user
+
+
+# user instance attribute marking its deactivation by the save
+_DEACTIVATED_ATTR = "_channels_auth_token_deactivated"
+
+
+def token_changed(sender, instance, using=None, **kwargs):
+    _invalidate_token(instance.key, instance.user_id)
+    # Concurrent lookups could cache old committed rows again
+    # until the transaction is committed.
+    transaction.on_commit(
+        partial(_invalidate_token, instance.key, instance.user_id),
+        using=using)
+
+
+def token_deleted(sender, instance, using=None, **kwargs):
+    token_changed(sender, instance, using=using, **kwargs)
+    if is_revocation_enabled():
+        # Rolled back deletion doesn't close connections.
+        transaction.on_commit(
+            partial(revoke_token, instance.key), using=using)
+
+
+def user_saving(sender, instance, using=None, update_fields=None, **kwargs):
+    # Only active to inactive transition closes user connections,
+    # previous state is got by one query if revocation is enabled.
+    if (
+        not is_revocation_enabled() or instance.pk is None
+        or getattr(instance, "is_active", True)
+        or (update_fields is not None and "is_active" not in update_fields)
+    ):
+        return
+    was_active = sender._default_manager.using(using).filter(
+        pk=instance.pk).values_list("is_active", flat=True).first()
+    if was_active:
+        setattr(instance, _DEACTIVATED_ATTR, True)
+
+
+def user_changed(sender, instance, using=None, **kwargs):
+    invalidate_user(instance.pk)
+    transaction.on_commit(partial(invalidate_user, instance.pk), using=using)
+    if instance.__dict__.pop(_DEACTIVATED_ATTR, False):
+        transaction.on_commit(partial(revoke_user, instance.pk), using=using)
+
+
+def user_deleted(sender, instance, using=None, **kwargs):
+    invalidate_user(instance.pk)
+    transaction.on_commit(partial(invalidate_user, instance.pk), using=using)
+    if is_revocation_enabled():
+        transaction.on_commit(partial(revoke_user, instance.pk), using=using)
+
+
+def _invalidate_token(token_key, user_pk):
+    invalidate_token(token_key)
+    invalidate_user(user_pk)
+
+
+def connect_signals():
+    User = get_user_model()
+    pre_save.connect(
+        user_saving, sender=User,
+        dispatch_uid="channels_auth_token_middlewares.user_saving")
+    post_save.connect(
+        user_changed, sender=User,
+        dispatch_uid="channels_auth_token_middlewares.user_saved")
+    post_delete.connect(
+        user_deleted, sender=User,
+        dispatch_uid="channels_auth_token_middlewares.user_deleted")
+
+    if not apps.is_installed("rest_framework.authtoken"):
+        return
+
+    Token = apps.get_model("authtoken", "Token")
+    post_save.connect(
+        token_changed, sender=Token,
+        dispatch_uid="channels_auth_token_middlewares.token_saved")
+    post_delete.connect(
+        token_deleted, sender=Token,
+        dispatch_uid="channels_auth_token_middlewares.token_deleted")
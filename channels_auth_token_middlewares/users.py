@@ -0,0 +1,109 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Compact users.
+"""
+
+
+import functools
+
+from django.contrib.auth import get_user_model
+
+
+class CompactUser:
+    """
+    Compact immutable user with a subset of user model fields in __slots__.
+    Subclasses with fields slots are created by compact_user_class.
+    """
+
+    # weakref is supported to be interned by UserRegistry
+    __slots__ = ("__weakref__",)
+
+    # user model field attnames, primary key attname is the first one
+    fields = ()
+
+    username_field = None
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, *values):
+        for field, value in zip(self.fields, values):
+            object.__setattr__(self, field, value)
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(*(getattr(user, field) for field in cls.fields))
+
+    @property
+    def pk(self):
+        return getattr(self, self.fields[0])
+
+    def get_username(self):
+        return getattr(self, self.username_field)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactUser):
+            return NotImplemented
+        return self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        if self.username_field is not None:
+            return str(self.get_username())
+        return f"{type(self).__name__} {self.pk}"
+
+    def __repr__(self):
+        values = ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self.fields)
+        return f"<{type(self).__name__} {values}>"
+
+
+def compact_user_class(fields):
+    """
+    Returns CompactUser subclass with user model fields slots.
+    Field names are converted to attnames,
+    primary key is always included as the first one.
+    """
+
+    User = get_user_model()
+    attnames = [User._meta.get_field(name).attname for name in fields]
+    pk_attname = User._meta.pk.attname
+    attnames = (pk_attname, *(name for name in attnames if name != pk_attname))
+    return _compact_user_class(User, tuple(dict.fromkeys(attnames)))
+
+
+@functools.lru_cache(maxsize=None)
+def _compact_user_class(User, attnames):
+    username_field = None
+    if getattr(User, "USERNAME_FIELD", None) in attnames:
+        username_field = User.USERNAME_FIELD
+    attrs = {
+        "__slots__": attnames,
+        "__module__": __name__,
+        "fields": attnames,
+        "username_field": username_field,
+    }
+    return type(f"Compact{User.__name__}", (CompactUser,), attrs)
@@ -0,0 +1,189 @@
+# Copyright 2022 Yegor Bitensky
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Token and user caches warming by Django REST framework auth tokens.
+"""
+
+
+import pickle
+import threading
+
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .cache import TieredUserCache, dump_user
+
+
+# warmed cache tiers
+TIER_LOCAL = "local"
+TIER_SHARED = "shared"
+
+_configured_warming_started = False
+_configured_warming_lock = threading.Lock()
+
+
+def iter_token_users(recently_used=None, chunk_size=2000):
+    """
+    Yields (token key, user) pairs of Django REST framework auth tokens
+    streamed by chunks, most recently logged in users first.
+    Auth tokens don't record their usage, so recently_used (seconds)
+    filters tokens by user last login.
+    """
+
+    Token = apps.get_model("authtoken", "Token")
+    tokens = Token.objects.select_related("user").order_by(
+        F("user__last_login").desc(nulls_last=True), "pk")
+    if recently_used is not None:
+        tokens = tokens.filter(
+            user__last_login__gte=timezone.now() - timedelta(
+                seconds=recently_used))
+    for token in tokens.iterator(chunk_size=chunk_size):
+        yield token.key, token.user
+
+
+def warm_user_cache(cache, tier=TIER_SHARED, recently_used=None,
+                    max_entries=None, max_bytes=None, chunk_size=2000):
+    """
+    Fills TieredUserCache shared tier or TokenCache (TieredUserCache local
+    tier) with users by Django REST framework auth tokens.
+    Tokens are streamed by chunks, so only one chunk is kept in memory.
+    Warming stops when max_entries or max_bytes budget (approximate
+    pickled user payloads size) is reached, local tier is bounded
+    by its maxsize as well.
+    Returns dict of warmed entries count and their approximate bytes.
+    """
+
+    if tier == TIER_SHARED:
+        if not isinstance(cache, TieredUserCache):
+            raise ValueError("Shared tier could be warmed for TieredUserCache only")
+        write = _SharedTierWriter(cache, chunk_size)
+    elif tier == TIER_LOCAL:
+        local = cache.local if isinstance(cache, TieredUserCache) else cache
+        if max_entries is None or max_entries > local.maxsize:
+            max_entries = local.maxsize
+        write = _LocalTierWriter(cache)
+    else:
+        raise ValueError(f"Unknown cache tier {tier!r}")
+
+    entries = size = 0
+    token_users = iter_token_users(
+        recently_used=recently_used, chunk_size=chunk_size)
+    try:
+        for token_key, user in token_users:
+            if max_entries is not None and entries >= max_entries:
+                break
+            payload = dump_user(user)
+            payload_size = len(pickle.dumps(payload)) + len(token_key)
+            if max_bytes is not None and size + payload_size > max_bytes:
+                break
+            size += payload_size
+            write(token_key, user, payload)
+            entries += 1
+    finally:
+        token_users.close()
+        write.flush()
+    return {"entries": entries, "bytes": size}
+
+
+class _SharedTierWriter:
+
+    def __init__(self, cache, chunk_size):
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.values = {}
+
+    def __call__(self, token_key, user, payload):
+        self.values[self.cache.make_token_key(token_key)] = user.pk
+        self.values[self.cache.make_user_key(user.pk)] = payload
+        if len(self.values) >= 2 * self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.values:
+            self.cache.shared.set_many(self.values, self.cache.timeout)
+            self.values = {}
+
+
+class _LocalTierWriter:
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __call__(self, token_key, user, payload):
+        if isinstance(self.cache, TieredUserCache):
+            # local tier entries keep user generation
+            self.cache.set_local(token_key, user)
+        else:
+            self.cache.set(token_key, user, user_pk=user.pk)
+
+    def flush(self):
+        pass
+
+
+def start_cache_warming(cache, **kwargs):
+    """
+    Warms cache local tier in the background daemon thread.
+    Cache could be TokenCache or TieredUserCache instance
+    or its dotted import path, kwargs are warm_user_cache kwargs.
+    Returns started thread.
+    """
+
+    thread = threading.Thread(
+        target=_warm_cache, args=(cache,), kwargs=kwargs,
+        name="channels-auth-token-cache-warming", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_configured_cache_warming():
+    """
+    Starts cache warming configured by
+    CHANNELS_AUTH_TOKEN_MIDDLEWARES_WARM_CACHE setting once per process.
+    Returns started thread or None.
+    """
+
+    global _configured_warming_started
+
+    if _configured_warming_started:
+        return None
+    with _configured_warming_lock:
+        if _configured_warming_started:
+            return None
+        _configured_warming_started = True
+
+    # opt-in background warming of in-process users cache tier,
+    # dict of "cache" (instance dotted path) and warm_user_cache kwargs
+    warm_cache = getattr(
+        settings, "CHANNELS_AUTH_TOKEN_MIDDLEWARES_WARM_CACHE", None)
+    if not warm_cache:
+        return None
+    return start_cache_warming(**warm_cache)
+
+
+def _warm_cache(cache, **kwargs):
+    if isinstance(cache, str):
+        cache = import_string(cache)
+    kwargs.setdefault("tier", TIER_LOCAL)
+    try:
+        warm_user_cache(cache, **kwargs)
+    finally:
+        connections.close_all()
@@ -0,0 +1,51 @@
+import os
+import statistics
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "main.settings")
+    django.setup()
+
+
+def setup_test_database():
+    """Create in-memory test database and return its connection."""
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    return connection
+
+
+def create_tokens(count, prefix="bench"):
+    """Create users with DRF tokens and return token keys."""
+
+    from django.contrib.auth import get_user_model
+    from rest_framework.authtoken.models import Token
+
+    User = get_user_model()
+    users = User.objects.bulk_create(
+        User(username=f"{prefix}{i}") for i in range(count))
+    tokens = Token.objects.bulk_create(
+        Token(user=user, key=Token.generate_key()) for user in users)
+    return [token.key for token in tokens]
+
+
+def percentile(values, percent):
+    """Returns percentile of values (nearest rank)."""
+
+    values = sorted(values)
+    index = max(0, round(percent / 100 * len(values) + 0.5) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def latency_stats(seconds):
+    """Returns p50 and p99 of latencies in milliseconds."""
+
+    return {
+        "p50_ms": round(statistics.median(seconds) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 3),
+    }
@@ -0,0 +1,85 @@
+"""
+DRF token lookups batching benchmark.
+
+Opens concurrent connections through DRFAuthTokenMiddleware with and
+without lookups batching and reports DB queries count
+and handshake latency.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.batching
+"""
+
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+
+from .base import (
+    create_tokens, latency_stats, setup_django, setup_test_database,
+)
+
+setup_django()
+
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from channels_auth_token_middlewares.middleware import (  # noqa: E402
+    DRFAuthTokenMiddleware,
+)
+
+from tests_app.consumer import MockConsumer  # noqa: E402
+
+
+CONNECTIONS = 500
+
+
+async def connect(mdwr, token_key):
+    scope = {"headers": [(b"authorization", f"Token {token_key}".encode())]}
+    started = time.perf_counter()
+    scope = await mdwr(scope, None, None)
+    assert not scope["user"].is_anonymous
+    return time.perf_counter() - started
+
+
+async def storm(mdwr, token_keys):
+    return await asyncio.gather(*(
+        connect(mdwr, token_key) for token_key in token_keys))
+
+
+def run(name, mdwr, token_keys, connection):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        latencies = async_to_sync(storm)(mdwr, token_keys)
+        elapsed = time.perf_counter() - started
+    return {
+        "case": name,
+        "connections": len(token_keys),
+        "queries": len(queries),
+        "seconds": round(elapsed, 3),
+        **latency_stats(latencies),
+    }
+
+
+def main():
+    connection = setup_test_database()
+    token_keys = create_tokens(CONNECTIONS)
+
+    cases = [
+        ("per_connection", DRFAuthTokenMiddleware(MockConsumer())),
+        ("batched_2ms", DRFAuthTokenMiddleware(
+            MockConsumer(), batch_window=0.002)),
+        ("batched_10ms", DRFAuthTokenMiddleware(
+            MockConsumer(), batch_window=0.01)),
+    ]
+    print(
+        f"{'case':<16}{'queries':>9}{'seconds':>9}"
+        f"{'p50 ms':>9}{'p99 ms':>9}")
+    for name, mdwr in cases:
+        result = run(name, mdwr, token_keys, connection)
+        print(
+            f"{result['case']:<16}{result['queries']:>9}"
+            f"{result['seconds']:>9}{result['p50_ms']:>9}"
+            f"{result['p99_ms']:>9}")
+
+
+if __name__ == "__main__":
+    main()
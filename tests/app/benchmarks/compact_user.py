@@ -0,0 +1,91 @@
+"""
+Compact user memory benchmark.
+
+Keeps scopes of authenticated connections (like long-lived websocket
+connections do) populated by DRF and Simple JWT middlewares
+with full user model instances and with compact users,
+and reports retained memory per connection measured by tracemalloc.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.compact_user [--connections 2000]
+"""
+
+import argparse
+import asyncio
+import gc
+import tracemalloc
+
+from .base import create_tokens, setup_django, setup_test_database
+
+setup_django()
+
+from rest_framework.authtoken.models import Token  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from channels_auth_token_middlewares.middleware import (  # noqa: E402
+    DRFAuthTokenMiddleware, SimpleJWTAuthTokenMiddleware,
+)
+
+from tests_app.consumer import MockConsumer  # noqa: E402
+
+
+COMPACT_USER_FIELDS = ["username", "is_staff"]
+
+
+async def connect_all(mdwr, headers):
+    scopes = []
+    for header in headers:
+        scope = await mdwr({"headers": [header]}, None, None)
+        assert scope["user"].is_authenticated
+        scopes.append(scope)
+    return scopes
+
+
+def measure(mdwr, headers):
+    """Returns retained bytes per connection."""
+
+    # Warm up lazy imports and caches before tracing.
+    asyncio.run(connect_all(mdwr, headers[:10]))
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        scopes = asyncio.run(connect_all(mdwr, headers))
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(scopes) == len(headers)
+    return (after - before) / len(headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_test_database()
+    token_keys = create_tokens(args.connections)
+    drf_headers = [
+        (b"authorization", f"Token {key}".encode()) for key in token_keys]
+    jwt_headers = [
+        (b"authorization", f"Bearer {AccessToken.for_user(token.user)}".encode())
+        for token in Token.objects.select_related("user")
+    ]
+
+    print(f"{'middleware':<30}{'full B':>10}{'compact B':>12}{'saved':>8}")
+    for name, middleware_class, headers in [
+        ("DRFAuthTokenMiddleware", DRFAuthTokenMiddleware, drf_headers),
+        ("SimpleJWTAuthTokenMiddleware", SimpleJWTAuthTokenMiddleware,
+         jwt_headers),
+    ]:
+        full = measure(middleware_class(MockConsumer()), headers)
+        compact = measure(middleware_class(
+            MockConsumer(), compact_user_fields=COMPACT_USER_FIELDS), headers)
+        print(f"{name:<30}{full:>10.0f}{compact:>12.0f}"
+              f"{1 - compact / full:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
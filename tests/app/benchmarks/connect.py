@@ -0,0 +1,258 @@
+"""
+Connect time auth overhead benchmark suite.
+
+Connects through every middleware class with valid, invalid and missing
+tokens using in-memory communicators and SQLite test database.
+Reports connections per second, p50/p99 handshake latency,
+DB queries per connect and allocated bytes per connect.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.connect [--connections 200] [--transport websocket]
+                               [--output results.json]
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+
+from .base import (
+    create_tokens, latency_stats, setup_django, setup_test_database,
+)
+
+setup_django()
+
+import channels  # noqa: E402
+import django  # noqa: E402
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from channels.testing import (  # noqa: E402
+    HttpCommunicator, WebsocketCommunicator,
+)
+
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+
+from channels_auth_token_middlewares.middleware import (  # noqa: E402
+    DRFAuthTokenMiddleware, DRFAuthTokenMiddlewareStack,
+    QueryStringDRFAuthTokenMiddleware,
+    QueryStringSimpleJWTAuthTokenMiddleware, SimpleJWTAuthTokenMiddleware,
+    SimpleJWTAuthTokenMiddlewareStack,
+)
+
+from tests_app.consumer import (  # noqa: E402
+    TestHttpConsumer, TestWebsocketConsumer,
+)
+from tests_app.middleware import (  # noqa: E402
+    TestCookieAuthTokenMiddleware, TestHeaderAuthTokenMiddleware,
+    TestQueryStringAuthTokenMiddleware,
+)
+
+
+ALLOCATION_SAMPLES = 20
+
+WRONG_DRF_TOKEN_KEY = "0" * 40
+
+
+def header(name, value):
+    return {"headers": [(name, value.encode())]}
+
+
+def query_string(value):
+    return {"path": f"/test/?{value}"}
+
+
+def get_cases(user_id, drf_token_key, jwt_token_key):
+    """Returns list of (middleware name, factory, {token state: request})."""
+
+    return [
+        ("HeaderAuthTokenMiddleware", TestHeaderAuthTokenMiddleware, {
+            "valid": header(b"test-authorization", f"Id {user_id}"),
+            "invalid": header(b"test-authorization", "Id 0"),
+            "missing": {},
+        }),
+        ("CookieAuthTokenMiddleware", TestCookieAuthTokenMiddleware, {
+            "valid": header(b"cookie", f"test={user_id}"),
+            "invalid": header(b"cookie", "test=0"),
+            "missing": {},
+        }),
+        ("QueryStringAuthTokenMiddleware", TestQueryStringAuthTokenMiddleware, {
+            "valid": query_string(f"test={user_id}"),
+            "invalid": query_string("test=0"),
+            "missing": {},
+        }),
+        ("DRFAuthTokenMiddleware", DRFAuthTokenMiddleware, {
+            "valid": header(b"authorization", f"Token {drf_token_key}"),
+            "invalid": header(b"authorization", f"Token {WRONG_DRF_TOKEN_KEY}"),
+            "missing": {},
+        }),
+        ("QueryStringDRFAuthTokenMiddleware", QueryStringDRFAuthTokenMiddleware, {
+            "valid": query_string(f"token={drf_token_key}"),
+            "invalid": query_string(f"token={WRONG_DRF_TOKEN_KEY}"),
+            "missing": {},
+        }),
+        ("DRFAuthTokenMiddlewareStack", DRFAuthTokenMiddlewareStack, {
+            "valid": header(b"authorization", f"Token {drf_token_key}"),
+            "invalid": header(b"authorization", f"Token {WRONG_DRF_TOKEN_KEY}"),
+            "missing": {},
+        }),
+        ("SimpleJWTAuthTokenMiddleware", SimpleJWTAuthTokenMiddleware, {
+            "valid": header(b"authorization", f"Bearer {jwt_token_key}"),
+            "invalid": header(b"authorization", "Bearer wrong_token_key"),
+            "missing": {},
+        }),
+        ("QueryStringSimpleJWTAuthTokenMiddleware",
+         QueryStringSimpleJWTAuthTokenMiddleware, {
+            "valid": query_string(f"token={jwt_token_key}"),
+            "invalid": query_string("token=wrong_token_key"),
+            "missing": {},
+        }),
+        ("SimpleJWTAuthTokenMiddlewareStack", SimpleJWTAuthTokenMiddlewareStack, {
+            "valid": header(b"authorization", f"Bearer {jwt_token_key}"),
+            "invalid": header(b"authorization", "Bearer wrong_token_key"),
+            "missing": {},
+        }),
+    ]
+
+
+async def websocket_connect(application, request, authenticated):
+    communicator = WebsocketCommunicator(
+        application, request.get("path", "/test/"),
+        headers=request.get("headers", []))
+    started = time.perf_counter()
+    connected, _ = await communicator.connect()
+    elapsed = time.perf_counter() - started
+    assert connected is authenticated
+    await communicator.disconnect()
+    return elapsed
+
+
+async def http_connect(application, request, authenticated):
+    communicator = HttpCommunicator(
+        application, "GET", request.get("path", "/test/"),
+        headers=request.get("headers", []))
+    started = time.perf_counter()
+    response = await communicator.get_response()
+    elapsed = time.perf_counter() - started
+    assert (response["body"] != b"None") is authenticated
+    return elapsed
+
+
+TRANSPORTS = {
+    "websocket": (websocket_connect, TestWebsocketConsumer),
+    "http": (http_connect, TestHttpConsumer),
+}
+
+
+async def run_connects(connect, application, request, authenticated, count):
+    return [
+        await connect(application, request, authenticated)
+        for _ in range(count)
+    ]
+
+
+async def measure_allocations(connect, application, request, authenticated):
+    # Warm up lazy imports and caches before tracing.
+    await connect(application, request, authenticated)
+
+    tracemalloc.start()
+    try:
+        allocated = []
+        for _ in range(ALLOCATION_SAMPLES):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await connect(application, request, authenticated)
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+    finally:
+        tracemalloc.stop()
+    return sorted(allocated)[len(allocated) // 2]
+
+
+def run_case(connection, transport, factory, request, authenticated, count):
+    connect, consumer_class = TRANSPORTS[transport]
+    application = factory(consumer_class())
+
+    alloc_bytes = async_to_sync(measure_allocations)(
+        connect, application, request, authenticated)
+
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        latencies = async_to_sync(run_connects)(
+            connect, application, request, authenticated, count)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "connections_per_second": round(count / elapsed, 1),
+        **latency_stats(latencies),
+        "queries_per_connect": round(len(queries) / count, 3),
+        "alloc_bytes_per_connect": alloc_bytes,
+    }
+
+
+def get_meta(args):
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "channels": channels.__version__,
+        "transport": args.transport,
+        "connections": args.connections,
+        "database": "sqlite3 (in-memory)",
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument(
+        "--transport", choices=sorted(TRANSPORTS), default="websocket")
+    parser.add_argument(
+        "--output", help="path to write JSON results to, stdout is '-'")
+    parser.add_argument(
+        "--only", help="run only middlewares which names contain the string")
+    args = parser.parse_args(argv)
+
+    connection = setup_test_database()
+    drf_token_key, = create_tokens(1)
+    user = get_user_model().objects.get(auth_token__key=drf_token_key)
+    jwt_token_key = str(RefreshToken.for_user(user).access_token)
+
+    results = []
+    header_line = (
+        f"{'middleware':<42}{'token':<9}{'conn/s':>9}{'p50 ms':>9}"
+        f"{'p99 ms':>9}{'queries':>9}{'alloc B':>9}")
+    print(header_line, file=sys.stderr)
+    for name, factory, requests in get_cases(
+        user.id, drf_token_key, jwt_token_key,
+    ):
+        if args.only and args.only not in name:
+            continue
+        for token_state, request in requests.items():
+            result = run_case(
+                connection, args.transport, factory, request,
+                token_state == "valid", args.connections)
+            results.append({
+                "middleware": name, "token": token_state, **result})
+            print(
+                f"{name:<42}{token_state:<9}"
+                f"{result['connections_per_second']:>9}"
+                f"{result['p50_ms']:>9}{result['p99_ms']:>9}"
+                f"{result['queries_per_connect']:>9}"
+                f"{result['alloc_bytes_per_connect']:>9}",
+                file=sys.stderr)
+
+    output = json.dumps({"meta": get_meta(args), "results": results}, indent=2)
+    if args.output == "-":
+        print(output)
+    elif args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Cookie token key extraction benchmark.
+
+Compares the single cookie scanner against full http.cookies.BaseCookie
+parsing on 4 KB and 8 KB Cookie headers with the token cookie
+at the start, in the middle, at the end and absent.
+"quoted" case has quoted cookie value before the token cookie,
+so cookies are scanned one by one.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.cookie
+"""
+
+import timeit
+
+from http.cookies import BaseCookie
+
+from .base import setup_django
+
+setup_django()
+
+from channels_auth_token_middlewares.middleware.base import (  # noqa: E402
+    get_cookie_value,
+)
+
+
+NUMBER = 2000
+
+TOKEN_COOKIE = "token=0123456789abcdef0123456789abcdef01234567"
+
+
+def legacy_get_cookie_value(cookie_raw_data, cookie_name):
+    cookie = BaseCookie()
+    cookie.load(cookie_raw_data)
+    cookie_item = cookie.get(cookie_name)
+    if not cookie_item:
+        return None
+    return cookie_item.value
+
+
+def make_cookies(size):
+    """Returns analytics like cookies list of about size bytes in total."""
+
+    cookies = []
+    length = 0
+    while length < size:
+        i = len(cookies)
+        cookie = f"_ga_{i:04d}=GS1.1.{1700000000 + i}.{i}.1.{1700000000 + i}.0.0.0"
+        cookies.append(cookie)
+        length += len(cookie) + 2
+    return cookies
+
+
+def make_header(size, position):
+    cookies = make_cookies(size - len(TOKEN_COOKIE))
+    if position == "start":
+        cookies.insert(0, TOKEN_COOKIE)
+    elif position == "middle":
+        cookies.insert(len(cookies) // 2, TOKEN_COOKIE)
+    elif position == "end":
+        cookies.append(TOKEN_COOKIE)
+    elif position == "quoted":
+        cookies.insert(0, 'consent="v1|analytics|ads"')
+        cookies.append(TOKEN_COOKIE)
+    return "; ".join(cookies)
+
+
+def bench(func, *args):
+    seconds = min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=5))
+    return seconds / NUMBER * 1e6
+
+
+def main():
+    print(
+        f"{'size':<6}{'token':<8}{'bytes':>7}"
+        f"{'legacy us':>12}{'current us':>12}{'speedup':>10}")
+    for size in (4096, 8192):
+        for position in ("start", "middle", "end", "absent", "quoted"):
+            header = make_header(size, position)
+            assert (
+                get_cookie_value(header, "token")
+                == legacy_get_cookie_value(header, "token")
+            )
+            legacy_us = bench(legacy_get_cookie_value, header, "token")
+            current_us = bench(get_cookie_value, header, "token")
+            print(
+                f"{size // 1024:>2} KB {position:<8}{len(header):>7}"
+                f"{legacy_us:>12.1f}{current_us:>12.2f}"
+                f"{legacy_us / current_us:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Token key extraction microbenchmarks.
+
+Compares current extraction path against the previous one
+(dict of headers, str decode and per call regex pattern building).
+
+Usage (from tests/app directory):
+$ python -m benchmarks.extraction
+"""
+
+import re
+import timeit
+
+from http.cookies import BaseCookie
+from urllib.parse import parse_qs
+
+from .base import setup_django
+
+setup_django()
+
+from tests_app.middleware import (  # noqa: E402
+    TestCookieAuthTokenMiddleware, TestHeaderAuthTokenMiddleware,
+    TestQueryStringAuthTokenMiddleware,
+)
+
+
+NUMBER = 100000
+
+HEADERS = [
+    (b"host", b"example.com"),
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101"),
+    (b"accept", b"*/*"),
+    (b"accept-language", b"en-US,en;q=0.5"),
+    (b"accept-encoding", b"gzip, deflate, br"),
+    (b"sec-websocket-version", b"13"),
+    (b"origin", b"https://example.com"),
+    (b"sec-websocket-extensions", b"permessage-deflate"),
+    (b"sec-websocket-key", b"dGhlIHNhbXBsZSBub25jZQ=="),
+    (b"connection", b"keep-alive, Upgrade"),
+    (b"cookie", b"_ga=GA1.1.1234567890.1234567890; test=1; theme=dark"),
+    (b"pragma", b"no-cache"),
+    (b"cache-control", b"no-cache"),
+    (b"upgrade", b"websocket"),
+    (b"test-authorization", b"Id 1"),
+]
+
+SCOPE = {
+    "headers": HEADERS,
+    "query_string": b"state=abcdef&utm_source=mail&test=1",
+}
+
+
+def legacy_get_scope_header_value(scope, header_name):
+    header_name = header_name.encode()
+    headers = dict(scope["headers"])
+    value = headers.get(header_name, headers.get(header_name.lower()))
+    if not value:
+        return None
+    return value.decode()
+
+
+def legacy_parse_token_key(regex, token_key_string):
+    matched = re.fullmatch(regex, token_key_string)
+    if not matched:
+        return None
+    return matched.group(1)
+
+
+def legacy_header(mdwr, scope):
+    token_key_string = legacy_get_scope_header_value(scope, mdwr.header_name)
+    regex = rf"{mdwr.keyword} ({mdwr.token_regex})"
+    return legacy_parse_token_key(regex, token_key_string)
+
+
+def legacy_cookie(mdwr, scope):
+    cookie_raw_data = legacy_get_scope_header_value(scope, "Cookie") or ""
+    cookie = BaseCookie()
+    cookie.load(cookie_raw_data)
+    token_key_string = cookie.get(mdwr.cookie_name).value
+    return legacy_parse_token_key(rf"({mdwr.token_regex})", token_key_string)
+
+
+def legacy_query_string(mdwr, scope):
+    query_params = parse_qs(scope["query_string"].decode())
+    token_key_string = query_params.get(mdwr.query_param)[0]
+    return legacy_parse_token_key(rf"({mdwr.token_regex})", token_key_string)
+
+
+def current(mdwr, scope):
+    return mdwr.parse_token_key(mdwr.get_token_key_string(scope))
+
+
+def bench(func, *args):
+    seconds = min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=5))
+    return seconds / NUMBER * 1e9
+
+
+def main():
+    cases = [
+        ("header", TestHeaderAuthTokenMiddleware(None), legacy_header),
+        ("cookie", TestCookieAuthTokenMiddleware(None), legacy_cookie),
+        ("query_string", TestQueryStringAuthTokenMiddleware(None),
+         legacy_query_string),
+    ]
+    print(f"{'case':<14}{'legacy ns':>12}{'current ns':>12}{'speedup':>10}")
+    for name, mdwr, legacy in cases:
+        assert legacy(mdwr, SCOPE) == current(mdwr, SCOPE) == "1"
+        legacy_ns = bench(legacy, mdwr, SCOPE)
+        current_ns = bench(current, mdwr, SCOPE)
+        print(
+            f"{name:<14}{legacy_ns:>12.0f}{current_ns:>12.0f}"
+            f"{legacy_ns / current_ns:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
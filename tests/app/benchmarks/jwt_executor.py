@@ -0,0 +1,95 @@
+"""
+Simple JWT validation executor benchmark.
+
+Validates tokens of concurrent handshakes by the thread sensitive
+executor (default), by BoundedExecutor thread pools, on the event loop
+and with validated tokens cache.
+Users are cached, so only token validation is measured.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.jwt_executor
+"""
+
+import asyncio
+import time
+
+from .base import (
+    create_tokens, latency_stats, setup_django, setup_test_database,
+)
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from channels_auth_token_middlewares.cache import TokenCache  # noqa: E402
+from channels_auth_token_middlewares.concurrency import (  # noqa: E402
+    BoundedExecutor,
+)
+from channels_auth_token_middlewares.middleware import (  # noqa: E402
+    SimpleJWTAuthTokenMiddleware,
+)
+
+
+USERS = 50
+CONCURRENCY = 200
+ROUNDS = 5
+
+
+async def timed(mdwr, token_key):
+    started = time.perf_counter()
+    user = await mdwr.get_user_instance(token_key)
+    assert user is not None
+    return time.perf_counter() - started
+
+
+async def run(mdwr, token_keys):
+    # Warm up user cache.
+    await asyncio.gather(*(mdwr.get_user_instance(key) for key in token_keys))
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        latencies.extend(await asyncio.gather(*(
+            timed(mdwr, token_keys[i % len(token_keys)])
+            for i in range(CONCURRENCY)
+        )))
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, latencies
+
+
+def main():
+    setup_test_database()
+    create_tokens(USERS)
+    token_keys = [
+        str(AccessToken.for_user(user))
+        for user in get_user_model().objects.all()
+    ]
+
+    cases = [("thread sensitive", {})] + [
+        (f"pool {workers} workers", {"jwt_executor": BoundedExecutor(
+            max_workers=workers, max_queue_depth=CONCURRENCY)})
+        for workers in (1, 4, 8)
+    ] + [
+        ("on loop", {"jwt_validate_on_loop": True}),
+        ("token cache", {"jwt_token_cache": TokenCache(maxsize=USERS * 2)}),
+    ]
+    print(f"{'executor':<20}{'conn/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'queue wait mean ms':>20}")
+    for name, kwargs in cases:
+        executor = kwargs.get("jwt_executor")
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            None, user_cache=TokenCache(maxsize=USERS * 2), **kwargs)
+        rate, latencies = asyncio.run(run(mdwr, token_keys))
+        stats = latency_stats(latencies)
+        queue_wait = "-"
+        if executor is not None:
+            queue_wait = f"{executor.stats['queue_wait']['mean'] * 1000:.3f}"
+            executor.shutdown()
+        print(f"{name:<20}{rate:>10.0f}{stats['p50_ms']:>10}"
+              f"{stats['p99_ms']:>10}{queue_wait:>20}")
+
+
+if __name__ == "__main__":
+    main()
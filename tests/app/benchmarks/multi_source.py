@@ -0,0 +1,116 @@
+"""
+Multi source middleware benchmark.
+
+Compares per connection overhead of nested header and query string
+middlewares (previous stacks layout) against one multi source middleware.
+User lookups are in-memory, so only the middleware overhead is measured.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.multi_source
+"""
+
+import asyncio
+import time
+
+from .base import setup_django
+
+setup_django()
+
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+
+from channels_auth_token_middlewares.middleware import (  # noqa: E402
+    HeaderAuthTokenMiddleware, HeaderTokenSource,
+    MultiSourceAuthTokenMiddleware, QueryStringAuthTokenMiddleware,
+    QueryStringTokenSource,
+)
+
+from tests_app.consumer import MockConsumer  # noqa: E402
+
+
+NUMBER = 20000
+
+TOKEN_KEY = "0123456789abcdef0123456789abcdef01234567"
+
+HEADERS = [
+    (b"host", b"example.com"),
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101"),
+    (b"accept", b"*/*"),
+    (b"accept-language", b"en-US,en;q=0.5"),
+    (b"sec-websocket-version", b"13"),
+    (b"origin", b"https://example.com"),
+    (b"sec-websocket-key", b"dGhlIHNhbXBsZSBub25jZQ=="),
+    (b"connection", b"keep-alive, Upgrade"),
+    (b"upgrade", b"websocket"),
+]
+
+SCOPES = {
+    "header": {
+        "headers": HEADERS + [
+            (b"authorization", f"Token {TOKEN_KEY}".encode())],
+        "query_string": b"",
+    },
+    "query_string": {
+        "headers": HEADERS,
+        "query_string": f"token={TOKEN_KEY}".encode(),
+    },
+    "missing": {
+        "headers": HEADERS,
+        "query_string": b"",
+    },
+}
+
+
+class User(AnonymousUser):
+    id = 1
+    is_anonymous = False
+
+
+class InMemoryLookupMixin:
+
+    async def get_user_instance(self, token_key):
+        return User() if token_key == TOKEN_KEY else None
+
+
+class HeaderMiddleware(InMemoryLookupMixin, HeaderAuthTokenMiddleware):
+    header_name = "Authorization"
+    keyword = "Token"
+    token_regex = "[0-9a-f]{40}"
+
+
+class QueryStringMiddleware(
+    InMemoryLookupMixin, QueryStringAuthTokenMiddleware,
+):
+    query_param = "token"
+
+
+class MultiSourceMiddleware(
+    InMemoryLookupMixin, MultiSourceAuthTokenMiddleware,
+):
+    sources = (
+        HeaderTokenSource("Authorization", "Token", token_regex="[0-9a-f]{40}"),
+        QueryStringTokenSource("token"),
+    )
+
+
+async def bench(mdwr, scope):
+    started = time.perf_counter()
+    for _ in range(NUMBER):
+        await mdwr(scope, None, None)
+    return (time.perf_counter() - started) / NUMBER * 1e6
+
+
+async def main():
+    nested = HeaderMiddleware(QueryStringMiddleware(MockConsumer()))
+    fused = MultiSourceMiddleware(MockConsumer())
+    print(f"{'case':<14}{'nested us':>12}{'fused us':>12}{'speedup':>10}")
+    for name, scope in SCOPES.items():
+        nested_us = await bench(nested, scope)
+        fused_us = await bench(fused, scope)
+        print(
+            f"{name:<14}{nested_us:>12.2f}{fused_us:>12.2f}"
+            f"{nested_us / fused_us:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Query string token key extraction benchmark.
+
+Compares the single query param scanner against full
+urllib.parse.parse_qs parsing on short and long (tracking and state
+params) query strings with the token param at the start,
+at the end and absent.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.query_string
+"""
+
+import timeit
+
+from urllib.parse import parse_qs
+
+from .base import setup_django
+
+setup_django()
+
+from channels_auth_token_middlewares.middleware.base import (  # noqa: E402
+    get_query_param_value,
+)
+
+
+NUMBER = 20000
+
+TOKEN_PARAM = b"token=0123456789abcdef0123456789abcdef01234567"
+
+SHORT_PARAMS = [b"room=lobby", b"v=2"]
+
+LONG_PARAMS = [
+    b"utm_source=newsletter", b"utm_medium=email",
+    b"utm_campaign=spring%20sale%202024", b"utm_content=hero+banner",
+    b"gclid=Cj0KCQjw" + b"x" * 80, b"fbclid=IwAR" + b"y" * 60,
+    b"state=%7B%22page%22%3A%22%2Fdashboard%2Fprojects%2F42%22%2C"
+    b"%22filters%22%3A%5B%22open%22%2C%22mine%22%5D%7D",
+    b"redirect_uri=https%3A%2F%2Fexample.com%2Fcallback%3Fnext%3D%252F",
+    b"lang=en-US", b"tz=Europe%2FBerlin", b"room=lobby", b"v=2",
+]
+
+
+def legacy_get_query_param_value(raw_query_string, query_param):
+    query_params = parse_qs(raw_query_string.decode())
+    values = query_params.get(query_param)
+    if not values:
+        return None
+    return values[0]
+
+
+def make_query_string(params, position):
+    if position == "start":
+        params = [TOKEN_PARAM, *params]
+    elif position == "end":
+        params = [*params, TOKEN_PARAM]
+    return b"&".join(params)
+
+
+def bench(func, *args):
+    seconds = min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=5))
+    return seconds / NUMBER * 1e6
+
+
+def main():
+    print(
+        f"{'case':<7}{'token':<8}{'bytes':>7}"
+        f"{'legacy us':>12}{'current us':>12}{'speedup':>10}")
+    for name, params in [("short", SHORT_PARAMS), ("long", LONG_PARAMS)]:
+        for position in ("start", "end", "absent"):
+            query_string = make_query_string(params, position)
+            assert (
+                get_query_param_value(query_string, "token")
+                == legacy_get_query_param_value(query_string, "token")
+            )
+            legacy_us = bench(legacy_get_query_param_value, query_string, "token")
+            current_us = bench(get_query_param_value, query_string, "token")
+            print(
+                f"{name:<7}{position:<8}{len(query_string):>7}"
+                f"{legacy_us:>12.2f}{current_us:>12.2f}"
+                f"{legacy_us / current_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Stacked middlewares benchmark.
+
+Measures per connection overhead of stacked cookie, header and query
+string middlewares (every layer is passed by anonymous connection),
+with 1 to 6 layers. Realistic headers with 4 KB Cookie header are used.
+User lookups are in-memory, so only the middleware overhead is measured.
+
+Usage (from tests/app directory):
+$ python -m benchmarks.stacked
+"""
+
+import asyncio
+import time
+
+from .base import setup_django
+
+setup_django()
+
+from channels_auth_token_middlewares.middleware import (  # noqa: E402
+    CookieAuthTokenMiddleware, HeaderAuthTokenMiddleware,
+    QueryStringAuthTokenMiddleware,
+)
+
+from tests_app.consumer import MockConsumer  # noqa: E402
+
+
+NUMBER = 5000
+
+REPEAT = 5
+
+COOKIE = "; ".join(
+    f"_ga_{i}=GA1.1.{i:010d}.{i * 7:010d}" for i in range(110)).encode()
+
+SCOPE = {
+    "headers": [
+        (b"host", b"example.com"),
+        (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101"),
+        (b"accept", b"*/*"),
+        (b"accept-language", b"en-US,en;q=0.5"),
+        (b"accept-encoding", b"gzip, deflate, br"),
+        (b"sec-websocket-version", b"13"),
+        (b"origin", b"https://example.com"),
+        (b"sec-websocket-extensions", b"permessage-deflate"),
+        (b"sec-websocket-key", b"dGhlIHNhbXBsZSBub25jZQ=="),
+        (b"connection", b"keep-alive, Upgrade"),
+        (b"cookie", COOKIE),
+        (b"pragma", b"no-cache"),
+        (b"cache-control", b"no-cache"),
+        (b"upgrade", b"websocket"),
+    ],
+    "query_string": b"utm_source=mail&utm_medium=email&utm_campaign=spring",
+}
+
+
+class InMemoryLookupMixin:
+
+    async def get_user_instance(self, token_key):
+        return None
+
+
+class CookieMiddleware(InMemoryLookupMixin, CookieAuthTokenMiddleware):
+    cookie_name = "token"
+
+
+class HeaderMiddleware(InMemoryLookupMixin, HeaderAuthTokenMiddleware):
+    header_name = "Authorization"
+    keyword = "Token"
+
+
+class QueryStringMiddleware(
+    InMemoryLookupMixin, QueryStringAuthTokenMiddleware,
+):
+    query_param = "token"
+
+
+LAYERS = (CookieMiddleware, HeaderMiddleware, QueryStringMiddleware)
+
+
+def build_stack(layers_count):
+    app = MockConsumer()
+    for i in range(layers_count):
+        app = LAYERS[i % len(LAYERS)](app)
+    return app
+
+
+async def bench(mdwr):
+    # best of repeats is reported
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        for _ in range(NUMBER):
+            await mdwr(SCOPE, None, None)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / NUMBER * 1e6
+
+
+async def main():
+    print(f"{'layers':<8}{'us':>10}{'us per layer':>14}")
+    for layers_count in range(1, 7):
+        us = await bench(build_stack(layers_count))
+        print(f"{layers_count:<8}{us:>10.2f}{us / layers_count:>14.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,8 @@
 from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from channels_auth_token_middlewares.revocation import RevocableConsumerMixin
+
 
 class MockConsumer:
     async def __call__(self, scope, receive, send):
@@ -23,3 +25,25 @@ class TestWebsocketConsumer(AsyncWebsocketConsumer):
             await self.close(code=401)
         else:
             await self.accept()
+
+
+class TestLazyWebsocketConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        user = await self.scope["auser"]()
+
+        if user.is_anonymous:
+            await self.close(code=401)
+        else:
+            await self.accept()
+
+
+class TestRevocableWebsocketConsumer(
+    RevocableConsumerMixin, TestWebsocketConsumer,
+):
+    pass
+
+
+class TestRevocableLazyWebsocketConsumer(
+    RevocableConsumerMixin, TestLazyWebsocketConsumer,
+):
+    pass
@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from channels_auth_token_middlewares.middleware import (
     BaseAuthTokenMiddleware, HeaderAuthTokenMiddleware,
     CookieAuthTokenMiddleware, QueryStringAuthTokenMiddleware,
+    MultiSourceAuthTokenMiddleware,
+    HeaderTokenSource, CookieTokenSource, QueryStringTokenSource,
 )
 
 
@@ -52,3 +54,15 @@ class TestQueryStringAuthTokenMiddleware(QueryStringAuthTokenMiddleware, UserGet
 
     async def get_user_instance(self, token_key):
         return await self.get_user_by_id(token_key)
+
+
+class TestMultiSourceAuthTokenMiddleware(MultiSourceAuthTokenMiddleware, UserGetterByIdMixin):
+
+    sources = (
+        HeaderTokenSource("Test-Authorization", "Id", token_regex=r"\d+"),
+        CookieTokenSource("test"),
+        QueryStringTokenSource("test"),
+    )
+
+    async def get_user_instance(self, token_key):
+        return await self.get_user_by_id(token_key)
@@ -1,3 +1,28 @@
+from .batching import BatchingMiddlewaresTests
+from .cache import (
+    LRUCacheTests, RejectedTokenCacheMiddlewaresTests,
+    TieredUserCacheMiddlewaresTests, TokenCacheMiddlewaresTests,
+    UserRegistryMiddlewaresTests, UserRegistryTests,
+)
+from .concurrency import (
+    BatchLoaderTests, BoundedExecutorTests, CircuitBreakerMiddlewaresTests,
+    CircuitBreakerTests, CoalesceLookupsMiddlewaresTests,
+    JWTExecutorMiddlewaresTests, SingleFlightTests,
+)
 from .direct import DirectMiddlewaresTests
+from .extraction import ExtractionTests, ScopeRequestTests
 from .http_communicator import HttpCommunicatorMiddlewaresTests
+from .lazy import LazyUserMiddlewaresTests
+from .lookups import LookupsLedgerMiddlewaresTests
+from .metrics import MetricsMiddlewaresTests, MetricsSinksTests
+from .multi_source import MultiSourceMiddlewaresTests
+from .projection import UserQuerysetMiddlewaresTests
+from .revocation import RevocationMiddlewaresTests
+from .schemes import SchemeMiddlewaresTests
+from .simplejwt import (
+    ClaimsUserMiddlewaresTests, SimpleJWTValidationMiddlewaresTests,
+)
+from .timeouts import LookupTimeoutMiddlewaresTests
+from .users import CompactUserMiddlewaresTests, CompactUserTests
+from .warming import CacheWarmingTests
 from .websocket_communicator import WebsocketCommunicatorMiddlewaresTests
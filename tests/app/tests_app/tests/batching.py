@@ -0,0 +1,62 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth import get_user_model
+
+from rest_framework.authtoken.models import Token
+
+from channels_auth_token_middlewares.middleware import DRFAuthTokenMiddleware
+
+from tests_app.consumer import MockConsumer
+
+from .base import BaseMiddlewaresTests
+
+
+class BatchingMiddlewaresTests(BaseMiddlewaresTests):
+
+    def _scope(self, token_key):
+        return {"headers": [
+            (b"authorization", f"Token {token_key}".encode())
+        ]}
+
+    def _connect_all(self, mdwr, token_keys):
+        async def connect_all():
+            return await asyncio.gather(*(
+                mdwr(self._scope(token_key), None, None)
+                for token_key in token_keys
+            ))
+        return [scope["user"] for scope in async_to_sync(connect_all)()]
+
+    def test_drf_auth_token_middleware_batching(self):
+        User = get_user_model()
+        tokens = [
+            Token.objects.create(
+                user=User.objects.create_user(f"batch{i}"))
+            for i in range(5)
+        ]
+        token_keys = [token.key for token in tokens] + ["0" * 40]
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), batch_window=0.01)
+
+        with self.assertNumQueries(1):
+            users = self._connect_all(mdwr, token_keys)
+
+        assert [user.id for user in users[:-1]] == [
+            token.user_id for token in tokens]
+        assert users[-1].is_anonymous
+
+    def test_drf_auth_token_middleware_batch_size(self):
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), batch_window=10, batch_size=2)
+        token_keys = [self._drf_token_key, "0" * 40, "1" * 40, "2" * 40]
+
+        with self.assertNumQueries(2):
+            users = self._connect_all(mdwr, token_keys)
+
+        assert users[0].id == 1
+        assert all(user.is_anonymous for user in users[1:])
+
+    def test_drf_auth_token_middleware_without_batching(self):
+        mdwr = DRFAuthTokenMiddleware(MockConsumer())
+        with self.assertNumQueries(3):
+            self._connect_all(mdwr, [self._drf_token_key] * 3)
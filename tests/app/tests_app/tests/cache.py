@@ -0,0 +1,562 @@
+import gc
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from channels.db import database_sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from channels_auth_token_middlewares.cache import (
+    LRUCache, TieredUserCache, TokenCache, UserRegistry, dump_user, load_user,
+)
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddleware, DRFAuthTokenMiddlewareStack,
+    SimpleJWTAuthTokenMiddleware, SimpleJWTAuthTokenMiddlewareStack,
+)
+
+from tests_app.consumer import MockConsumer
+
+from .base import BaseMiddlewaresTests
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(maxsize=2)
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert "a" in cache
+        assert cache.stats == {"hits": 2, "misses": 1, "evictions": 0, "size": 1}
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+        cache.set("a", 1)
+        timer.now = 9
+        assert cache.get("a") == 1
+        timer.now = 10
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.evictions == 1
+
+    def test_delete_tag(self):
+        cache = LRUCache(maxsize=4)
+        cache.set("a", 1, tags=("x",))
+        cache.set("b", 2, tags=("x", "y"))
+        cache.set("c", 3, tags=("y",))
+        cache.delete_tag("x")
+        assert cache.get("a") is None
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+        cache.delete_tag("y")
+        assert len(cache) == 0
+
+    def test_invalid_maxsize(self):
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class TokenCacheMiddlewaresTests(BaseMiddlewaresTests):
+
+    def test_drf_auth_token_middleware_cache(self):
+        cache = TokenCache(maxsize=8)
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        scope = {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+
+        with self.assertNumQueries(1):
+            assert async_to_sync(mdwr)(scope, None, None)["user"].id == 1
+        with self.assertNumQueries(0):
+            assert async_to_sync(mdwr)(scope, None, None)["user"].id == 1
+        assert cache.stats["hits"] == 1
+        assert cache.stats["misses"] == 1
+
+    def test_drf_auth_token_middleware_stack_cache(self):
+        cache = TokenCache(maxsize=8)
+        mdwr = DRFAuthTokenMiddlewareStack(MockConsumer(), user_cache=cache)
+        header_scope = {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ], "query_string": b""}
+        query_string_scope = {
+            "headers": [],
+            "query_string": f"token={self._drf_token_key}".encode(),
+        }
+
+        with self.assertNumQueries(1):
+            async_to_sync(mdwr)(header_scope, None, None)
+            user = async_to_sync(mdwr)(query_string_scope, None, None)["user"]
+        assert user.id == 1
+
+    def test_user_change_invalidation(self):
+        cache = TokenCache(maxsize=8)
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        scope = {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+        async_to_sync(mdwr)(scope, None, None)
+        assert len(cache) == 1
+
+        user = get_user_model().objects.get(id=1)
+        user.first_name = "Test"
+        user.save()
+        assert len(cache) == 0
+
+        user = async_to_sync(mdwr)(scope, None, None)["user"]
+        assert user.first_name == "Test"
+
+    def test_token_delete_invalidation(self):
+        cache = TokenCache(maxsize=8)
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        User = get_user_model()
+        user = User.objects.create_user("revoked")
+        token = Token.objects.create(user=user)
+        scope = {"headers": [
+            (b"authorization", f"Token {token.key}".encode())
+        ]}
+        assert not async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+
+        token.delete()
+        assert len(cache) == 0
+        assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+
+    def test_invalidation_on_commit(self):
+        cache = TokenCache(maxsize=8)
+        user = get_user_model().objects.get(id=1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            user.first_name = "Committed"
+            user.save()
+            # concurrent lookup caches old committed row
+            cache.set(self._drf_token_key, user, user_pk=user.pk)
+        assert len(callbacks) == 1
+        assert len(cache) == 0
+
+        token = Token.objects.create(
+            user=get_user_model().objects.create_user("committed"))
+        with self.captureOnCommitCallbacks(execute=True):
+            token.delete()
+            cache.set(token.key, token.user, user_pk=token.user_id)
+        assert len(cache) == 0
+
+    def test_token_delete_during_load(self):
+        cache = TokenCache(maxsize=8)
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        token = Token.objects.create(
+            user=get_user_model().objects.create_user("loading"))
+        scope = {"headers": [
+            (b"authorization", f"Token {token.key}".encode())
+        ]}
+        load_drf_user = mdwr.load_drf_user
+
+        async def load_and_delete(token_key):
+            user = await load_drf_user(token_key)
+            # token is deleted and committed before the user is cached
+            await database_sync_to_async(token.delete)()
+            return user
+
+        with mock.patch.object(mdwr, "load_drf_user", load_and_delete):
+            assert not async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+        assert len(cache) == 0
+        assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+
+    def test_generation_changed(self):
+        cache = TokenCache(maxsize=8)
+        user = get_user_model()(id=1)
+        generation = async_to_sync(cache.aget_generation)()
+        cache.invalidate_user(1)
+        assert not cache.set("t1", user, user_pk=1, generation=generation)
+        async_to_sync(cache.aset_user)(user, generation)
+        assert len(cache) == 0
+        assert cache.set("t1", user, user_pk=1, generation=cache.generation)
+        assert cache.get("t1") is user
+
+
+class RejectedTokenCacheMiddlewaresTests(BaseMiddlewaresTests):
+
+    def test_drf_auth_token_middleware_rejected_token_cache(self):
+        cache = TokenCache(maxsize=8, ttl=5)
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), rejected_token_cache=cache)
+        scope = {"headers": [
+            (b"authorization", f"Token {'0' * 40}".encode())
+        ]}
+
+        with self.assertNumQueries(1):
+            assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+        with self.assertNumQueries(0):
+            assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+        assert len(cache) == 1
+
+    def test_drf_auth_token_middleware_rejected_token_created(self):
+        cache = TokenCache(maxsize=8, ttl=5)
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), rejected_token_cache=cache)
+        token_key = "0" * 40
+        scope = {"headers": [
+            (b"authorization", f"Token {token_key}".encode())
+        ]}
+        assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+
+        user = get_user_model().objects.create_user("late")
+        Token.objects.create(user=user, key=token_key)
+        assert len(cache) == 0
+        assert async_to_sync(mdwr)(scope, None, None)["user"].id == user.id
+
+    def test_drf_auth_token_middleware_valid_token_not_rejected(self):
+        cache = TokenCache(maxsize=8, ttl=5)
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), rejected_token_cache=cache)
+        scope = {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+        assert async_to_sync(mdwr)(scope, None, None)["user"].id == 1
+        assert len(cache) == 0
+
+    def test_simplejwt_auth_token_middleware_rejected_token_cache(self):
+        cache = TokenCache(maxsize=8, ttl=5)
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), rejected_token_cache=cache)
+        scope = {"headers": [(b"authorization", b"Bearer wrong_token_key")]}
+
+        with mock.patch.object(
+            mdwr._auth, "get_validated_token",
+            wraps=mdwr._auth.get_validated_token,
+        ) as get_validated_token:
+            for _ in range(3):
+                user = async_to_sync(mdwr)(scope, None, None)["user"]
+                assert user.is_anonymous
+        assert get_validated_token.call_count == 1
+
+
+class TieredUserCacheMiddlewaresTests(BaseMiddlewaresTests):
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def _drf_scope(self):
+        return {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+
+    def _simplejwt_scope(self):
+        return {"headers": [
+            (b"authorization", f"Bearer {self._simplejwt_token_key}".encode())
+        ]}
+
+    def test_dump_load_user(self):
+        user = get_user_model().objects.get(id=1)
+        loaded_user = load_user(dump_user(user))
+        assert loaded_user.pk == user.pk
+        assert loaded_user.username == user.username
+        assert loaded_user.date_joined == user.date_joined
+        assert loaded_user.get_deferred_fields() == {"password"}
+
+    def test_drf_auth_token_middleware_tiered_cache(self):
+        cache = TieredUserCache()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        with self.assertNumQueries(1):
+            assert async_to_sync(mdwr)(self._drf_scope(), None, None)["user"].id == 1
+        with self.assertNumQueries(0):
+            assert async_to_sync(mdwr)(self._drf_scope(), None, None)["user"].id == 1
+        assert cache.stats["local"]["hits"] == 1
+        assert cache.stats["shared"]["misses"] == 1
+
+        # other worker with empty local tier
+        other_cache = TieredUserCache()
+        other_mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), user_cache=other_cache)
+        with self.assertNumQueries(0):
+            user = async_to_sync(other_mdwr)(
+                self._drf_scope(), None, None)["user"]
+        assert user.id == 1
+        assert user.username == "test"
+        assert other_cache.stats["local"]["hit_rate"] == 0
+        assert other_cache.stats["shared"] == {
+            "hits": 1, "misses": 0, "hit_rate": 1.0}
+
+    def test_tiered_cache_other_worker_invalidation(self):
+        cache = TieredUserCache()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        async_to_sync(mdwr)(self._drf_scope(), None, None)
+        with self.assertNumQueries(0):
+            async_to_sync(mdwr)(self._drf_scope(), None, None)
+        assert len(cache.local) == 1
+
+        # user is invalidated by other worker, which local tier is not shared
+        TieredUserCache(local=TokenCache()).invalidate_user(1)
+        assert len(cache.local) == 1
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+        assert user.id == 1
+        with self.assertNumQueries(0):
+            async_to_sync(mdwr)(self._drf_scope(), None, None)
+
+    def test_drf_auth_token_middleware_tiered_cache_user_change(self):
+        cache = TieredUserCache()
+        mdwr = DRFAuthTokenMiddlewareStack(MockConsumer(), user_cache=cache)
+        async_to_sync(mdwr)(self._drf_scope(), None, None)
+
+        user = get_user_model().objects.get(id=1)
+        user.first_name = "Tiered"
+        user.save()
+
+        other_mdwr = DRFAuthTokenMiddlewareStack(
+            MockConsumer(), user_cache=TieredUserCache())
+        with self.assertNumQueries(1):
+            user = async_to_sync(other_mdwr)(
+                self._drf_scope(), None, None)["user"]
+        assert user.first_name == "Tiered"
+
+    def test_drf_auth_token_middleware_tiered_cache_token_delete(self):
+        cache = TieredUserCache()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        user = get_user_model().objects.create_user("tiered")
+        token = Token.objects.create(user=user)
+        scope = {"headers": [
+            (b"authorization", f"Token {token.key}".encode())
+        ]}
+        assert async_to_sync(mdwr)(scope, None, None)["user"].id == user.id
+        shared_token_key = cache.make_token_key(token.key)
+        assert caches["default"].get(shared_token_key) == user.id
+
+        token.delete()
+        assert caches["default"].get(shared_token_key) is None
+        assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+
+    def test_simplejwt_auth_token_middleware_tiered_cache(self):
+        cache = TieredUserCache()
+        mdwr = SimpleJWTAuthTokenMiddlewareStack(MockConsumer(), user_cache=cache)
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(self._simplejwt_scope(), None, None)["user"]
+        assert user.id == 1
+
+        other_mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), user_cache=TieredUserCache())
+        with self.assertNumQueries(0):
+            user = async_to_sync(other_mdwr)(
+                self._simplejwt_scope(), None, None)["user"]
+        assert user.id == 1
+
+        get_user_model().objects.get(id=1).save()
+        with self.assertNumQueries(1):
+            async_to_sync(mdwr)(self._simplejwt_scope(), None, None)
+
+    def test_tiered_cache_invalidation_during_load(self):
+        cache = TieredUserCache()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        load_drf_user = mdwr.load_drf_user
+
+        async def load_and_invalidate(token_key):
+            user = await load_drf_user(token_key)
+            cache.invalidate_user(user.pk)
+            return user
+
+        with mock.patch.object(mdwr, "load_drf_user", load_and_invalidate):
+            async_to_sync(mdwr)(self._drf_scope(), None, None)
+        assert len(cache.local) == 0
+        assert caches["default"].get(
+            cache.make_token_key(self._drf_token_key)) is None
+
+    def test_tiered_cache_other_worker_invalidation_during_load(self):
+        cache = TieredUserCache()
+        mdwr = SimpleJWTAuthTokenMiddleware(MockConsumer(), user_cache=cache)
+        get_jwt_user = mdwr.get_jwt_user
+
+        async def load_and_invalidate(validated_token):
+            user = await get_jwt_user(validated_token)
+            # user is invalidated by other worker
+            TieredUserCache(local=TokenCache()).invalidate_user(user.pk)
+            return user
+
+        with mock.patch.object(mdwr, "get_jwt_user", load_and_invalidate):
+            async_to_sync(mdwr)(self._simplejwt_scope(), None, None)
+        assert len(cache.local) == 0
+        assert caches["default"].get(cache.make_user_key(1)) is None
+
+        with self.assertNumQueries(1):
+            async_to_sync(mdwr)(self._simplejwt_scope(), None, None)
+        with self.assertNumQueries(0):
+            async_to_sync(mdwr)(self._simplejwt_scope(), None, None)
+
+    def test_simplejwt_auth_token_middleware_token_cache(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), user_cache=TokenCache())
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                user = async_to_sync(mdwr)(
+                    self._simplejwt_scope(), None, None)["user"]
+                assert user.id == 1
+        scope = {"headers": [(b"authorization", b"Bearer wrong_token_key")]}
+        assert async_to_sync(mdwr)(scope, None, None)["user"].is_anonymous
+
+    @override_settings(SIMPLE_JWT={"CHECK_REVOKE_TOKEN": True})
+    def test_simplejwt_auth_token_middleware_user_cache_revoke_token(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), user_cache=TokenCache())
+
+
+class UserRegistryTests(SimpleTestCase):
+
+    def test_intern(self):
+        User = get_user_model()
+        registry = UserRegistry()
+        user = User(id=1, username="a")
+        assert registry.intern(user, token_key="t1") is user
+        assert registry.intern(User(id=1), token_key="t2") is user
+        assert registry.get(1) is user
+        assert registry.get("1") is user
+        assert registry.get_by_token("t1") is user
+        assert registry.get_by_token("t2") is user
+        assert registry.get_by_token("t3") is None
+        assert len(registry) == 1
+
+    def test_invalidate_user(self):
+        User = get_user_model()
+        registry = UserRegistry()
+        user = registry.intern(User(id=1), token_key="t1")
+        registry.invalidate_user(1)
+        assert registry.version(1) == 1
+        assert registry.get(1) is None
+        assert registry.get_by_token("t1") is None
+
+        new_user = User(id=1)
+        assert registry.intern(new_user) is new_user
+        assert registry.get(1) is new_user
+        assert user is not new_user
+
+    def test_invalidate_token(self):
+        User = get_user_model()
+        registry = UserRegistry()
+        user = registry.intern(User(id=1), token_key="t1")
+        registry.invalidate_token("t1")
+        assert registry.get_by_token("t1") is None
+        assert registry.get(1) is user
+
+    def test_generation_changed(self):
+        User = get_user_model()
+        registry = UserRegistry()
+        generation = registry.generation
+        registry.invalidate_user(1)
+        user = User(id=1)
+        assert registry.intern(user, generation) is user
+        assert registry.get(1) is None
+        assert registry.intern(user, registry.generation) is user
+        assert registry.get(1) is user
+
+    def test_weak_reference(self):
+        registry = UserRegistry()
+        registry.intern(get_user_model()(id=1), token_key="t1")
+        gc.collect()
+        assert registry.get(1) is None
+        assert registry.get_by_token("t1") is None
+        assert len(registry) == 0
+
+
+class UserRegistryMiddlewaresTests(BaseMiddlewaresTests):
+
+    def _drf_scope(self):
+        return {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+
+    def _simplejwt_scope(self):
+        return {"headers": [
+            (b"authorization", f"Bearer {self._simplejwt_token_key}".encode())
+        ]}
+
+    def test_drf_auth_token_middleware_user_registry(self):
+        registry = UserRegistry()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_registry=registry)
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]._wrapped
+            other_user = async_to_sync(mdwr)(
+                self._drf_scope(), None, None)["user"]._wrapped
+        assert user.id == 1
+        assert other_user is user
+
+        get_user_model().objects.filter(id=1).first().save()
+        with self.assertNumQueries(1):
+            new_user = async_to_sync(mdwr)(
+                self._drf_scope(), None, None)["user"]._wrapped
+        assert new_user.id == 1
+        assert new_user is not user
+
+    def test_drf_auth_token_middleware_user_registry_compact_user(self):
+        registry = UserRegistry()
+        mdwr = DRFAuthTokenMiddlewareStack(
+            MockConsumer(), user_registry=registry,
+            compact_user_fields=("username",))
+        with self.assertNumQueries(1):
+            users = [
+                async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]._wrapped
+                for _ in range(3)
+            ]
+        assert users[0].username == "test"
+        assert all(user is users[0] for user in users)
+
+    def test_drf_auth_token_middleware_user_registry_token_delete(self):
+        registry = UserRegistry()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_registry=registry)
+        user = get_user_model().objects.create_user("interned")
+        token = Token.objects.create(user=user)
+        scope = {"headers": [
+            (b"authorization", f"Token {token.key}".encode())
+        ]}
+        interned_user = async_to_sync(mdwr)(scope, None, None)["user"]._wrapped
+        assert interned_user.id == user.id
+
+        token.delete()
+        assert async_to_sync(mdwr)(scope, None, None)["user"]._wrapped.is_anonymous
+
+    def test_simplejwt_auth_token_middleware_user_registry(self):
+        registry = UserRegistry()
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), user_registry=registry)
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(
+                self._simplejwt_scope(), None, None)["user"]._wrapped
+            other_user = async_to_sync(mdwr)(
+                self._simplejwt_scope(), None, None)["user"]._wrapped
+        assert user.id == 1
+        assert other_user is user
+
+        get_user_model().objects.filter(id=1).first().save()
+        with self.assertNumQueries(1):
+            new_user = async_to_sync(mdwr)(
+                self._simplejwt_scope(), None, None)["user"]._wrapped
+        assert new_user is not user
+
+    @override_settings(SIMPLE_JWT={"CHECK_REVOKE_TOKEN": True})
+    def test_simplejwt_auth_token_middleware_user_registry_revoke_token(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), user_registry=UserRegistry())
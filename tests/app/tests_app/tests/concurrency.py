@@ -0,0 +1,596 @@
+import asyncio
+import threading
+
+from asgiref.sync import async_to_sync
+
+from django.db import OperationalError
+from django.test import SimpleTestCase
+
+from channels_auth_token_middlewares.cache import TokenCache
+from channels_auth_token_middlewares.concurrency import (
+    BatchLoader, BoundedExecutor, CircuitBreaker, CircuitOpen,
+    ExecutorQueueFull, SingleFlight,
+)
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddleware, SimpleJWTAuthTokenMiddleware,
+)
+
+from tests_app.consumer import MockConsumer
+from tests_app.middleware import TestHeaderAuthTokenMiddleware
+
+from .base import BaseMiddlewaresTests
+from .cache import FakeTimer
+from .metrics import RecordingSink
+
+
+class CountingLookup:
+
+    def __init__(self, result=None, exception=None):
+        self.result = result
+        self.exception = exception
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self, key):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    async def test_coalescing(self):
+        flight = SingleFlight()
+        lookup = CountingLookup(result="user")
+        tasks = [
+            asyncio.create_task(flight.do("key", lookup, "key"))
+            for _ in range(10)
+        ]
+        await lookup.started.wait()
+        assert len(flight) == 1
+        lookup.release.set()
+
+        assert await asyncio.gather(*tasks) == ["user"] * 10
+        assert lookup.calls == 1
+        assert len(flight) == 0
+
+        lookup.release.set()
+        assert await flight.do("key", lookup, "key") == "user"
+        assert lookup.calls == 2
+
+    async def test_different_keys(self):
+        flight = SingleFlight()
+        lookup = CountingLookup(result="user")
+        lookup.release.set()
+        await asyncio.gather(
+            flight.do("key1", lookup, "key1"),
+            flight.do("key2", lookup, "key2"),
+        )
+        assert lookup.calls == 2
+
+    async def test_exception(self):
+        flight = SingleFlight()
+        lookup = CountingLookup(exception=RuntimeError("db is down"))
+        tasks = [
+            asyncio.create_task(flight.do("key", lookup, "key"))
+            for _ in range(3)
+        ]
+        await lookup.started.wait()
+        lookup.release.set()
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert lookup.calls == 1
+        assert len(flight) == 0
+
+    async def test_waiter_cancellation(self):
+        flight = SingleFlight()
+        lookup = CountingLookup(result="user")
+        cancelled = asyncio.create_task(flight.do("key", lookup, "key"))
+        waiting = asyncio.create_task(flight.do("key", lookup, "key"))
+        await lookup.started.wait()
+
+        cancelled.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+        lookup.release.set()
+
+        assert await waiting == "user"
+        assert lookup.calls == 1
+
+    async def test_all_waiters_cancellation(self):
+        flight = SingleFlight()
+        lookup = CountingLookup(result="user")
+        tasks = [
+            asyncio.create_task(flight.do("key", lookup, "key"))
+            for _ in range(2)
+        ]
+        await lookup.started.wait()
+
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(
+            isinstance(result, asyncio.CancelledError) for result in results)
+        assert len(flight) == 0
+
+        lookup.release.set()
+        assert await flight.do("key", lookup, "key") == "user"
+        assert lookup.calls == 2
+
+
+class CoalescingHeaderAuthTokenMiddleware(TestHeaderAuthTokenMiddleware):
+
+    lookup = None
+
+    async def get_user_instance(self, token_key):
+        return await self.lookup(token_key)
+
+
+class CoalesceLookupsMiddlewaresTests(SimpleTestCase):
+
+    async def test_coalesce_lookups(self):
+        mdwr = CoalescingHeaderAuthTokenMiddleware(
+            MockConsumer(), coalesce_lookups=True)
+        mdwr.lookup = CountingLookup(result=None)
+        scopes = [
+            {"headers": [(b"test-authorization", b"Id 1")]}
+            for _ in range(5)
+        ]
+        tasks = [
+            asyncio.create_task(mdwr(scope, None, None)) for scope in scopes
+        ]
+        await mdwr.lookup.started.wait()
+        mdwr.lookup.release.set()
+
+        for scope in await asyncio.gather(*tasks):
+            assert scope["user"].is_anonymous
+        assert mdwr.lookup.calls == 1
+
+    async def test_coalesce_lookups_disabled(self):
+        mdwr = CoalescingHeaderAuthTokenMiddleware(MockConsumer())
+        mdwr.lookup = CountingLookup(result=None)
+        mdwr.lookup.release.set()
+        await asyncio.gather(*(
+            mdwr({"headers": [(b"test-authorization", b"Id 1")]}, None, None)
+            for _ in range(3)
+        ))
+        assert mdwr.lookup.calls == 3
+
+
+class BatchLoaderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    async def load_many(self, keys):
+        self.batches.append(keys)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    async def test_window(self):
+        loader = BatchLoader(self.load_many, window=0.01)
+        results = await asyncio.gather(
+            loader.load("a"), loader.load("b"), loader.load("a"),
+            loader.load("missing"),
+        )
+        assert results == ["A", "B", "A", None]
+        assert self.batches == [["a", "b", "missing"]]
+
+    async def test_max_batch_size(self):
+        loader = BatchLoader(self.load_many, window=10, max_batch_size=2)
+        results = await asyncio.wait_for(asyncio.gather(
+            loader.load("a"), loader.load("b"),
+            loader.load("c"), loader.load("d"),
+        ), 1)
+        assert results == ["A", "B", "C", "D"]
+        assert self.batches == [["a", "b"], ["c", "d"]]
+
+    async def test_exception(self):
+        async def load_many(keys):
+            raise RuntimeError("db is down")
+
+        loader = BatchLoader(load_many, window=0.01)
+        results = await asyncio.gather(
+            loader.load("a"), loader.load("b"), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def test_waiter_cancellation(self):
+        loader = BatchLoader(self.load_many, window=0.01)
+        cancelled = asyncio.create_task(loader.load("a"))
+        waiting = asyncio.create_task(loader.load("a"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        assert await waiting == "A"
+
+    def test_invalid_max_batch_size(self):
+        with self.assertRaises(ValueError):
+            BatchLoader(self.load_many, max_batch_size=0)
+
+
+class BoundedExecutorTests(SimpleTestCase):
+
+    async def test_run(self):
+        executor = BoundedExecutor(max_workers=2, thread_name_prefix="test-pool")
+        try:
+            thread_name = await executor.run(
+                lambda: threading.current_thread().name)
+        finally:
+            executor.shutdown()
+        assert thread_name.startswith("test-pool")
+        assert executor.stats["submitted"] == 1
+        assert executor.stats["queue_wait"]["count"] == 1
+        assert executor.pending == 0
+
+    async def test_exception(self):
+        executor = BoundedExecutor()
+
+        def fail():
+            raise ValueError
+
+        try:
+            with self.assertRaises(ValueError):
+                await executor.run(fail)
+        finally:
+            executor.shutdown()
+        assert executor.pending == 0
+
+    async def test_queue_full(self):
+        release = threading.Event()
+        executor = BoundedExecutor(max_workers=1, max_queue_depth=1)
+        try:
+            tasks = [
+                asyncio.create_task(executor.run(release.wait))
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            assert executor.pending == 2
+            with self.assertRaises(ExecutorQueueFull):
+                await executor.run(release.wait)
+            release.set()
+            await asyncio.gather(*tasks)
+        finally:
+            release.set()
+            executor.shutdown()
+
+        stats = executor.stats
+        assert stats["pending"] == 0
+        assert stats["submitted"] == 2
+        assert stats["rejected"] == 1
+        assert stats["queue_wait"]["count"] == 2
+        assert stats["queue_wait"]["max"] > 0
+
+    async def test_cancellation(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def wait():
+            started.set()
+            release.wait()
+
+        executor = BoundedExecutor(max_workers=1, max_queue_depth=0)
+        try:
+            task = asyncio.create_task(executor.run(wait))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # running call keeps its slot until it is finished
+            assert executor.pending == 1
+            with self.assertRaises(ExecutorQueueFull):
+                await executor.run(wait)
+            release.set()
+        finally:
+            release.set()
+            executor.shutdown()
+        assert executor.pending == 0
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            BoundedExecutor(max_workers=0)
+        with self.assertRaises(ValueError):
+            BoundedExecutor(max_queue_depth=-1)
+
+
+class JWTExecutorMiddlewaresTests(BaseMiddlewaresTests):
+
+    async def test_jwt_executor(self):
+        executor = BoundedExecutor(thread_name_prefix="test-jwt")
+        mdwr = SimpleJWTAuthTokenMiddleware(MockConsumer(), jwt_executor=executor)
+        auth = mdwr._auth
+        threads = []
+
+        def get_validated_token(token_key):
+            threads.append(threading.current_thread().name)
+            return type(auth).get_validated_token(auth, token_key)
+
+        auth.get_validated_token = get_validated_token
+        try:
+            user = await mdwr.get_user_instance(str(self._simplejwt_token_key))
+            wrong_user = await mdwr.get_user_instance("wrong_token_key")
+        finally:
+            executor.shutdown()
+
+        assert user.id == 1
+        assert wrong_user is None
+        assert len(threads) == 2
+        assert all(name.startswith("test-jwt") for name in threads)
+        assert executor.stats["submitted"] == 2
+
+    async def test_jwt_executor_queue_full(self):
+        release = threading.Event()
+        executor = BoundedExecutor(max_workers=1, max_queue_depth=0)
+        sink = RecordingSink()
+        token_key = str(self._simplejwt_token_key)
+        try:
+            task = asyncio.create_task(executor.run(release.wait))
+            await asyncio.sleep(0)
+
+            mdwr = SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), jwt_executor=executor, metrics_sink=sink)
+            user = await mdwr.get_user_by_token_key(token_key)
+            assert user.is_anonymous
+            assert sink.outcomes == ["queue_full"]
+
+            mdwr = SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), jwt_executor=executor,
+                circuit_open_policy="reject")
+            with self.assertRaises(ExecutorQueueFull):
+                await mdwr.get_user_by_token_key(token_key)
+
+            release.set()
+            await task
+        finally:
+            release.set()
+            executor.shutdown()
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.changes = []
+        self.breaker = CircuitBreaker(
+            failure_rate=0.5, window_size=4, min_calls=4, open_interval=10,
+            half_open_probes=2, timer=self.timer,
+            on_state_change=lambda breaker, old, new: self.changes.append(
+                (old, new, breaker.state)))
+
+    def open_circuit(self):
+        for _ in range(4):
+            assert self.breaker.allow()
+            self.breaker.record_failure()
+
+    def test_failure_rate(self):
+        breaker = self.breaker
+        for failed in (True, False, True):
+            assert breaker.allow()
+            breaker.record_failure() if failed else breaker.record_success()
+        assert breaker.state == "closed"
+        assert breaker.stats["failure_rate"] == 2 / 3
+
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == "open"
+        assert not breaker.allow()
+        assert breaker.stats["rejected"] == 1
+        assert self.changes == [("closed", "open", "open")]
+
+    def test_window(self):
+        breaker = self.breaker
+        for failed in (True, True, False, False, False, False):
+            breaker.record_failure() if failed else breaker.record_success()
+        assert breaker.stats["failures"] == 0
+        assert breaker.stats["calls"] == 4
+        assert breaker.state == "closed"
+
+    def test_half_open_close(self):
+        self.open_circuit()
+        self.timer.now = 9
+        assert not self.breaker.allow()
+        self.timer.now = 10
+        assert self.breaker.allow()
+        assert self.breaker.allow()
+        assert not self.breaker.allow()
+        assert self.breaker.state == "half_open"
+
+        self.breaker.record_success()
+        assert self.breaker.state == "half_open"
+        self.breaker.record_success()
+        assert self.breaker.state == "closed"
+        assert self.breaker.stats["calls"] == 0
+        assert [change[:2] for change in self.changes] == [
+            ("closed", "open"), ("open", "half_open"), ("half_open", "closed")]
+
+    def test_half_open_failure(self):
+        self.open_circuit()
+        self.timer.now = 10
+        assert self.breaker.allow()
+        self.breaker.record_failure()
+        assert self.breaker.state == "open"
+        assert self.breaker.stats["opened"] == 2
+        self.timer.now = 19
+        assert not self.breaker.allow()
+        self.timer.now = 20
+        assert self.breaker.allow()
+
+    def test_half_open_release(self):
+        self.open_circuit()
+        self.timer.now = 10
+        assert self.breaker.allow()
+        assert self.breaker.allow()
+        self.breaker.release()
+        assert self.breaker.allow()
+        assert not self.breaker.allow()
+
+    async def test_call(self):
+        breaker = self.breaker
+        lookup = CountingLookup(result=1)
+        lookup.release.set()
+        assert await breaker.call(lookup, "a") == 1
+
+        lookup = CountingLookup(exception=OperationalError())
+        lookup.release.set()
+        for _ in range(3):
+            with self.assertRaises(OperationalError):
+                await breaker.call(lookup, "a")
+        assert breaker.state == "open"
+        with self.assertRaises(CircuitOpen):
+            await breaker.call(lookup, "a")
+        assert lookup.calls == 3
+
+    async def test_call_ignored_exceptions(self):
+        for exception in (ExecutorQueueFull(), CircuitOpen()):
+            lookup = CountingLookup(exception=exception)
+            lookup.release.set()
+            for _ in range(3):
+                with self.assertRaises(type(exception)):
+                    await self.breaker.call(lookup, "a")
+        assert self.breaker.state == "closed"
+        assert self.breaker.stats["calls"] == 0
+
+    async def test_call_cancellation(self):
+        self.open_circuit()
+        self.timer.now = 10
+        lookup = CountingLookup(result=1)
+        tasks = [
+            asyncio.create_task(self.breaker.call(lookup, "a"))
+            for _ in range(2)
+        ]
+        await lookup.started.wait()
+        tasks[0].cancel()
+        lookup.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert results[1] == 1
+        # cancelled probe is released
+        assert self.breaker.state == "half_open"
+        assert self.breaker.allow()
+
+    def test_reset(self):
+        self.open_circuit()
+        self.breaker.reset()
+        assert self.breaker.state == "closed"
+        assert self.breaker.allow()
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            CircuitBreaker(failure_rate=0)
+        with self.assertRaises(ValueError):
+            CircuitBreaker(window_size=0)
+
+
+class FailingHeaderAuthTokenMiddleware(TestHeaderAuthTokenMiddleware):
+
+    failing = True
+
+    async def get_user_instance(self, token_key):
+        if self.failing:
+            raise OperationalError("database is unavailable")
+        return await super().get_user_instance(token_key)
+
+
+class CircuitBreakerMiddlewaresTests(BaseMiddlewaresTests):
+
+    def _scope(self):
+        return {"headers": [(b"test-authorization", b"Id 1")]}
+
+    def _breaker(self, timer):
+        return CircuitBreaker(
+            window_size=2, min_calls=2, open_interval=10, timer=timer)
+
+    async def test_circuit_breaker(self):
+        timer = FakeTimer()
+        sink = RecordingSink()
+        mdwr = FailingHeaderAuthTokenMiddleware(
+            MockConsumer(), circuit_breaker=self._breaker(timer),
+            metrics_sink=sink)
+        for _ in range(2):
+            with self.assertRaises(OperationalError):
+                await mdwr(self._scope(), None, None)
+        assert mdwr.circuit_breaker.state == "open"
+
+        # fails fast without lookups
+        mdwr.failing = False
+        assert (await mdwr(self._scope(), None, None))["user"].is_anonymous
+        assert sink.outcomes == ["circuit_open"]
+
+        timer.now = 10
+        assert (await mdwr(self._scope(), None, None))["user"].id == 1
+        assert mdwr.circuit_breaker.state == "closed"
+
+    async def test_circuit_open_reject_policy(self):
+        mdwr = FailingHeaderAuthTokenMiddleware(
+            MockConsumer(), circuit_breaker=self._breaker(FakeTimer()),
+            circuit_open_policy="reject")
+        for _ in range(2):
+            with self.assertRaises(OperationalError):
+                await mdwr(self._scope(), None, None)
+        with self.assertRaises(CircuitOpen):
+            await mdwr(self._scope(), None, None)
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "websocket", **self._scope()}
+        assert await mdwr(scope, None, send) is None
+        assert messages == [{"type": "websocket.close", "code": 1013}]
+
+    async def test_circuit_open_stale_policy(self):
+        mdwr = FailingHeaderAuthTokenMiddleware(
+            MockConsumer(), circuit_breaker=self._breaker(FakeTimer()),
+            circuit_open_policy="stale",
+            stale_user_cache=TokenCache(maxsize=8))
+        mdwr.failing = False
+        assert (await mdwr(self._scope(), None, None))["user"].id == 1
+
+        mdwr.failing = True
+        with self.assertRaises(OperationalError):
+            await mdwr(self._scope(), None, None)
+        assert mdwr.circuit_breaker.state == "open"
+        assert (await mdwr(self._scope(), None, None))["user"].id == 1
+
+    async def test_lookup_timeout_failure(self):
+        lookup = CountingLookup()
+        mdwr = CoalescingHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.01,
+            circuit_breaker=self._breaker(FakeTimer()))
+        mdwr.lookup = lookup
+        for _ in range(2):
+            assert (await mdwr(self._scope(), None, None))["user"].is_anonymous
+        assert lookup.calls == 2
+        assert mdwr.circuit_breaker.state == "open"
+        assert (await mdwr(self._scope(), None, None))["user"].is_anonymous
+        assert lookup.calls == 2
+
+    async def test_coalesced_lookups_failure(self):
+        lookup = CountingLookup(exception=OperationalError())
+        mdwr = CoalescingHeaderAuthTokenMiddleware(
+            MockConsumer(), coalesce_lookups=True,
+            circuit_breaker=CircuitBreaker())
+        mdwr.lookup = lookup
+        tasks = [
+            asyncio.create_task(mdwr(self._scope(), None, None))
+            for _ in range(20)
+        ]
+        await lookup.started.wait()
+        lookup.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(result, OperationalError) for result in results)
+        assert lookup.calls == 1
+        assert mdwr.circuit_breaker.stats["calls"] == 1
+        assert mdwr.circuit_breaker.stats["failures"] == 1
+
+    def test_drf_auth_token_middleware_circuit_breaker(self):
+        breaker = CircuitBreaker()
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), circuit_breaker=breaker)
+        scope = {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+        assert async_to_sync(mdwr)(scope, None, None)["user"].id == 1
+        assert breaker.stats["calls"] == 1
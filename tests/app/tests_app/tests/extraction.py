@@ -0,0 +1,231 @@
+import random
+
+from http.cookies import BaseCookie
+from unittest import mock
+from urllib.parse import parse_qs
+
+from django.test import SimpleTestCase
+
+from channels_auth_token_middlewares.middleware.base import (
+    SCOPE_LOOKUPS_KEY, SCOPE_REQUEST_KEY, ScopeRequest,
+    get_cookie_value, get_query_param_value, get_scope_request,
+)
+
+from tests_app.consumer import MockConsumer
+from tests_app.middleware import (
+    TestCookieAuthTokenMiddleware, TestHeaderAuthTokenMiddleware,
+    TestQueryStringAuthTokenMiddleware,
+)
+
+
+def legacy_get_cookie_value(cookie_raw_data, cookie_name):
+    cookie = BaseCookie()
+    cookie.load(cookie_raw_data)
+    cookie_item = cookie.get(cookie_name)
+    if not cookie_item:
+        return None
+    return cookie_item.value
+
+
+def legacy_get_query_param_value(raw_query_string, query_param):
+    query_params = parse_qs(raw_query_string.decode())
+    values = query_params.get(query_param)
+    if not values:
+        return None
+    return values[0]
+
+
+class ExtractionTests(SimpleTestCase):
+
+    def test_token_key_string_pattern(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer(), token_regex=r"\d+")
+        assert mdwr.token_key_string_pattern is mdwr.token_key_string_pattern
+        assert mdwr.token_key_string_pattern.pattern == r"Id (\d+)"
+        assert mdwr.parse_token_key("Id 12") == "12"
+        assert mdwr.parse_token_key("Id 1a") is None
+        assert mdwr.parse_token_key("Token 12") is None
+
+    def test_get_scope_header_value(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer())
+        scope = {"headers": [(b"test-authorization", b"Id 1")]}
+        assert mdwr.get_scope_header_value(scope, "Test-Authorization") == "Id 1"
+        assert mdwr.get_scope_header_value(scope, b"test-authorization") == "Id 1"
+        assert mdwr.get_scope_header_value(scope, "Cookie") is None
+        with self.assertRaises(ValueError):
+            mdwr.get_scope_header_value(scope, 1)
+
+    def test_get_cookie_value_as_base_cookie(self):
+        jar = "; ".join(f"_c{i}=GA1.1.{i}" for i in range(50))
+        for cookie_raw_data in [
+            "",
+            "test=1",
+            "test=",
+            "  test  =  1 ;",
+            "a=2; test=abc; b=3",
+            "a=1 test=2",
+            "testing=1; test=2",
+            "x_test=1; test=2",
+            "x=test=5",
+            "test1=1",
+            'test="1"',
+            'test="a\\"b\\012"',
+            'a="q"; test="v"',
+            'a="x; test=2"; test=3',
+            'a="x; test=2"',
+            "test=a=b; c=d",
+            f"{jar}; test=1",
+            f"test=1; {jar}",
+            jar,
+        ]:
+            with self.subTest(cookie_raw_data=cookie_raw_data):
+                assert (
+                    get_cookie_value(cookie_raw_data, "test")
+                    == legacy_get_cookie_value(cookie_raw_data, "test")
+                )
+
+    def test_get_cookie_value_first_match(self):
+        assert get_cookie_value("test=1; test=2", "test") == "1"
+        assert get_cookie_value('a="b"; test=1; test=2', "test") == "1"
+
+    def test_get_cookie_value_malformed_cookies_skipped(self):
+        for cookie_raw_data in [
+            'bad"cookie=1; test=ok',
+            "bad\\cookie=1; test=ok",
+            'a="unterminated; test=ok',
+            "=; ;; test=ok",
+        ]:
+            assert legacy_get_cookie_value(cookie_raw_data, "test") is None
+            assert get_cookie_value(cookie_raw_data, "test") == "ok"
+
+    def assert_query_param_value_as_parse_qs(self, raw_query_string, query_param):
+        assert (
+            get_query_param_value(raw_query_string, query_param)
+            == legacy_get_query_param_value(raw_query_string, query_param)
+        ), raw_query_string
+
+    def test_get_query_param_value_as_parse_qs(self):
+        tracking = "&".join(f"utm_{i}=v%20{i}" for i in range(30)).encode()
+        for raw_query_string in [
+            b"",
+            b"&",
+            b"token",
+            b"token=",
+            b"token=1",
+            b"token==1",
+            b"token=1=2",
+            b"=1&token=2",
+            b"token&token=1",
+            b"token=&token=1",
+            b"token=1&token=2",
+            b"tokens=1&token=2",
+            b"x_token=1&token=2",
+            b"a=token%3D1&token=2",
+            b"token=a%26b%3Dc",
+            b"token=a+b%2Bc",
+            b"token=%",
+            b"token=%zz%4",
+            b"token=%E2%9C%93",
+            b"token=%E2%9C",
+            "token=\u2713".encode(),
+            b"tok%65n=1&token=2",
+            b"token%3D1=2",
+            b"to+ken=1",
+            b"&&token=1&&",
+            b"token=1;token=2",
+            tracking + b"&token=1",
+            b"token=1&" + tracking,
+            tracking,
+        ]:
+            with self.subTest(raw_query_string=raw_query_string):
+                self.assert_query_param_value_as_parse_qs(raw_query_string, "token")
+        self.assert_query_param_value_as_parse_qs(b"to+ken=1", "to ken")
+        self.assert_query_param_value_as_parse_qs(b"a%26b=1", "a&b")
+
+    def test_get_query_param_value_as_parse_qs_random(self):
+        parts = [
+            "token", "tok%65n", "t", "to+ken", "=", "&", "+", "%", "%2",
+            "%26", "%3D", "%2B", "%E2%9C%93", "\u2713", "1", "abc", ";",
+        ]
+        rand = random.Random(0)
+        for _ in range(3000):
+            raw_query_string = "".join(
+                rand.choice(parts) for _ in range(rand.randint(0, 12))).encode()
+            for query_param in ("token", "to ken", "t"):
+                self.assert_query_param_value_as_parse_qs(
+                    raw_query_string, query_param)
+
+
+class ScopeRequestTests(SimpleTestCase):
+
+    def test_header(self):
+        headers = [
+            (b"Test-Authorization", b"Id 1"),
+            (b"test-authorization", b"Id 2"),
+            (b"test-authorization", b"Id 3"),
+            (b"cookie", b"test=1"),
+        ]
+        request = get_scope_request({"headers": headers})
+        # exact name match takes precedence, last header wins
+        assert request.header(b"Test-Authorization") == b"Id 1"
+        assert request.header(b"test-authorization") == b"Id 3"
+        assert request.header(b"Cookie") == b"test=1"
+        assert request.header(b"authorization") is None
+        assert request.lower_headers == {
+            b"test-authorization": b"Id 3", b"cookie": b"test=1"}
+
+    def test_cookie_and_query_param(self):
+        request = get_scope_request({
+            "headers": [(b"Cookie", b"a=1; test=2")],
+            "query_string": b"test=3&b=",
+        })
+        assert request.cookie("test") == "2"
+        assert request.cookie("b") is None
+        assert request.query_param("test") == "3"
+        assert request.query_param("b") is None
+        assert request.cookie("test") == "2"
+
+        request = get_scope_request({"headers": []})
+        assert request.cookie("test") is None
+        assert request.query_param("test") is None
+
+    def test_memo(self):
+        scope = {"headers": [(b"cookie", b"test=1")], "query_string": b""}
+        request = get_scope_request(scope)
+        assert scope[SCOPE_REQUEST_KEY] is request
+        assert get_scope_request(dict(scope)) is request
+
+        # replaced headers or query string invalidate the memo
+        scope = dict(scope, headers=[(b"cookie", b"test=2")])
+        assert get_scope_request(scope) is not request
+        assert get_scope_request(scope).cookie("test") == "2"
+        scope = dict(scope, query_string=b"test=3")
+        assert get_scope_request(scope).query_param("test") == "3"
+
+    async def test_stacked_middlewares(self):
+        mdwr = TestQueryStringAuthTokenMiddleware(
+            TestCookieAuthTokenMiddleware(
+                TestHeaderAuthTokenMiddleware(MockConsumer())))
+        scope = {"headers": [(b"cookie", b"other=1")], "query_string": b"a=1"}
+        requests = []
+
+        def build_request(scope):
+            requests.append(ScopeRequest(scope))
+            return requests[-1]
+
+        with mock.patch(
+            "channels_auth_token_middlewares.middleware.base.ScopeRequest",
+            side_effect=build_request,
+        ):
+            inner_scope = await mdwr(scope, None, None)
+
+        # memo is placed by the outer layer and reused by inner ones
+        assert len(requests) == 1
+        request = requests[0]
+        assert request.headers is scope["headers"]
+        assert request._cookies == {"test": None}
+        assert request._query_params == {"test": None}
+        assert request._headers_index == {b"cookie": b"other=1"}
+        assert inner_scope["user"].is_anonymous
+        # application scope doesn't keep middlewares helpers
+        assert SCOPE_REQUEST_KEY not in inner_scope
+        assert SCOPE_LOOKUPS_KEY not in inner_scope
@@ -0,0 +1,107 @@
+import asyncio
+
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import empty
+
+from channels.auth import UserLazyObject
+from channels.testing import WebsocketCommunicator
+
+from channels_auth_token_middlewares.middleware import DRFAuthTokenMiddlewareStack
+
+from tests_app.consumer import MockConsumer, TestLazyWebsocketConsumer
+from tests_app.middleware import (
+    TestHeaderAuthTokenMiddleware, TestQueryStringAuthTokenMiddleware,
+)
+
+from .base import BaseMiddlewaresTests
+
+
+class LazyUserMiddlewaresTests(BaseMiddlewaresTests):
+
+    async def test_lazy_user_not_accessed(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer(), lazy_user=True)
+        scope = {"headers": [(b"test-authorization", b"Id 1")]}
+        with mock.patch.object(mdwr, "get_user_instance") as get_user_instance:
+            updated_scope = await mdwr(scope, None, None)
+        get_user_instance.assert_not_called()
+        assert updated_scope["user"]._wrapped is empty
+
+    async def test_lazy_user(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer(), lazy_user=True)
+        scope = {"headers": [(b"test-authorization", b"Id 1")]}
+        updated_scope = await mdwr(scope, None, None)
+
+        with mock.patch.object(
+            mdwr, "get_user_instance", wraps=mdwr.get_user_instance,
+        ) as get_user_instance:
+            users = await asyncio.gather(
+                updated_scope["auser"](), updated_scope["auser"]())
+            user = await updated_scope["auser"]()
+        get_user_instance.assert_called_once_with("1")
+        assert users[0] is users[1] is user
+        assert user.id == 1
+        assert updated_scope["user"].id == 1
+
+    async def test_lazy_user_anonymous(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer(), lazy_user=True)
+        for scope in [
+            {"headers": []},
+            {"headers": [(b"test-authorization", b"Id 2")]},
+        ]:
+            updated_scope = await mdwr(scope, None, None)
+            assert (await updated_scope["auser"]()).is_anonymous
+            assert updated_scope["user"].is_anonymous
+
+    async def test_lazy_user_already_resolved(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer(), lazy_user=True)
+        user = UserLazyObject()
+        user._wrapped = await self.get_user()
+        scope = {"headers": [(b"test-authorization", b"Id 2")], "user": user}
+        with mock.patch.object(mdwr, "get_user_instance") as get_user_instance:
+            updated_scope = await mdwr(scope, None, None)
+            assert (await updated_scope["auser"]()).id == 1
+        get_user_instance.assert_not_called()
+
+    async def test_lazy_user_after_anonymous(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer(), lazy_user=True)
+        user = UserLazyObject()
+        user._wrapped = AnonymousUser()
+        scope = {"headers": [(b"test-authorization", b"Id 1")], "user": user}
+        updated_scope = await mdwr(scope, None, None)
+        assert updated_scope["user"].is_anonymous
+        assert (await updated_scope["auser"]()).id == 1
+        assert updated_scope["user"].id == 1
+
+    async def test_nested_lazy_users(self):
+        mdwr = TestHeaderAuthTokenMiddleware(
+            TestQueryStringAuthTokenMiddleware(MockConsumer(), lazy_user=True),
+            lazy_user=True,
+        )
+        for scope, user_id in [
+            ({"headers": [(b"test-authorization", b"Id 1")],
+              "query_string": b"test=2"}, 1),
+            ({"headers": [(b"test-authorization", b"Id 2")],
+              "query_string": b"test=1"}, 1),
+            ({"headers": [], "query_string": b"test=2"}, None),
+        ]:
+            updated_scope = await mdwr(scope, None, None)
+            user = await updated_scope["auser"]()
+            assert user.id == user_id
+
+    async def test_lazy_websocket_consumer(self):
+        mdwr = DRFAuthTokenMiddlewareStack(
+            TestLazyWebsocketConsumer(), lazy_user=True)
+        for headers, success in [
+            ([(b"authorization", f"Token {self._drf_token_key}".encode())], True),
+            ([(b"authorization", f"Token {'0' * 40}".encode())], False),
+        ]:
+            communicator = WebsocketCommunicator(mdwr, "/test/", headers=headers)
+            connected, _ = await communicator.connect()
+            assert connected is success
+            await communicator.disconnect()
+
+    async def get_user(self):
+        mdwr = TestHeaderAuthTokenMiddleware(MockConsumer())
+        return await mdwr.get_user_instance("1")
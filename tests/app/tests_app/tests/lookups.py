@@ -0,0 +1,85 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddleware, QueryStringDRFAuthTokenMiddleware,
+    QueryStringSimpleJWTAuthTokenMiddleware, SimpleJWTAuthTokenMiddleware,
+)
+from channels_auth_token_middlewares.middleware.base import SCOPE_LOOKUPS_KEY
+
+from tests_app.consumer import MockConsumer
+from tests_app.middleware import (
+    TestCookieAuthTokenMiddleware, TestHeaderAuthTokenMiddleware,
+)
+
+from .base import BaseMiddlewaresTests
+
+
+BAD_DRF_TOKEN_KEY = "0" * 40
+
+
+class LookupsLedgerMiddlewaresTests(BaseMiddlewaresTests):
+
+    def _scope(self, header_token_key, query_token_key, keyword="Token"):
+        return {
+            "headers": [
+                (b"authorization", f"{keyword} {header_token_key}".encode()),
+            ],
+            "query_string": f"token={query_token_key}".encode(),
+        }
+
+    def _drf_stack(self, **kwargs):
+        return DRFAuthTokenMiddleware(
+            QueryStringDRFAuthTokenMiddleware(MockConsumer(), **kwargs),
+            **kwargs)
+
+    def test_drf_stack_bad_token_looked_up_once(self):
+        mdwr = self._drf_stack()
+        scope = self._scope(BAD_DRF_TOKEN_KEY, BAD_DRF_TOKEN_KEY)
+        with self.assertNumQueries(1):
+            scope = async_to_sync(mdwr)(scope, None, None)
+        assert scope["user"].is_anonymous
+        assert SCOPE_LOOKUPS_KEY not in scope
+
+    def test_drf_stack_other_token_looked_up(self):
+        mdwr = self._drf_stack()
+        scope = self._scope(BAD_DRF_TOKEN_KEY, self._drf_token_key)
+        with self.assertNumQueries(2):
+            scope = async_to_sync(mdwr)(scope, None, None)
+        assert scope["user"].id == 1
+
+    def test_drf_stack_lazy_user(self):
+        mdwr = self._drf_stack(lazy_user=True)
+        scope = self._scope(BAD_DRF_TOKEN_KEY, BAD_DRF_TOKEN_KEY)
+        scope = async_to_sync(mdwr)(scope, None, None)
+        with self.assertNumQueries(1):
+            assert async_to_sync(scope["auser"])().is_anonymous
+
+    def test_simplejwt_stack_bad_token_looked_up_once(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            QueryStringSimpleJWTAuthTokenMiddleware(MockConsumer()))
+        scope = self._scope("bad", "bad", keyword="Bearer")
+        with mock.patch.object(
+            SimpleJWTAuthTokenMiddleware, "get_jwt_user_instance",
+            autospec=True, return_value=None,
+        ) as get_jwt_user_instance:
+            scope = async_to_sync(mdwr)(scope, None, None)
+        assert scope["user"].is_anonymous
+        get_jwt_user_instance.assert_called_once_with(mdwr, "bad")
+
+    def test_other_backends_not_shared(self):
+        mdwr = TestHeaderAuthTokenMiddleware(
+            TestCookieAuthTokenMiddleware(MockConsumer()))
+        headers = [(b"test-authorization", b"Id 2"), (b"cookie", b"test=2")]
+        with self.assertNumQueries(2):
+            scope = async_to_sync(mdwr)({"headers": headers}, None, None)
+        assert scope["user"].is_anonymous
+
+        mdwr = TestHeaderAuthTokenMiddleware(
+            TestCookieAuthTokenMiddleware(
+                MockConsumer(), lookup_backend="test"),
+            lookup_backend="test")
+        with self.assertNumQueries(1):
+            scope = async_to_sync(mdwr)({"headers": headers}, None, None)
+        assert scope["user"].is_anonymous
@@ -0,0 +1,161 @@
+import os
+import socket
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from channels_auth_token_middlewares.cache import TokenCache
+from channels_auth_token_middlewares.metrics import (
+    MetricsSink, PrometheusTextSink, StatsdSink,
+)
+from channels_auth_token_middlewares.middleware import DRFAuthTokenMiddlewareStack
+
+from tests_app.consumer import MockConsumer
+from tests_app.middleware import (
+    TestHeaderAuthTokenMiddleware, TestMultiSourceAuthTokenMiddleware,
+)
+
+from .base import BaseMiddlewaresTests
+
+
+class RecordingSink(MetricsSink):
+
+    def __init__(self):
+        self.timings = []
+        self.outcomes = []
+
+    def timing(self, stage, seconds):
+        assert seconds >= 0
+        self.timings.append(stage)
+
+    def count(self, outcome):
+        self.outcomes.append(outcome)
+
+
+class MetricsMiddlewaresTests(BaseMiddlewaresTests):
+
+    async def assert_metrics(self, mdwr, scope, outcome, stages):
+        sink = mdwr.metrics_sink = RecordingSink()
+        await mdwr(scope, None, None)
+        assert sink.outcomes == [outcome]
+        assert sink.timings == stages
+
+    async def test_outcomes(self):
+        mdwr = TestHeaderAuthTokenMiddleware(
+            MockConsumer(), token_regex=r"\d+", metrics_sink=RecordingSink())
+        all_stages = ["token_key_string", "parse_token_key", "user_instance"]
+        for headers, outcome, stages in [
+            ([], "no_token", ["token_key_string"]),
+            ([(b"test-authorization", b"Id x")], "malformed",
+             ["token_key_string", "parse_token_key"]),
+            ([(b"test-authorization", b"Id 2")], "not_found", all_stages),
+            ([(b"test-authorization", b"Id 1")], "authenticated", all_stages),
+        ]:
+            await self.assert_metrics(mdwr, {"headers": headers}, outcome, stages)
+
+    async def test_multi_source_outcomes(self):
+        mdwr = TestMultiSourceAuthTokenMiddleware(MockConsumer())
+        all_stages = ["token_key_string", "parse_token_key", "user_instance"]
+        for scope, outcome, stages in [
+            ({"headers": [], "query_string": b""}, "no_token",
+             ["token_key_string"]),
+            ({"headers": [(b"test-authorization", b"Id x")], "query_string": b""},
+             "malformed", ["token_key_string", "parse_token_key"]),
+            ({"headers": [(b"test-authorization", b"Id x")], "query_string": b"test=1"},
+             "authenticated", all_stages),
+            ({"headers": [], "query_string": b"test=2"}, "not_found", all_stages),
+        ]:
+            await self.assert_metrics(mdwr, scope, outcome, stages)
+
+    async def test_rejected_token_cache_outcome(self):
+        sink = RecordingSink()
+        mdwr = TestHeaderAuthTokenMiddleware(
+            MockConsumer(), metrics_sink=sink, rejected_token_cache=TokenCache())
+        scope = {"headers": [(b"test-authorization", b"Id 2")]}
+        await mdwr(scope, None, None)
+        await mdwr(scope, None, None)
+        assert sink.outcomes == ["not_found", "not_found"]
+        assert sink.timings.count("user_instance") == 1
+
+    async def test_stack_lazy_user_outcome(self):
+        sink = RecordingSink()
+        mdwr = DRFAuthTokenMiddlewareStack(
+            MockConsumer(), metrics_sink=sink, lazy_user=True)
+        scope = {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())]}
+        updated_scope = await mdwr(scope, None, None)
+        assert sink.outcomes == []
+        assert (await updated_scope["auser"]()).id == 1
+        assert sink.outcomes == ["authenticated"]
+
+
+class MetricsSinksTests(SimpleTestCase):
+
+    def test_no_op_sink(self):
+        sink = MetricsSink()
+        assert sink.timing("user_instance", 0.1) is None
+        assert sink.count("authenticated") is None
+
+    def test_prometheus_text_sink(self):
+        sink = PrometheusTextSink(prefix="auth", buckets=[0.01, 0.1])
+        sink.count("authenticated")
+        sink.count("authenticated")
+        sink.count("no_token")
+        sink.timing("user_instance", 0.005)
+        sink.timing("user_instance", 0.05)
+        sink.timing("user_instance", 5)
+
+        text = sink.render()
+        assert "# TYPE auth_outcomes_total counter" in text
+        assert 'auth_outcomes_total{outcome="authenticated"} 2' in text
+        assert 'auth_outcomes_total{outcome="no_token"} 1' in text
+        assert 'auth_outcomes_total{outcome="malformed"} 0' in text
+        assert "# TYPE auth_stage_seconds histogram" in text
+        assert 'auth_stage_seconds_bucket{stage="user_instance",le="0.01"} 1' in text
+        assert 'auth_stage_seconds_bucket{stage="user_instance",le="0.1"} 2' in text
+        assert 'auth_stage_seconds_bucket{stage="user_instance",le="+Inf"} 3' in text
+        assert 'auth_stage_seconds_sum{stage="user_instance"} 5.055' in text
+        assert 'auth_stage_seconds_count{stage="user_instance"} 3' in text
+
+    def test_prometheus_text_sink_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "auth.prom")
+            sink = PrometheusTextSink(path=path)
+            sink.count("authenticated")
+            assert not os.path.exists(path)
+
+            sink.write()
+            with open(path) as metrics_file:
+                assert metrics_file.read() == sink.render()
+            assert os.listdir(directory) == ["auth.prom"]
+
+    def test_prometheus_text_sink_periodic_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "auth.prom")
+            sink = PrometheusTextSink(path=path, write_interval=0.01)
+            try:
+                sink.count("authenticated")
+                for _ in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.01)
+            finally:
+                sink.close()
+            assert not sink._writer.is_alive()
+            with open(path) as metrics_file:
+                assert metrics_file.read() == sink.render()
+
+    def test_statsd_sink(self):
+        collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        collector.bind(("127.0.0.1", 0))
+        collector.settimeout(1)
+        sink = StatsdSink(port=collector.getsockname()[1], prefix="auth")
+        try:
+            sink.count("not_found")
+            sink.timing("parse_token_key", 0.0015)
+            assert collector.recv(1024) == b"auth.outcome.not_found:1|c"
+            assert collector.recv(1024) == b"auth.stage.parse_token_key:1.500|ms"
+        finally:
+            sink.close()
+            collector.close()
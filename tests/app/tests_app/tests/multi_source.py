@@ -0,0 +1,134 @@
+from unittest import mock
+
+from channels.testing import WebsocketCommunicator
+
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddlewareStack, MultiSourceDRFAuthTokenMiddleware,
+    MultiSourceSimpleJWTAuthTokenMiddleware, SimpleJWTAuthTokenMiddlewareStack,
+)
+
+from tests_app.consumer import MockConsumer, TestWebsocketConsumer
+from tests_app.middleware import TestMultiSourceAuthTokenMiddleware
+
+from .base import BaseMiddlewaresTests
+
+
+class CountingHeaders(list):
+
+    iterations = 0
+
+    def __iter__(self):
+        self.iterations += 1
+        return super().__iter__()
+
+
+class MultiSourceMiddlewaresTests(BaseMiddlewaresTests):
+
+    async def test_sources(self):
+        mdwr = TestMultiSourceAuthTokenMiddleware(MockConsumer())
+        for scope in [
+            {"headers": [(b"test-authorization", b"Id 1")]},
+            {"headers": [(b"Test-Authorization", b"Id 1")]},
+            {"headers": [(b"cookie", b"test=1")]},
+            {"headers": [], "query_string": b"test=1"},
+        ]:
+            updated_scope = await mdwr(scope, None, None)
+            assert updated_scope["user"].id == 1
+
+        for scope in [
+            {"headers": []},
+            {"headers": [(b"test-authorization", b"Id 2")]},
+            {"headers": [(b"cookie", b"test=2")]},
+            {"headers": [], "query_string": b"test=2"},
+        ]:
+            updated_scope = await mdwr(scope, None, None)
+            assert updated_scope["user"].is_anonymous
+
+    async def test_sources_order(self):
+        mdwr = TestMultiSourceAuthTokenMiddleware(MockConsumer())
+        scope = {
+            "headers": [
+                (b"cookie", b"test=2"),
+                (b"test-authorization", b"Id 1"),
+            ],
+            "query_string": b"test=2",
+        }
+        updated_scope = await mdwr(scope, None, None)
+        assert updated_scope["user"].id == 1
+
+    async def test_malformed_source_skipped(self):
+        mdwr = TestMultiSourceAuthTokenMiddleware(MockConsumer())
+        scope = {
+            "headers": [(b"test-authorization", b"Id wrong")],
+            "query_string": b"test=1",
+        }
+        updated_scope = await mdwr(scope, None, None)
+        assert updated_scope["user"].id == 1
+
+    async def test_next_source_lookup(self):
+        mdwr = TestMultiSourceAuthTokenMiddleware(MockConsumer())
+        headers = CountingHeaders([
+            (b"test-authorization", b"Id 2"),
+            (b"cookie", b"test=1"),
+        ])
+        scope = {"headers": headers, "query_string": b"test=1"}
+        with mock.patch.object(
+            mdwr, "get_user_instance", wraps=mdwr.get_user_instance,
+        ) as get_user_instance:
+            updated_scope = await mdwr(scope, None, None)
+
+        # not found header token key is followed by cookie one,
+        # the same query string token key is not looked up again
+        assert updated_scope["user"].id == 1
+        assert get_user_instance.call_args_list == [
+            mock.call("2"), mock.call("1")]
+        assert headers.iterations == 1
+
+    async def test_drf_auth_token_middleware_stack_bad_header_token(self):
+        mdwr = DRFAuthTokenMiddlewareStack(MockConsumer())
+        scope = {
+            "headers": [(b"authorization", f"Token {'0' * 40}".encode())],
+            "query_string": f"token={self._drf_token_key}".encode(),
+        }
+        assert (await mdwr(scope, None, None))["user"].id == 1
+
+        mdwr = DRFAuthTokenMiddlewareStack(MockConsumer(), lazy_user=True)
+        scope = await mdwr(scope, None, None)
+        assert (await scope["auser"]()).id == 1
+
+    async def test_drf_auth_token_middleware_stack(self):
+        mdwr = DRFAuthTokenMiddlewareStack(TestWebsocketConsumer())
+        assert isinstance(mdwr, MultiSourceDRFAuthTokenMiddleware)
+        await self._test_middleware(mdwr, True, headers=[
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ])
+        await self._test_middleware(
+            mdwr, True, path=f"/test/?token={self._drf_token_key}")
+        await self._test_middleware(mdwr, False, headers=[
+            (b"authorization", b"Token wrong_token_key")
+        ])
+        await self._test_middleware(mdwr, False, path="/test/?token=wrong")
+        await self._test_middleware(mdwr, False)
+
+    async def test_simplejwt_auth_token_middleware_stack(self):
+        mdwr = SimpleJWTAuthTokenMiddlewareStack(TestWebsocketConsumer())
+        assert isinstance(mdwr, MultiSourceSimpleJWTAuthTokenMiddleware)
+        await self._test_middleware(mdwr, True, headers=[
+            (b"authorization", f"Bearer {self._simplejwt_token_key}".encode())
+        ])
+        await self._test_middleware(
+            mdwr, True, path=f"/test/?token={self._simplejwt_token_key}")
+        await self._test_middleware(mdwr, False, headers=[
+            (b"authorization", b"Bearer wrong_token_key")
+        ])
+        await self._test_middleware(mdwr, False)
+
+    async def _test_middleware(self, mdwr, success, path=None, headers=None):
+        path = path or "/test/"
+        headers = headers or []
+
+        communicator = WebsocketCommunicator(mdwr, path, headers=headers)
+        connected, _ = await communicator.connect()
+        assert connected is success
+
+        await communicator.disconnect()
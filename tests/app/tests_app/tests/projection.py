@@ -0,0 +1,196 @@
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authtoken.models import Token
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from channels_auth_token_middlewares.cache import TieredUserCache, TokenCache
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddleware, DRFAuthTokenMiddlewareStack,
+    SimpleJWTAuthTokenMiddleware, SimpleJWTAuthTokenMiddlewareStack,
+)
+
+from tests_app.consumer import MockConsumer
+from tests_app.models import Profile
+
+from .base import BaseMiddlewaresTests
+
+
+class ProfileDRFAuthTokenMiddleware(DRFAuthTokenMiddleware):
+
+    def get_user_queryset(self):
+        return super().get_user_queryset().select_related("profile")
+
+
+class UserQuerysetMiddlewaresTests(BaseMiddlewaresTests):
+
+    def setUp(self):
+        user = get_user_model().objects.get(id=1)
+        Profile.objects.create(user=user, nickname="tester")
+        user.groups.add(Group.objects.create(name="testers"))
+
+    def _drf_scope(self):
+        return {"headers": [
+            (b"authorization", f"Token {self._drf_token_key}".encode())
+        ]}
+
+    def _simplejwt_scope(self, token_key=None):
+        token_key = token_key or self._simplejwt_token_key
+        return {"headers": [
+            (b"authorization", f"Bearer {token_key}".encode())
+        ]}
+
+    def test_drf_auth_token_middleware_default_queryset(self):
+        mdwr = DRFAuthTokenMiddleware(MockConsumer())
+        with CaptureQueriesContext(connection) as queries:
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+            assert user.id == 1
+        assert user.get_deferred_fields() == set()
+        # token is got with its user like Django REST framework does
+        assert len(queries) == 1
+        table = Token._meta.db_table
+        assert f'FROM "{table}"' in queries[0]["sql"]
+
+    def test_mixins_kwargs(self):
+        for mdwr in (
+            DRFAuthTokenMiddleware(
+                MockConsumer(), user_only=("id",), lazy_user=True),
+            SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), user_only=("id",), lazy_user=True),
+        ):
+            assert mdwr.user_only[0] == "id"
+            assert mdwr.lazy_user
+        with self.assertRaises(TypeError):
+            DRFAuthTokenMiddleware(MockConsumer(), jwt_executor=None)
+
+    def test_drf_auth_token_middleware_select_related(self):
+        mdwr = DRFAuthTokenMiddlewareStack(
+            MockConsumer(), user_select_related=("profile",))
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+            assert user.profile.nickname == "tester"
+
+    def test_drf_auth_token_middleware_prefetch_related(self):
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), user_prefetch_related=("groups",))
+        with self.assertNumQueries(2):
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+        with self.assertNumQueries(0):
+            assert [group.name for group in user.groups.all()] == ["testers"]
+
+    def test_drf_auth_token_middleware_only_defer(self):
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_only=("username",))
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+            assert user.username == "test"
+        assert "email" in user.get_deferred_fields()
+        assert "username" not in user.get_deferred_fields()
+
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), user_defer=("password",))
+        user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+        assert user.get_deferred_fields() == {"password"}
+
+    def test_drf_auth_token_middleware_batch_select_related(self):
+        User = get_user_model()
+        tokens = [
+            Token.objects.create(user=User.objects.create_user(f"batch_{i}"))
+            for i in range(2)
+        ]
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), batch_window=0.01,
+            user_select_related=("profile",), user_defer=("password",))
+        token_keys = [self._drf_token_key] + [token.key for token in tokens]
+        with self.assertNumQueries(1):
+            users = async_to_sync(mdwr.get_drf_users)(token_keys)
+            assert users[self._drf_token_key].profile.nickname == "tester"
+        for token in tokens:
+            assert users[token.key].id == token.user_id
+        for user in users.values():
+            assert user.get_deferred_fields() == {"password"}
+            assert not hasattr(user, "_channels_auth_token_key")
+
+    def test_drf_auth_token_middleware_get_user_queryset(self):
+        mdwr = ProfileDRFAuthTokenMiddleware(MockConsumer())
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(self._drf_scope(), None, None)["user"]
+            assert user.profile.nickname == "tester"
+
+    def test_drf_auth_token_middleware_user_cache(self):
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), user_cache=TokenCache(),
+            user_select_related=("profile",))
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                user = async_to_sync(mdwr)(
+                    self._drf_scope(), None, None)["user"]
+                assert user.profile.nickname == "tester"
+
+    def test_simplejwt_auth_token_middleware_select_related(self):
+        mdwr = SimpleJWTAuthTokenMiddlewareStack(
+            MockConsumer(), user_select_related=("profile",))
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(
+                self._simplejwt_scope(), None, None)["user"]
+            assert user.id == 1
+            assert user.profile.nickname == "tester"
+
+    def test_simplejwt_auth_token_middleware_prefetch_related(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), jwt_validate_on_loop=True,
+            user_prefetch_related=("groups",))
+        with self.assertNumQueries(2):
+            user = async_to_sync(mdwr)(
+                self._simplejwt_scope(), None, None)["user"]
+        with self.assertNumQueries(0):
+            assert [group.name for group in user.groups.all()] == ["testers"]
+
+    def test_simplejwt_auth_token_middleware_only(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), user_only=("username",))
+        assert mdwr.user_only == ("username", "is_active")
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr)(
+                self._simplejwt_scope(), None, None)["user"]
+            assert user.username == "test"
+        assert "email" in user.get_deferred_fields()
+
+    def test_simplejwt_auth_token_middleware_inactive_user(self):
+        user = get_user_model().objects.create_user("inactive")
+        token_key = RefreshToken.for_user(user).access_token
+        user.is_active = False
+        user.save()
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), user_select_related=("profile",))
+        user = async_to_sync(mdwr)(
+            self._simplejwt_scope(token_key), None, None)["user"]
+        assert user.is_anonymous
+
+    def test_user_queryset_improperly_configured(self):
+        with self.assertRaises(ImproperlyConfigured):
+            DRFAuthTokenMiddleware(
+                MockConsumer(), user_only=("username",),
+                compact_user_fields=("username",))
+        with self.assertRaises(ImproperlyConfigured):
+            DRFAuthTokenMiddleware(
+                MockConsumer(), user_select_related=("profile",),
+                user_cache=TieredUserCache())
+        with self.assertRaises(ImproperlyConfigured):
+            ProfileDRFAuthTokenMiddleware(
+                MockConsumer(), compact_user_fields=("username",))
+        with self.assertRaises(ImproperlyConfigured):
+            SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), user_defer=("password",),
+                compact_user_fields=("username",))
+
+    @override_settings(SIMPLE_JWT={"CHECK_REVOKE_TOKEN": True})
+    def test_simplejwt_user_queryset_revoke_token(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), user_select_related=("profile",))
@@ -0,0 +1,175 @@
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import override_settings
+
+from rest_framework.authtoken.models import Token
+
+from channels_auth_token_middlewares.middleware import DRFAuthTokenMiddleware
+from channels_auth_token_middlewares.revocation import (
+    SCOPE_GROUPS_KEY, revoke_token, token_group, user_group,
+)
+
+from tests_app.consumer import (
+    MockConsumer, TestRevocableLazyWebsocketConsumer,
+    TestRevocableWebsocketConsumer,
+)
+
+from .base import BaseMiddlewaresTests
+
+
+class RevocationMiddlewaresTests(BaseMiddlewaresTests):
+
+    def setUp(self):
+        revocation = override_settings(
+            CHANNEL_LAYERS={
+                "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+            },
+            CHANNELS_AUTH_TOKEN_MIDDLEWARES_REVOCATION=True,
+        )
+        revocation.enable()
+        self.addCleanup(revocation.disable)
+        self.user = get_user_model().objects.create_user("revocable")
+        self.token = Token.objects.create(user=self.user)
+        self.other_token = Token.objects.create(
+            user=get_user_model().objects.create_user("other"))
+
+    async def _connect(self, token, consumer=TestRevocableWebsocketConsumer,
+                       **kwargs):
+        mdwr = DRFAuthTokenMiddleware(
+            consumer.as_asgi(), revocation_groups=True, **kwargs)
+        communicator = WebsocketCommunicator(mdwr, "/", headers=[
+            (b"authorization", f"Token {token.key}".encode()),
+        ])
+        connected, _ = await communicator.connect()
+        assert connected
+        return communicator
+
+    def _commit(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+
+    def _patch_group_send(self, **kwargs):
+        return mock.patch.object(get_channel_layer(), "group_send", **kwargs)
+
+    async def _assert_revoked(self, communicator):
+        assert await communicator.receive_output() == {
+            "type": "websocket.close", "code": 4001}
+        await communicator.disconnect()
+
+    async def _assert_not_revoked(self, communicator):
+        assert await communicator.receive_nothing()
+        await communicator.disconnect()
+
+    async def test_scope_groups(self):
+        mdwr = DRFAuthTokenMiddleware(MockConsumer(), revocation_groups=True)
+        scope = await mdwr({"headers": [
+            (b"authorization", f"Token {self.token.key}".encode()),
+        ]}, None, None)
+        assert scope[SCOPE_GROUPS_KEY] == [
+            token_group(self.token.key), user_group(self.user.pk)]
+        assert self.token.key not in token_group(self.token.key)
+
+        scope = await mdwr({"headers": [
+            (b"authorization", f"Token {'0' * 40}".encode()),
+        ]}, None, None)
+        assert SCOPE_GROUPS_KEY not in scope
+
+        mdwr = DRFAuthTokenMiddleware(MockConsumer())
+        scope = await mdwr({"headers": [
+            (b"authorization", f"Token {self.token.key}".encode()),
+        ]}, None, None)
+        assert SCOPE_GROUPS_KEY not in scope
+
+    async def test_token_deleted(self):
+        communicator = await self._connect(self.token)
+        other_communicator = await self._connect(self.other_token)
+        await database_sync_to_async(self._commit)(self.token.delete)
+        await self._assert_revoked(communicator)
+        await self._assert_not_revoked(other_communicator)
+
+    async def test_user_deactivated(self):
+        communicator = await self._connect(self.token)
+        other_communicator = await self._connect(self.other_token)
+
+        # active user change doesn't close connections
+        self.user.first_name = "Active"
+        await database_sync_to_async(self._commit)(self.user.save)
+        assert await communicator.receive_nothing()
+
+        self.user.is_active = False
+        await database_sync_to_async(self._commit)(self.user.save)
+        await self._assert_revoked(communicator)
+        await self._assert_not_revoked(other_communicator)
+
+    async def test_user_deleted(self):
+        communicator = await self._connect(self.token)
+        await database_sync_to_async(self._commit)(self.user.delete)
+        await self._assert_revoked(communicator)
+
+    async def test_lazy_user(self):
+        communicator = await self._connect(
+            self.token, consumer=TestRevocableLazyWebsocketConsumer,
+            lazy_user=True)
+        await database_sync_to_async(revoke_token)(self.token.key)
+        await self._assert_revoked(communicator)
+
+    async def test_disconnect_discards_groups(self):
+        communicator = await self._connect(self.token)
+        await communicator.disconnect()
+        channel_layer = get_channel_layer()
+        assert token_group(self.token.key) not in channel_layer.groups
+        assert user_group(self.user.pk) not in channel_layer.groups
+
+    def test_inactive_user_saved(self):
+        self.user.is_active = False
+        with self._patch_group_send() as group_send:
+            self._commit(self.user.save)
+            group_send.assert_called_once_with(
+                user_group(self.user.pk), {"type": "auth_token.revoked"})
+
+            # already inactive user changes don't revoke it again
+            self.user.first_name = "Inactive"
+            self._commit(self.user.save)
+            get_user_model().objects.create_user("new", is_active=False)
+            assert group_send.call_count == 1
+
+    def test_rolled_back(self):
+        def rolled_back():
+            with transaction.atomic():
+                self.token.delete()
+                self.user.is_active = False
+                self.user.save()
+                transaction.set_rollback(True)
+
+        with self._patch_group_send() as group_send:
+            self._commit(rolled_back)
+        group_send.assert_not_called()
+
+    def test_channel_layer_error(self):
+        with self._patch_group_send(side_effect=ConnectionError) as group_send:
+            with self.assertLogs(
+                "channels_auth_token_middlewares.revocation", "ERROR",
+            ):
+                self._commit(self.token.delete)
+        group_send.assert_called_once()
+        assert not Token.objects.filter(key=self.token.key).exists()
+
+    @override_settings(CHANNELS_AUTH_TOKEN_MIDDLEWARES_REVOCATION=False)
+    def test_disabled(self):
+        self.user.is_active = False
+        with self._patch_group_send() as group_send:
+            self._commit(self.user.save)
+            self._commit(self.token.delete)
+            self._commit(self.user.delete)
+        group_send.assert_not_called()
+
+    @override_settings(CHANNEL_LAYERS={})
+    def test_no_channel_layer(self):
+        self.token.delete()
+        self.user.delete()
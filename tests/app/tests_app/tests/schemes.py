@@ -0,0 +1,91 @@
+import asyncio
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.core.exceptions import ImproperlyConfigured
+
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddleware, SchemeAuthTokenMiddleware,
+    SimpleJWTAuthTokenMiddleware,
+)
+
+from tests_app.consumer import MockConsumer
+
+from .base import BaseMiddlewaresTests
+from .metrics import RecordingSink
+
+
+class SchemeMiddlewaresTests(BaseMiddlewaresTests):
+
+    def setUp(self):
+        self.drf = DRFAuthTokenMiddleware(None)
+        self.jwt = SimpleJWTAuthTokenMiddleware(None)
+
+    def _mdwr(self, **kwargs):
+        return SchemeAuthTokenMiddleware(
+            MockConsumer(),
+            schemes={"Token": self.drf, "Bearer": self.jwt}, **kwargs)
+
+    def _scope(self, value):
+        return {"headers": [(b"authorization", value.encode())]}
+
+    def test_dispatch(self):
+        mdwr = self._mdwr()
+        with mock.patch.object(
+            self.jwt, "get_user_instance", wraps=self.jwt.get_user_instance,
+        ) as get_jwt_user_instance:
+            with self.assertNumQueries(1):
+                scope = async_to_sync(mdwr)(
+                    self._scope(f"Token {self._drf_token_key}"), None, None)
+            assert scope["user"].id == 1
+            get_jwt_user_instance.assert_not_called()
+
+        with mock.patch.object(
+            self.drf, "get_user_instance", wraps=self.drf.get_user_instance,
+        ) as get_drf_user_instance:
+            scope = async_to_sync(mdwr)(
+                self._scope(f"Bearer {self._simplejwt_token_key}"), None, None)
+            assert scope["user"].id == 1
+            get_drf_user_instance.assert_not_called()
+
+    def test_not_matched(self):
+        mdwr = self._mdwr()
+        for value in (
+            f"Basic {self._drf_token_key}",
+            f"token {self._drf_token_key}",
+            "Token bad",
+            "Bearer",
+            "Token",
+            "",
+        ):
+            with self.assertNumQueries(0):
+                scope = async_to_sync(mdwr)(self._scope(value), None, None)
+            assert scope["user"].is_anonymous
+
+    def test_lazy_user(self):
+        mdwr = self._mdwr(lazy_user=True)
+        with self.assertNumQueries(0):
+            scope = async_to_sync(mdwr)(
+                self._scope(f"Token {self._drf_token_key}"), None, None)
+        with self.assertNumQueries(1):
+            assert async_to_sync(scope["auser"])().id == 1
+
+    def test_backend_options(self):
+        self.drf = DRFAuthTokenMiddleware(None, lookup_timeout=0.01)
+        sink = RecordingSink()
+        mdwr = self._mdwr(metrics_sink=sink)
+        with mock.patch.object(self.drf, "get_user_instance") as get_user_instance:
+            get_user_instance.side_effect = asyncio.TimeoutError
+            scope = async_to_sync(mdwr)(
+                self._scope(f"Token {self._drf_token_key}"), None, None)
+        assert scope["user"].is_anonymous
+
+        scope = async_to_sync(mdwr)(self._scope("Basic 1"), None, None)
+        assert scope["user"].is_anonymous
+        assert sink.outcomes == ["malformed"]
+
+    def test_improperly_configured(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SchemeAuthTokenMiddleware(MockConsumer())
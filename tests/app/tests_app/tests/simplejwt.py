@@ -0,0 +1,206 @@
+import threading
+
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from channels_auth_token_middlewares.claims import ClaimsUser, UserNotLoaded
+
+from channels_auth_token_middlewares.cache import TokenCache, invalidate_user
+from channels_auth_token_middlewares.middleware import (
+    SimpleJWTAuthTokenMiddleware,
+)
+
+from tests_app.consumer import MockConsumer
+
+from .base import BaseMiddlewaresTests
+
+
+class SimpleJWTValidationMiddlewaresTests(BaseMiddlewaresTests):
+
+    def patch_validation(self, mdwr):
+        auth = mdwr._auth
+        return mock.patch.object(
+            auth, "get_validated_token", wraps=auth.get_validated_token)
+
+    async def test_validate_on_loop(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), jwt_validate_on_loop=True)
+        threads = []
+        get_validated_token = mdwr._auth.get_validated_token
+
+        def validate(token_key):
+            threads.append(threading.get_ident())
+            return get_validated_token(token_key)
+
+        with mock.patch.object(mdwr._auth, "get_validated_token", validate):
+            user = await mdwr.get_user_instance(str(self._simplejwt_token_key))
+            wrong_user = await mdwr.get_user_instance("wrong_token_key")
+
+        assert user.id == 1
+        assert wrong_user is None
+        assert threads == [threading.get_ident()] * 2
+
+    async def test_token_cache(self):
+        token_cache = TokenCache()
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), jwt_token_cache=token_cache)
+        token_key = str(self._simplejwt_token_key)
+
+        with self.patch_validation(mdwr) as get_validated_token:
+            users = [await mdwr.get_user_instance(token_key) for _ in range(3)]
+            assert await mdwr.get_user_instance("wrong_token_key") is None
+            assert await mdwr.get_user_instance("wrong_token_key") is None
+
+        assert [user.id for user in users] == [1, 1, 1]
+        assert get_validated_token.call_count == 3
+        assert len(token_cache) == 1
+
+        invalidate_user(1)
+        assert len(token_cache) == 0
+
+    async def test_token_cache_ttl_until_exp(self):
+        now = [0]
+        token_cache = TokenCache(ttl=3600, timer=lambda: now[0])
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), jwt_token_cache=token_cache,
+            jwt_validate_on_loop=True)
+        token = AccessToken(str(self._simplejwt_token_key))
+        token.set_exp(lifetime=timedelta(seconds=60))
+        token_key = str(token)
+
+        with self.patch_validation(mdwr) as get_validated_token:
+            await mdwr.get_user_instance(token_key)
+            now[0] = 50
+            await mdwr.get_user_instance(token_key)
+            assert get_validated_token.call_count == 1
+            now[0] = 61
+            await mdwr.get_user_instance(token_key)
+            assert get_validated_token.call_count == 2
+
+    def _patch_blacklist_installed(self):
+        is_installed = apps.is_installed
+        return mock.patch.object(
+            apps, "is_installed", side_effect=lambda app_name: (
+                app_name == "rest_framework_simplejwt.token_blacklist"
+                or is_installed(app_name)))
+
+    @override_settings(SIMPLE_JWT={
+        "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.SlidingToken",),
+    })
+    def test_blacklisted_token_classes(self):
+        with self._patch_blacklist_installed():
+            # blacklist is checked by DB query, so tokens are validated
+            # in a thread and are not cached
+            for kwargs in (
+                {"jwt_validate_on_loop": True},
+                {"jwt_token_cache": TokenCache()},
+            ):
+                with self.assertRaises(ImproperlyConfigured):
+                    SimpleJWTAuthTokenMiddleware(MockConsumer(), **kwargs)
+            SimpleJWTAuthTokenMiddleware(MockConsumer())
+
+        # blacklist app is not installed
+        SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), jwt_validate_on_loop=True,
+            jwt_token_cache=TokenCache())
+
+    def test_not_blacklisted_token_classes(self):
+        with self._patch_blacklist_installed():
+            SimpleJWTAuthTokenMiddleware(
+                MockConsumer(), jwt_validate_on_loop=True,
+                jwt_token_cache=TokenCache())
+
+
+class ClaimsUserMiddlewaresTests(BaseMiddlewaresTests):
+
+    def get_scope(self):
+        return {"headers": [
+            (b"authorization", f"Bearer {self._simplejwt_token_key}".encode()),
+        ]}
+
+    async def test_claims_user(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(MockConsumer(), jwt_claims_user=True)
+        with mock.patch.object(
+            mdwr, "get_jwt_user", wraps=mdwr.get_jwt_user,
+        ) as get_jwt_user:
+            updated_scope = await mdwr(self.get_scope(), None, None)
+            user = updated_scope["user"]
+            assert isinstance(user._wrapped, ClaimsUser)
+            assert user.id == user.pk == 1
+            assert user.is_authenticated
+            assert user.token_type == "access"
+            assert not user.is_loaded
+            with self.assertRaises(AttributeError):
+                user.email
+            for attr in ("username", "is_staff", "is_superuser", "has_perm"):
+                with self.assertRaises(UserNotLoaded):
+                    getattr(user, attr)
+            get_jwt_user.assert_not_called()
+
+            users = [await user.aget_user(), await user.aget_user()]
+            get_jwt_user.assert_called_once()
+
+        assert users[0] is users[1]
+        assert users[0].id == 1
+        assert user.is_loaded
+        assert user.email == users[0].email
+        assert user.last_login == users[0].last_login
+        assert user.username == user.get_username() == users[0].username
+        assert user.is_staff is users[0].is_staff
+        assert user.is_superuser is users[0].is_superuser
+
+    def test_claims_user_queries(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), jwt_claims_user=True, jwt_validate_on_loop=True)
+        with self.assertNumQueries(0):
+            updated_scope = async_to_sync(mdwr)(self.get_scope(), None, None)
+            assert updated_scope["user"].id == 1
+        with self.assertNumQueries(1):
+            async_to_sync(updated_scope["user"].aget_user)()
+
+    async def test_claims_user_wrong_token(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(MockConsumer(), jwt_claims_user=True)
+        scope = {"headers": [(b"authorization", b"Bearer wrong_token_key")]}
+        updated_scope = await mdwr(scope, None, None)
+        assert updated_scope["user"].is_anonymous
+
+    async def test_claims_user_deleted_user(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(MockConsumer(), jwt_claims_user=True)
+        token = AccessToken(str(self._simplejwt_token_key))
+        token["user_id"] = "2"
+        scope = {"headers": [(b"authorization", f"Bearer {token}".encode())]}
+        updated_scope = await mdwr(scope, None, None)
+        assert updated_scope["user"].id == 2
+        assert await updated_scope["user"].aget_user() is None
+        with self.assertRaises(AttributeError):
+            updated_scope["user"].email
+        assert not updated_scope["user"].is_staff
+        assert not updated_scope["user"].has_perm("auth.add_user")
+
+    def test_claims_user_inactive_user(self):
+        user = get_user_model().objects.create_user(
+            "inactive", is_superuser=True)
+        token = AccessToken.for_user(user)
+        user.is_active = False
+        user.save()
+        mdwr = SimpleJWTAuthTokenMiddleware(MockConsumer(), jwt_claims_user=True)
+        scope = {"headers": [(b"authorization", f"Bearer {token}".encode())]}
+        updated_scope = async_to_sync(mdwr)(scope, None, None)
+        # token is trusted until user instance is loaded
+        assert updated_scope["user"].is_authenticated
+        assert async_to_sync(updated_scope["user"].aget_user)() is None
+        assert not updated_scope["user"].is_superuser
+
+    @override_settings(SIMPLE_JWT={"CHECK_REVOKE_TOKEN": True})
+    def test_claims_user_revoke_token(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SimpleJWTAuthTokenMiddleware(MockConsumer(), jwt_claims_user=True)
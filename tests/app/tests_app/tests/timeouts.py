@@ -0,0 +1,126 @@
+import asyncio
+
+from channels.testing import WebsocketCommunicator
+
+from django.core.exceptions import ImproperlyConfigured
+
+from channels_auth_token_middlewares.cache import TokenCache
+from channels_auth_token_middlewares.middleware import UserLookupTimeout
+
+from tests_app.consumer import MockConsumer, TestWebsocketConsumer
+from tests_app.middleware import TestHeaderAuthTokenMiddleware
+
+from .base import BaseMiddlewaresTests
+from .metrics import RecordingSink
+
+
+class SlowHeaderAuthTokenMiddleware(TestHeaderAuthTokenMiddleware):
+
+    delay = 0
+
+    async def get_user_instance(self, token_key):
+        await asyncio.sleep(self.delay)
+        return await super().get_user_instance(token_key)
+
+
+class LookupTimeoutMiddlewaresTests(BaseMiddlewaresTests):
+
+    def _scope(self, user_id=1):
+        return {"headers": [
+            (b"test-authorization", f"Id {user_id}".encode())
+        ]}
+
+    async def test_in_time(self):
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=1, lookup_timeout_policy="reject")
+        assert (await mdwr(self._scope(), None, None))["user"].id == 1
+
+    async def test_anonymous_policy(self):
+        sink = RecordingSink()
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.01, metrics_sink=sink)
+        mdwr.delay = 1
+        assert (await mdwr(self._scope(), None, None))["user"].is_anonymous
+        assert sink.outcomes == ["timeout"]
+        assert sink.timings[-1] == "user_instance"
+
+    async def test_reject_policy(self):
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.01, lookup_timeout_policy="reject")
+        mdwr.delay = 1
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        # inner application is not called
+        scope = {"type": "websocket", **self._scope()}
+        assert await mdwr(scope, None, send) is None
+        assert messages == [{"type": "websocket.close", "code": 1013}]
+
+        messages.clear()
+        assert await mdwr({"type": "http", **self._scope()}, None, send) is None
+        assert [message["type"] for message in messages] == [
+            "http.response.start", "http.response.body"]
+        assert messages[0]["status"] == 403
+
+        with self.assertRaises(UserLookupTimeout):
+            await mdwr(self._scope(), None, None)
+
+    async def test_reject_policy_websocket_communicator(self):
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            TestWebsocketConsumer(), lookup_timeout=0.01,
+            lookup_timeout_policy="reject")
+        mdwr.delay = 1
+        communicator = WebsocketCommunicator(
+            mdwr, "/test/", headers=self._scope()["headers"])
+        connected, code = await communicator.connect()
+        assert not connected
+        assert code == 1013
+
+    async def test_reject_policy_lazy_user(self):
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.01, lookup_timeout_policy="reject",
+            lazy_user=True)
+        mdwr.delay = 1
+        scope = await mdwr(self._scope(), None, None)
+        with self.assertRaises(UserLookupTimeout):
+            await scope["auser"]()
+
+    async def test_stale_policy(self):
+        stale_user_cache = TokenCache(maxsize=8, ttl=60)
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.05, lookup_timeout_policy="stale",
+            stale_user_cache=stale_user_cache)
+        assert (await mdwr(self._scope(), None, None))["user"].id == 1
+        assert len(stale_user_cache) == 1
+
+        mdwr.delay = 1
+        assert (await mdwr(self._scope(), None, None))["user"].id == 1
+        # nothing remembered for other token keys
+        assert (await mdwr(self._scope(2), None, None))["user"].is_anonymous
+
+    async def test_timeout_not_rejected(self):
+        rejected_token_cache = TokenCache(maxsize=8, ttl=60)
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.01,
+            rejected_token_cache=rejected_token_cache)
+        mdwr.delay = 1
+        assert (await mdwr(self._scope(), None, None))["user"].is_anonymous
+        assert len(rejected_token_cache) == 0
+
+    async def test_coalesced_lookup_timeout(self):
+        mdwr = SlowHeaderAuthTokenMiddleware(
+            MockConsumer(), lookup_timeout=0.05, coalesce_lookups=True)
+        mdwr.delay = 0.1
+        scopes = await asyncio.gather(
+            mdwr(self._scope(), None, None), mdwr(self._scope(), None, None))
+        assert all(scope["user"].is_anonymous for scope in scopes)
+
+    def test_improperly_configured(self):
+        with self.assertRaises(ImproperlyConfigured):
+            TestHeaderAuthTokenMiddleware(
+                MockConsumer(), lookup_timeout=1, lookup_timeout_policy="wait")
+        with self.assertRaises(ImproperlyConfigured):
+            TestHeaderAuthTokenMiddleware(
+                MockConsumer(), lookup_timeout=1, lookup_timeout_policy="stale")
@@ -0,0 +1,106 @@
+import pickle
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from channels_auth_token_middlewares.cache import TieredUserCache, TokenCache
+from channels_auth_token_middlewares.middleware import (
+    DRFAuthTokenMiddleware, DRFAuthTokenMiddlewareStack,
+    SimpleJWTAuthTokenMiddleware,
+)
+from channels_auth_token_middlewares.users import (
+    CompactUser, compact_user_class,
+)
+
+from tests_app.consumer import MockConsumer
+
+from .base import BaseMiddlewaresTests
+
+
+class CompactUserTests(SimpleTestCase):
+
+    def test_compact_user_class(self):
+        User = get_user_model()
+        user_class = compact_user_class(["username", "id", "is_staff"])
+        assert user_class is compact_user_class(["username", "id", "is_staff"])
+        assert issubclass(user_class, CompactUser)
+        assert user_class.fields == ("id", "username", "is_staff")
+
+        user = user_class.from_user(User(id=3, username="test", is_staff=True))
+        assert user.pk == user.id == 3
+        assert user.username == str(user) == user.get_username() == "test"
+        assert user.is_staff
+        assert user.is_authenticated and not user.is_anonymous
+        assert user == user_class(3, "other", False)
+        assert hash(user) == hash(3)
+        assert not hasattr(user, "__dict__")
+        with self.assertRaises(AttributeError):
+            user.email
+        with self.assertRaises(AttributeError):
+            user.username = "other"
+
+    def test_compact_user_class_unknown_field(self):
+        with self.assertRaises(FieldDoesNotExist):
+            compact_user_class(["unknown"])
+
+    def test_compact_user_class_pickle(self):
+        user_class = compact_user_class(["username"])
+        with self.assertRaises((TypeError, pickle.PicklingError)):
+            pickle.dumps(user_class(1, "test"))
+
+
+class CompactUserMiddlewaresTests(BaseMiddlewaresTests):
+
+    def assert_compact_user(self, user):
+        assert isinstance(user, CompactUser)
+        assert user.fields == ("id", "username")
+        assert user.id == 1
+        assert user.username == "test"
+
+    def test_drf_compact_user(self):
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), compact_user_fields=["username"])
+        with self.assertNumQueries(1) as queries:
+            user = async_to_sync(mdwr.get_user_instance)(self._drf_token_key)
+        self.assert_compact_user(user)
+        sql = queries.captured_queries[0]["sql"]
+        assert "password" not in sql and "email" not in sql
+        assert async_to_sync(mdwr.get_user_instance)("0" * 40) is None
+
+    def test_drf_compact_user_batching(self):
+        mdwr = DRFAuthTokenMiddlewareStack(
+            MockConsumer(), compact_user_fields=["username"], batch_window=0)
+        with self.assertNumQueries(1):
+            user = async_to_sync(mdwr.get_user_instance)(self._drf_token_key)
+        self.assert_compact_user(user)
+
+    def test_drf_compact_user_cache(self):
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), compact_user_fields=["username"],
+            user_cache=TokenCache())
+        with self.assertNumQueries(1):
+            users = [
+                async_to_sync(mdwr.get_user_instance)(self._drf_token_key)
+                for _ in range(2)
+            ]
+        assert users[0] is users[1]
+        self.assert_compact_user(users[0])
+
+    def test_simplejwt_compact_user(self):
+        mdwr = SimpleJWTAuthTokenMiddleware(
+            MockConsumer(), compact_user_fields=["username"])
+        user = async_to_sync(mdwr.get_user_instance)(
+            str(self._simplejwt_token_key))
+        self.assert_compact_user(user)
+
+    def test_compact_user_tiered_user_cache(self):
+        for middleware_class in [
+            DRFAuthTokenMiddleware, SimpleJWTAuthTokenMiddleware,
+        ]:
+            with self.assertRaises(ImproperlyConfigured):
+                middleware_class(
+                    MockConsumer(), compact_user_fields=["username"],
+                    user_cache=TieredUserCache())
@@ -0,0 +1,151 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from channels_auth_token_middlewares import warming
+from channels_auth_token_middlewares.cache import TieredUserCache, TokenCache
+from channels_auth_token_middlewares.middleware import DRFAuthTokenMiddleware
+from channels_auth_token_middlewares.warming import (
+    start_cache_warming, warm_user_cache,
+)
+
+from tests_app.consumer import MockConsumer
+
+from .base import BaseMiddlewaresTests
+
+
+# warmed by the app ready hook test
+warmed_cache = TokenCache()
+
+
+class CacheWarmingTests(BaseMiddlewaresTests):
+
+    def setUp(self):
+        caches["default"].clear()
+        User = get_user_model()
+        now = timezone.now()
+        self.tokens = [
+            Token.objects.create(user=User.objects.create_user(
+                f"warm_{i}", last_login=now - timedelta(days=i)))
+            for i in range(3)
+        ]
+
+    def _scope(self, token_key):
+        return {"headers": [
+            (b"authorization", f"Token {token_key}".encode())
+        ]}
+
+    def test_command(self):
+        stdout = StringIO()
+        # tokens are streamed by one query
+        with self.assertNumQueries(1):
+            call_command(
+                "warm_auth_token_cache", chunk_size=2, stdout=stdout)
+        assert stdout.getvalue().startswith("Warmed 4 tokens")
+
+        mdwr = DRFAuthTokenMiddleware(
+            MockConsumer(), user_cache=TieredUserCache())
+        with self.assertNumQueries(0):
+            for token in self.tokens:
+                user = async_to_sync(mdwr)(
+                    self._scope(token.key), None, None)["user"]
+                assert user.id == token.user_id
+                assert user.username == token.user.username
+
+    def test_command_recently_used(self):
+        call_command(
+            "warm_auth_token_cache", recently_used=36 * 3600, stdout=StringIO())
+        cache = TieredUserCache()
+        shared = caches["default"]
+        warmed = [
+            shared.get(cache.make_token_key(token.key)) for token in self.tokens
+        ]
+        assert warmed == [self.tokens[0].user_id, self.tokens[1].user_id, None]
+        assert shared.get(cache.make_token_key(self._drf_token_key)) is None
+
+    def test_command_budget(self):
+        stdout = StringIO()
+        call_command("warm_auth_token_cache", max_entries=1, stdout=stdout)
+        assert stdout.getvalue().startswith("Warmed 1 tokens")
+
+        # most recently logged in users are warmed first
+        warmed = warm_user_cache(TieredUserCache(), max_entries=2)
+        cache = TieredUserCache()
+        assert caches["default"].get(
+            cache.make_token_key(self.tokens[0].key)) == self.tokens[0].user_id
+
+        warmed = warm_user_cache(TieredUserCache(), max_bytes=warmed["bytes"])
+        assert warmed["entries"] == 2
+        warmed = warm_user_cache(TieredUserCache(), max_bytes=0)
+        assert warmed == {"entries": 0, "bytes": 0}
+
+    def test_command_not_tiered_cache(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "warm_auth_token_cache",
+                cache="tests_app.tests.warming.warmed_cache", stdout=StringIO())
+
+    def test_local_tier(self):
+        cache = TokenCache(maxsize=2)
+        warmed = warm_user_cache(cache, tier="local")
+        assert warmed["entries"] == 2
+        assert cache.get(self.tokens[0].key).id == self.tokens[0].user_id
+
+        cache = TieredUserCache()
+        warm_user_cache(cache, tier="local", max_entries=1)
+        assert len(cache.local) == 1
+        assert caches["default"].get(
+            cache.make_token_key(self.tokens[0].key)) is None
+
+        # warmed entries are invalidated like other ones
+        self.tokens[0].user.save()
+        assert cache.local.get(self.tokens[0].key) is None
+
+    def _start_threads(self):
+        threads = []
+        patcher = mock.patch(
+            "channels_auth_token_middlewares.warming.threading.Thread.start",
+            autospec=True, side_effect=threads.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return threads
+
+    def test_start_cache_warming(self):
+        threads = self._start_threads()
+        cache = TokenCache()
+        assert start_cache_warming(cache, recently_used=3600) is threads[0]
+        assert threads[0].daemon
+        threads[0].run()
+        assert len(cache) == 1
+
+    @override_settings(CHANNELS_AUTH_TOKEN_MIDDLEWARES_WARM_CACHE={
+        "cache": "tests_app.tests.warming.warmed_cache", "max_entries": 2,
+    })
+    def test_app_ready_hook(self):
+        patcher = mock.patch.object(
+            warming, "_configured_warming_started", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with mock.patch.object(
+            warming, "start_cache_warming",
+        ) as start_cache_warming:
+            app_config = apps.get_app_config("channels_auth_token_middlewares")
+            for _ in range(2):
+                app_config.ready()
+        start_cache_warming.assert_called_once_with(
+            cache="tests_app.tests.warming.warmed_cache", max_entries=2)
+
+        warming._warm_cache(**start_cache_warming.call_args.kwargs)
+        assert len(warmed_cache) == 2